@@ -0,0 +1,68 @@
+"""Long-running FontForge worker, run with `fontforge -lang=py -script`.
+
+Reads commands from stdin, one per line. Each line is a command name,
+optionally followed by a space and a JSON-encoded string argument:
+
+  Open "<path>"
+  CIDFlatten
+  Generate "<path>"
+  Close
+
+Exactly one reply line is written for every command, either `ok` or `error`
+followed by a space and a JSON-encoded message. A line reading `ready` is
+written once at startup, before any command is read.
+"""
+
+import sys
+import os
+import json
+
+import fontforge
+
+def run_command(font, name, arg):
+    if name == 'Open':
+        return fontforge.open(arg)
+    if font is None:
+        if name == 'Close':
+            return None
+        raise ValueError('no font is open')
+    if name == 'CIDFlatten':
+        # CIDFlatten flattens CID-based fonts (e.g. otf) with multiple
+        # sub-fonts into one single font.
+        # See https://github.com/bdusell/webfont-generator/issues/20
+        if font.is_cid:
+            font.cidFlatten()
+    elif name == 'Generate':
+        font.generate(arg)
+    elif name == 'Close':
+        font.close()
+        return None
+    else:
+        raise ValueError('unknown command %r' % name)
+    return font
+
+def main():
+    # Replies are written to the original stdout. Anything FontForge itself
+    # prints is redirected to stderr so that it cannot corrupt the replies.
+    replies = os.fdopen(os.dup(1), 'w')
+    os.dup2(2, 1)
+    replies.write('ready\n')
+    replies.flush()
+    font = None
+    while True:
+        line = sys.stdin.readline()
+        if not line:
+            break
+        name, _, arg = line.rstrip('\n').partition(' ')
+        if name == 'Open' and font is not None:
+            font.close()
+            font = None
+        try:
+            font = run_command(font, name, json.loads(arg) if arg else None)
+        except Exception as e:
+            replies.write('error %s\n' % json.dumps(str(e)))
+        else:
+            replies.write('ok\n')
+        replies.flush()
+
+main()
@@ -6,6 +6,8 @@ import java.util.LinkedList;
 import java.util.List;
 import java.util.ArrayList;
 import java.io.PrintStream;
+import java.io.BufferedReader;
+import java.io.InputStreamReader;
 import java.io.InputStream;
 import java.io.FileInputStream;
 import java.io.OutputStream;
@@ -85,6 +87,7 @@ public class ConvertFont {
 			String inputFileName = null;
 			List<String> outputFileNames = new ArrayList<String>();
 			String selectString = null;
+			boolean serverMode = false;
 
 			String arg;
 			while((arg = args.poll()) != null) {
@@ -102,6 +105,8 @@ public class ConvertFont {
 					if(selectString == null) {
 						throw new UsageError();
 					}
+				} else if(arg.equals("--server")) {
+					serverMode = true;
 				} else if(arg.equals("-h") || arg.equals("--help")) {
 					showHelp(System.out);
 					System.exit(0);
@@ -112,12 +117,6 @@ public class ConvertFont {
 				}
 			}
 
-			if(inputFileName == null) {
-				throw new UsageError();
-			}
-			if(outputFileNames.isEmpty()) {
-				throw new UsageError();
-			}
 			int fontSelection = 0;
 			if(selectString != null) {
 				fontSelection = Integer.parseInt(selectString) - 1;
@@ -126,55 +125,24 @@ public class ConvertFont {
 				}
 			}
 
-			/* Arguments have been checked. */
-
-			/* Check the output formats. */
-			List<FontConverter> converters = new ArrayList<FontConverter>(outputFileNames.size());
-			for(String outputFileName : outputFileNames) {
-				/* Choose the output format based on the file extension. */
-				String ext = getExtension(outputFileName);
-				if(ext == null) {
-					throw new Error("output format for " + outputFileName +
-						" not recognized");
-				}
-				FontConverter converter = getFontConverter(ext);
-				if(converter == null) {
-					throw new Error("output format " + ext + " not recognized");
+			if(serverMode) {
+				if(inputFileName != null || !outputFileNames.isEmpty()) {
+					throw new UsageError();
 				}
-				converters.add(converter);
+				serve(fontSelection);
+				return;
 			}
 
-			/* Open the input file. */
-			InputStream fin = null;
-			fin = new FileInputStream(inputFileName);
-
-			try {
-				/* Read the fonts from the input file. */
-				FontFactory fontFactory = FontFactory.getInstance();
-				Font[] allFonts = fontFactory.loadFonts(fin);
+			if(inputFileName == null) {
+				throw new UsageError();
+			}
+			if(outputFileNames.isEmpty()) {
+				throw new UsageError();
+			}
 
-				Font inputFont;
-				if(fontSelection < allFonts.length) {
-					inputFont = allFonts[fontSelection];
-				} else {
-					throw new Error("selection " + (fontSelection + 1) + " not found in " + inputFileName);
-				}
+			/* Arguments have been checked. */
 
-				for(int i = 0, n = outputFileNames.size(); i < n; ++i) {
-					/* Convert the font. */
-					WritableFontData data = converters.get(i).convert(inputFont);
-					/* Open the output file. */
-					OutputStream fout = new FileOutputStream(outputFileNames.get(i));
-					try {
-						/* Write the data to the output file. */
-						data.copyTo(fout);
-					} finally {
-						fout.close();
-					}
-				}
-			} finally {
-				fin.close();
-			}
+			convert(inputFileName, outputFileNames, fontSelection);
 		} catch(UsageError e) {
 			showHelp(System.err);
 			System.exit(1);
@@ -187,9 +155,92 @@ public class ConvertFont {
 		}
 	}
 
+	/* Convert one input file to the given output files. */
+	private static void convert(String inputFileName, List<String> outputFileNames,
+			int fontSelection) throws Error, IOException {
+
+		/* Check the output formats. */
+		List<FontConverter> converters = new ArrayList<FontConverter>(outputFileNames.size());
+		for(String outputFileName : outputFileNames) {
+			/* Choose the output format based on the file extension. */
+			String ext = getExtension(outputFileName);
+			if(ext == null) {
+				throw new Error("output format for " + outputFileName +
+					" not recognized");
+			}
+			FontConverter converter = getFontConverter(ext);
+			if(converter == null) {
+				throw new Error("output format " + ext + " not recognized");
+			}
+			converters.add(converter);
+		}
+
+		/* Open the input file. */
+		InputStream fin = null;
+		fin = new FileInputStream(inputFileName);
+
+		try {
+			/* Read the fonts from the input file. */
+			FontFactory fontFactory = FontFactory.getInstance();
+			Font[] allFonts = fontFactory.loadFonts(fin);
+
+			Font inputFont;
+			if(fontSelection < allFonts.length) {
+				inputFont = allFonts[fontSelection];
+			} else {
+				throw new Error("selection " + (fontSelection + 1) + " not found in " + inputFileName);
+			}
+
+			for(int i = 0, n = outputFileNames.size(); i < n; ++i) {
+				/* Convert the font. */
+				WritableFontData data = converters.get(i).convert(inputFont);
+				/* Open the output file. */
+				OutputStream fout = new FileOutputStream(outputFileNames.get(i));
+				try {
+					/* Write the data to the output file. */
+					data.copyTo(fout);
+				} finally {
+					fout.close();
+				}
+			}
+		} finally {
+			fin.close();
+		}
+	}
+
+	/* Serve conversion requests read from stdin, one per line. Each request
+	 * is an input file name followed by one or more output file names,
+	 * separated by tabs. Exactly one reply line is written to stdout for each
+	 * request, either "ok" or "error" followed by a space and a message.
+	 * Keeping one JVM around for many fonts avoids paying for JVM startup and
+	 * class loading on every conversion. */
+	private static void serve(int fontSelection) throws IOException {
+		BufferedReader in = new BufferedReader(new InputStreamReader(System.in, "UTF-8"));
+		PrintStream out = new PrintStream(System.out, false, "UTF-8");
+		String line;
+		while((line = in.readLine()) != null) {
+			List<String> fileNames = Arrays.asList(line.split("\t", -1));
+			String reply;
+			if(fileNames.size() < 2) {
+				reply = "error expected an input file and at least one output file";
+			} else {
+				try {
+					convert(fileNames.get(0), fileNames.subList(1, fileNames.size()),
+						fontSelection);
+					reply = "ok";
+				} catch(Exception e) {
+					reply = "error " + String.valueOf(e.getMessage()).replace('\n', ' ');
+				}
+			}
+			out.print(reply + "\n");
+			out.flush();
+		}
+	}
+
 	private static void showHelp(PrintStream out) {
 		out.print(
 			"Usage: java ConvertFont <input-file> -o <output-file>\n" +
+			"       java ConvertFont --server\n" +
 			"\n" +
 			"  Convert a TTF font file to WOFF and/or EOT.\n" +
 			"\n" +
@@ -206,6 +257,11 @@ public class ConvertFont {
 			"  -s --select <integer>\n" +
 			"                When reading a font with multiple font definitions, selects the\n" +
 			"                nth font in the file. By default, selects the first font.\n" +
+			"  --server      Rather than converting one input file, read conversion\n" +
+			"                requests from stdin, one per line. Each request is an input\n" +
+			"                file name followed by one or more output file names,\n" +
+			"                separated by tabs. One line is written to stdout for each\n" +
+			"                request: `ok`, or `error` followed by a message.\n" +
 			"  -h --help     This help message.\n"
 		);
 	}
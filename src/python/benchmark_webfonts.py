@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+import sys
+import os
+import os.path
+import shutil
+import logging
+import tempfile
+
+from webfont_generator.util import parse_count
+from webfont_generator.error import Error
+from webfont_generator.dependencies import FORMATS_SET, ENGINES
+from webfont_generator.family import parse_engines
+from webfont_generator.benchmark import (SYNTHETIC_FONTS, DEFAULT_FORMAT_SETS,
+    run_benchmarks, write_results, read_results, compare_results)
+
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 0.1
+
+def usage(out):
+    out.write('''\
+Usage: benchmark-webfonts [options] [-o <results.json>]
+       benchmark-webfonts --compare <old.json> <new.json> [--threshold <t>]
+
+  Time every conversion path of generate-webfonts on synthetic fonts of
+  various sizes, or compare the results of two benchmark runs.
+
+Options:
+  -o --output <file>
+                Write the results as JSON to the given file. Default is
+                stdout.
+  --fonts <fonts>
+                Comma-separated list of synthetic fonts to benchmark.
+                Possible fonts are:
+                  latin       200 glyphs
+                  latin-ext   1,000 glyphs
+                  large       5,000 glyphs
+                  cjk         30,000 glyphs
+                The default is all of them.
+  -f --format <formats>
+                Comma-separated list of output formats for which to time a
+                full conversion. May be given more than once. The defaults
+                are: eot,woff2,woff,ttf,svg; woff2,woff; and woff2
+  --engines <engines>
+                Comma-separated list of converters to benchmark, as for
+                generate-webfonts. The default is all of them.
+  -r --repeat <n>
+                Number of times to run each benchmark. The median of the runs
+                is reported. Default is 3.
+  --threads <n>
+                Number of threads used for full conversions. Default is the
+                number of CPUs.
+  --cold        Restart the persistent FontForge and sfntly processes before
+                every run, so that their startup time is included. By
+                default they are started by an untimed warm-up run.
+  --work-dir <dir>
+                Directory for the synthetic fonts and converted files. They
+                are kept afterwards. Default is a temporary directory, which
+                is removed.
+  --compare <old.json> <new.json>
+                Rather than running benchmarks, print how the wall time of
+                each benchmark changed between two runs, and exit with status
+                1 if any became slower by more than the threshold.
+  --threshold <t>
+                Fraction by which a benchmark may become slower before it is
+                reported as a regression. Default is 0.1.
+  --verbose     Show verbose output while running.
+  -h --help     Show this help message.
+''')
+
+def main():
+    # Parse command line arguments
+    output_file_name = None
+    fonts_str = None
+    format_sets = []
+    engines_str = None
+    repeat_str = None
+    threads_str = None
+    cold = False
+    work_dir = None
+    compare_file_names = None
+    threshold_str = None
+    be_verbose = False
+    args = sys.argv[:0:-1]
+    while args:
+        arg = args.pop()
+        if arg == '-o' or arg == '--output':
+            output_file_name = args.pop()
+        elif arg == '--fonts':
+            fonts_str = args.pop()
+        elif arg == '-f' or arg == '--format':
+            format_sets.append(args.pop())
+        elif arg == '--engines':
+            engines_str = args.pop()
+        elif arg == '-r' or arg == '--repeat':
+            repeat_str = args.pop()
+        elif arg == '--threads':
+            threads_str = args.pop()
+        elif arg == '--cold':
+            cold = True
+        elif arg == '--work-dir':
+            work_dir = args.pop()
+        elif arg == '--compare':
+            compare_file_names = (args.pop(), args.pop())
+        elif arg == '--threshold':
+            threshold_str = args.pop()
+        elif arg == '--verbose':
+            be_verbose = True
+        elif arg == '-h' or arg == '--help':
+            usage(sys.stdout)
+            sys.exit(0)
+        else:
+            usage(sys.stderr)
+            sys.exit(1)
+    try:
+        if threshold_str is None:
+            threshold = DEFAULT_THRESHOLD
+        else:
+            try:
+                threshold = float(threshold_str)
+            except ValueError:
+                raise Error('Invalid threshold: %r' % threshold_str)
+        if fonts_str is None:
+            font_names = list(SYNTHETIC_FONTS)
+        else:
+            font_names = fonts_str.split(',')
+            for font_name in font_names:
+                if font_name not in SYNTHETIC_FONTS:
+                    raise Error('Unrecognized font: %r' % font_name)
+        format_sets = [s.split(',') for s in format_sets] or DEFAULT_FORMAT_SETS
+        for formats in format_sets:
+            for f in formats:
+                if f not in FORMATS_SET:
+                    raise Error('Unrecognized format: %r' % f)
+        if engines_str is None:
+            engines_str = ','.join(ENGINES)
+        engines = parse_engines(engines_str)
+        if repeat_str is None:
+            repeat = DEFAULT_REPEAT
+        else:
+            repeat = parse_count(repeat_str, 'repeats')
+        if threads_str is None:
+            threads = os.cpu_count() or 1
+        else:
+            threads = parse_count(threads_str, 'threads')
+    except Error as e:
+        print('%s\n' % e, file=sys.stderr)
+        usage(sys.stderr)
+        sys.exit(1)
+    if compare_file_names is not None:
+        try:
+            old_results, new_results = map(read_results, compare_file_names)
+        except (OSError, ValueError, KeyError) as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+        num_regressions = compare_results(sys.stdout, old_results,
+            new_results, threshold)
+        if num_regressions:
+            print('%d benchmarks became slower by more than %g%%' % (
+                num_regressions, threshold * 100), file=sys.stderr)
+            sys.exit(1)
+        sys.exit(0)
+    # Configure the logger for verbosity
+    logger = logging.getLogger('webfont-generator')
+    logger.addHandler(logging.StreamHandler())
+    if be_verbose:
+        logger.setLevel(logging.INFO)
+    else:
+        logger.setLevel(logging.WARNING)
+    remove_work_dir = work_dir is None
+    if remove_work_dir:
+        work_dir = tempfile.mkdtemp(prefix='webfont-benchmark-')
+    try:
+        results = run_benchmarks(work_dir, font_names, format_sets, engines,
+            threads, repeat, cold, logger)
+    except Error as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if remove_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    settings = {
+        'fonts' : font_names,
+        'format_sets' : format_sets,
+        'engines' : sorted(engines),
+        'repeat' : repeat,
+        'threads' : threads,
+        'cold' : cold
+    }
+    if output_file_name is None or output_file_name == '-':
+        write_results(sys.stdout, results, settings)
+    else:
+        with open(output_file_name, 'w') as fout:
+            write_results(fout, results, settings)
+
+if __name__ == '__main__':
+    main()
@@ -1,25 +1,61 @@
 #!/usr/bin/env python
 
 import sys
+import contextlib
 import os
 import os.path
 import logging
 
-from webfont_generator.util import remove_suffix
+from webfont_generator.util import parse_size, parse_count
 from webfont_generator.error import Error
-from webfont_generator.operations import FontFile
 from webfont_generator.dependencies import (
-    FORMATS_SET, convert_files, construct_dependency_graph, make_file_dicts)
+    construct_dependency_graph, make_file_dicts)
 from webfont_generator.graph import depth_first_traversal
-from webfont_generator.css import generate_css
+from webfont_generator.family import (
+    input_font_files, parse_output_formats, parse_engines,
+    parse_font_display, apply_browser_profile, generate_family,
+    ConversionOptions)
+from webfont_generator.batch import read_manifest_file, convert_families
+from webfont_generator.cache import ConversionCache, DEFAULT_MAX_SIZE
+from webfont_generator.profile import Profiler, PROFILE_FORMATS
+from webfont_generator.costs import CostModel
+from webfont_generator.subset import parse_subsets, read_frequency_file
+from webfont_generator.precompress import parse_encodings
+from webfont_generator.buildplan import (STEP_OPERATIONS, plan_family,
+    write_ninja, write_plan_json)
+from webfont_generator.watch import make_watcher, watch
+from webfont_generator.spool import (Spool, job_options, run_worker,
+    wait_for_batch, DEFAULT_STALE_AFTER, DEFAULT_POLL_INTERVAL, MAX_ATTEMPTS)
+from webfont_generator.server import (ConversionService, ConversionServer,
+    DEFAULT_QUEUE_SIZE, DEFAULT_MAX_UPLOAD_SIZE)
 
 VERSION = '1.3.2'
 
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8000
+
 def usage(out):
     out.write('''\
 Usage: generate-webfonts [options] <input-file> -o <output-dir> ...
+       generate-webfonts [options] --batch <manifest> -o <output-dir>
+       generate-webfonts --cache <dir> --prune-cache [--cache-size <size>]
+       generate-webfonts serve [options]
+       generate-webfonts step <operation> <input-file> ... -- <output-file> ...
+       generate-webfonts submit --spool <dir> [options] --batch <manifest> -o <output-dir>
+       generate-webfonts worker --spool <dir> [options]
+       generate-webfonts collect --spool <dir> <batch-id>
+
+  Convert font files to web-friendly font formats. The serve command runs an
+  HTTP conversion service; see `generate-webfonts serve --help`. The step
+  command runs a single conversion of a plan written by --emit-ninja or
+  --emit-plan; see `generate-webfonts step --help`.
 
-  Convert font files to web-friendly font formats.
+  The submit command queues the families of a batch as jobs in a spool
+  directory, with the same options as --batch, and prints the ID of the batch.
+  Workers on any machine which shares the directory convert them; see
+  `generate-webfonts worker --help`. The collect command waits for a batch to
+  finish and reports the families which failed; see
+  `generate-webfonts collect --help`.
 
 Arguments:
   <input-file> ...
@@ -52,7 +88,155 @@ Options:
                 of the output directory.
   --font-family <name>
                 Name of the font family used in the CSS file. Default is the
-                base name of the first input file.
+                family name recorded in the input files, or the base name of
+                the first input file if they record none.
+  --font-display <value>
+                Value of the font-display descriptor of every @font-face
+                rule, which controls how text is shown while the font loads:
+                auto, block, swap, fallback or optional. Omitted by default.
+  --preload <file>
+                Name of a generated HTML file of <link rel="preload"> tags
+                for the best format of every face, to put in the <head> of
+                pages which use the fonts. Use `-` for stdout.
+  --inline-under <size>
+                Inline the first format which is not inlined already, other
+                than eot and svg, if its data URL would be smaller than the
+                given number of bytes, optionally suffixed with K or M.
+                Inlining a tiny font saves a request, but a large one delays
+                every page which uses the CSS.
+  --browsers <profile>
+                Leave out the output formats which no browser in a profile
+                needs. Possible profiles are:
+                  all         Every browser (default)
+                  modern      Browsers which support woff, which leaves out
+                              eot and svg
+                  evergreen   Current browsers, which leaves out all but the
+                              best format: woff2, woff, ttf or otf
+  --batch <manifest>
+                Convert many font families in one run. Every non-blank line
+                of the manifest file lists the input files of one font
+                family, and may use glob patterns. Relative paths are relative
+                to the manifest. Each family is written to a subdirectory of
+                the output directory named after its first input file, and
+                CSS, if requested, is written to a file with the name given by
+                --css in that subdirectory. A family that fails to convert is
+                reported without stopping the rest of the batch.
+  -j --jobs <n>
+                Number of worker processes used to convert families in batch
+                mode. Default is the number of CPUs.
+  --threads <n>
+                Maximum number of independent conversions to run at the same
+                time for each font family. Default is the number of CPUs, or,
+                in batch mode, the number of CPUs divided by the number of
+                jobs.
+  --cache <dir>
+                Keep converted files in a cache in the given directory, keyed
+                on the contents of the input file, the output format, and the
+                version of the converter. Conversions found in the cache are
+                copied from it instead of being run again.
+  --cache-size <size>
+                Maximum size of the cache in bytes, optionally suffixed with
+                K, M or G. When the cache grows larger, the least recently
+                used files are removed from it. Default is 1G.
+  --prune-cache
+                Rather than converting files, remove the least recently used
+                files from the cache until it is no larger than the cache
+                size.
+  --incremental
+                Only generate output files whose inputs have changed since
+                they were last generated, or which were generated some other
+                way. How each output file was generated is recorded in the
+                file .webfont-generator-state.json in the output directory.
+  --engines <engines>
+                Comma-separated list of converters which may be used.
+                Possible engines are:
+                  fontforge   FontForge
+                  sfntly      sfntly (ttf to woff, eot)
+                  woff2       woff2_compress and woff2_decompress
+                  fonttools   fontTools, in-process (ttf, otf to woff2;
+                              woff2 to ttf); requires the fontTools and
+                              brotli Python packages
+                  native-woff Built-in WOFF encoder and decoder, in-process
+                              (ttf, otf to woff; woff to ttf)
+                The default is: fontforge,sfntly,woff2
+  --subset <subsets>
+                Split the font into shards covering different ranges of
+                Unicode, and generate an @font-face rule with a unicode-range
+                for each, so that browsers download only the shards a page
+                uses. The value is a comma-separated list of shards:
+                  latin, latin-ext, cyrillic, cyrillic-ext, greek,
+                  greek-ext, vietnamese
+                              Ranges of the same names used by Google Fonts
+                  cjk[:<n>]   CJK characters not in an earlier shard, in
+                              chunks of n characters (default 1000)
+                  other       Characters not in an earlier shard
+                or a custom shard in the form <name>=<unicode-range>, such as
+                  symbols=U+2190-21FF,U+2600-26FF
+                May be given more than once. Characters not in any shard are
+                left out. Requires a ttf, otf, woff or woff2 input file and the
+                fontTools Python package.
+  --subset-frequency <file>
+                Text file listing characters from most to least frequently
+                used, which determines which CJK characters go in the first
+                chunks. By default, they are chunked in code point order.
+  --hash-names  Copy every generated file which is not inlined to a name
+                which includes a hash of its contents, such as
+                MyFont.1a2b3c4d.woff2, and refer to the copies in the CSS.
+                Since the contents at such a URL never change, they can be
+                cached forever. The copies are listed in an asset manifest,
+                and the copy listed before for a file which changed is
+                deleted.
+  --asset-manifest <file>
+                JSON file in which --hash-names records the name of the copy
+                of each file, relative to the directory of the file. Entries
+                for other files are kept. Default is asset-manifest.json in
+                the output directory, or in the subdirectory of each family
+                in batch mode.
+  --precompress[=<formats>]
+                Next to every generated ttf, otf, svg and eot file, write
+                copies compressed at the highest level, which web servers can
+                serve as they are. Copies which would not be smaller are not
+                written. woff and woff2 files are compressed already. The
+                value is a comma-separated list of formats:
+                  br          Brotli; requires the brotli Python package
+                  gz          gzip
+                The default is: br,gz
+  --cost-model <file>
+                Record how long each converter takes in the given stats file,
+                and choose the converters which are expected to be fastest
+                according to it, rather than following a fixed order of
+                preference.
+  --watch       After converting the fonts, keep running, and convert them
+                again whenever any of the input files change. Only the
+                families whose input files changed are converted again, and
+                only the output files which depend on the changed input files
+                are generated again. In batch mode, the manifest is watched
+                too, and families are converted one at a time.
+  --profile[=<format>]
+                Time every stage of the conversion: planning, each converter
+                run, and CSS generation. For each stage, report the wall time,
+                CPU time of this process and of converter processes, peak
+                memory usage of converter processes, and bytes read and
+                written. Possible report formats are:
+                  text        A table (default)
+                  json        JSON
+                  trace       Chrome trace events, for chrome://tracing
+  --profile-output <file>
+                Write the profiling report to the given file rather than to
+                stderr.
+  --emit-ninja <file>
+                Rather than converting files, write a Ninja build file which
+                converts them, so that Ninja can run the conversions of many
+                fonts in parallel and redo only those whose inputs changed.
+                Every conversion is a build edge which runs
+                `generate-webfonts step`, and CSS and preload links, if
+                requested, are generated from the converted files. Paths are
+                as given, so run ninja from the current directory. Use `-` for
+                stdout.
+  --emit-plan <file>
+                Like --emit-ninja, but write the plan as JSON, listing the
+                inputs, outputs and command line of every step in an order in
+                which they can be run, for other build systems.
   --verbose     Show verbose output while running.
   --dot         Rather than converting files, print dot code for the converter
                 dependency graph.
@@ -60,6 +244,248 @@ Options:
   -h --help     Show this help message.
 ''')
 
+def serve_usage(out):
+    out.write('''\
+Usage: generate-webfonts serve [options]
+
+  Run an HTTP service which converts uploaded fonts. FontForge and sfntly are
+  started up front and kept running between requests.
+
+Endpoints:
+  POST /convert?filename=<name>&formats=<formats>&prefix=<prefix>
+                Convert the font in the request body, whose format is given by
+                the extension of its file name. Alternatively, upload one or
+                more fonts as a multipart/form-data form. The formats and
+                prefix are as for --format and --prefix, and a font_family
+                parameter may be given as for --font-family. The response is a
+                zip file holding the converted files and a CSS file, or, if
+                the Accept header includes multipart/mixed, a multipart/mixed
+                response with a part for each file. If the queue is full, the
+                response has status 503.
+  GET /health   Report the queue depth and the converter processes as JSON.
+                The status is 503 while the queue is full.
+  GET /metrics  Report the queue depth, the number of responses by status,
+                and the latency of every stage of handling a request, in the
+                Prometheus text format.
+
+Options:
+  --host <host> Address to listen on. Default is 127.0.0.1.
+  --port <port> Port to listen on. Default is 8000.
+  --workers <n> Number of fonts to convert at the same time, and number of
+                FontForge and sfntly processes to keep running. Default is the
+                number of CPUs.
+  --queue-size <n>
+                Maximum number of requests waiting to be converted. Default
+                is 64.
+  --max-upload-size <size>
+                Maximum size of a request body in bytes, optionally suffixed
+                with K, M or G. Default is 32M.
+  --engines <engines>
+                Comma-separated list of converters which may be used, as for
+                generate-webfonts. The default is: fontforge,sfntly,woff2
+  --verbose     Log every request.
+  -h --help     Show this help message.
+''')
+
+def step_usage(out):
+    out.write('''\
+Usage: generate-webfonts step <operation> <input-file> ... -- <output-file> ...
+
+  Run a single conversion, as planned by --emit-ninja or --emit-plan. The
+  formats of the files are deduced as for generate-webfonts. Possible
+  operations are:
+%s
+Options:
+  --verbose     Show verbose output while running.
+  -h --help     Show this help message.
+''' % ''.join('    %s\n' % name for name in STEP_OPERATIONS))
+
+def step_main(argv):
+    options, file_names = parse_subcommand_args(argv, step_usage,
+        flag_options=['--verbose'], allow_positional=True)
+    # The first -- separates the input files from the output files
+    if '--' not in file_names:
+        exit_with_usage(step_usage)
+    separator = file_names.index('--')
+    input_file_names = file_names[:separator]
+    output_file_names = file_names[separator + 1:]
+    if not input_file_names or not output_file_names:
+        exit_with_usage(step_usage)
+    operation_name = input_file_names.pop(0)
+    try:
+        operation = STEP_OPERATIONS.get(operation_name)
+        if operation is None:
+            raise Error('Unrecognized operation: %r' % operation_name)
+        input_files = input_font_files(input_file_names)
+        output_files = input_font_files(output_file_names)
+    except Error as e:
+        exit_with_usage(step_usage, e)
+    logger = make_logger(options.get('--verbose', False))
+    try:
+        operation(input_files, output_files, logger)
+    except Error as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+def worker_usage(out):
+    out.write('''\
+Usage: generate-webfonts worker --spool <dir> [options]
+
+  Convert the jobs queued in a spool directory by `generate-webfonts submit`,
+  one family at a time, until interrupted. Run workers on as many machines as
+  share the spool directory, or several on one machine. A job whose worker
+  dies is handed to another worker once its claim goes stale, and given up on
+  after %d attempts.
+
+Options:
+  --spool <dir> The spool directory. Required.
+  --threads <n> Maximum number of independent conversions to run at the same
+                time for each font family. Default is the number of CPUs.
+  --cache <dir>
+                Keep converted files in a cache in the given directory, as
+                for generate-webfonts.
+  --cache-size <size>
+                Maximum size of the cache, as for generate-webfonts.
+  --stale-after <seconds>
+                Number of seconds after which the claim of a job which a
+                worker has stopped refreshing is taken to be abandoned. Use
+                the same value for every worker. Default is %d.
+  --poll-interval <seconds>
+                Number of seconds to wait before looking for jobs again when
+                there are none. Default is %d.
+  --exit-when-idle
+                Exit once there are no jobs left, rather than waiting for
+                more.
+  --verbose     Show verbose output while running.
+  -h --help     Show this help message.
+''' % (MAX_ATTEMPTS, DEFAULT_STALE_AFTER, DEFAULT_POLL_INTERVAL))
+
+def worker_main(argv):
+    options, args = parse_subcommand_args(argv, worker_usage,
+        ['--spool', '--threads', '--cache', '--cache-size', '--stale-after',
+            '--poll-interval'],
+        ['--exit-when-idle', '--verbose'])
+    spool_dir = options.get('--spool')
+    if spool_dir is None:
+        exit_with_usage(worker_usage)
+    try:
+        threads_str = options.get('--threads')
+        if threads_str is None:
+            threads = os.cpu_count() or 1
+        else:
+            threads = parse_count(threads_str, 'threads')
+        cache = make_cache(options.get('--cache'), options.get('--cache-size'))
+        stale_after = parse_seconds(options.get('--stale-after'),
+            DEFAULT_STALE_AFTER)
+        poll_interval = parse_seconds(options.get('--poll-interval'),
+            DEFAULT_POLL_INTERVAL)
+    except Error as e:
+        exit_with_usage(worker_usage, e)
+    logger = make_logger(options.get('--verbose', False))
+    try:
+        run_worker(Spool(spool_dir), logger, threads, cache, stale_after,
+            poll_interval, options.get('--exit-when-idle', False))
+    except KeyboardInterrupt:
+        pass
+
+def collect_usage(out):
+    out.write('''\
+Usage: generate-webfonts collect --spool <dir> [options] <batch-id>
+
+  Wait until every family of a batch submitted with `generate-webfonts submit`
+  has been converted, and report the families which failed. The exit status is
+  non-zero if any failed.
+
+Options:
+  --spool <dir> The spool directory. Required.
+  --timeout <seconds>
+                Give up if the batch has not finished after the given number
+                of seconds. By default, wait for as long as it takes.
+  --poll-interval <seconds>
+                Number of seconds between checks. Default is %d.
+  -h --help     Show this help message.
+''' % DEFAULT_POLL_INTERVAL)
+
+def collect_main(argv):
+    options, batch_ids = parse_subcommand_args(argv, collect_usage,
+        ['--spool', '--timeout', '--poll-interval'], allow_positional=True)
+    spool_dir = options.get('--spool')
+    if spool_dir is None or len(batch_ids) != 1:
+        exit_with_usage(collect_usage)
+    try:
+        timeout = parse_seconds(options.get('--timeout'), None)
+        poll_interval = parse_seconds(options.get('--poll-interval'),
+            DEFAULT_POLL_INTERVAL)
+    except Error as e:
+        exit_with_usage(collect_usage, e)
+    try:
+        results = wait_for_batch(Spool(spool_dir), batch_ids[0],
+            poll_interval, timeout)
+    except Error as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    except KeyboardInterrupt:
+        sys.exit(1)
+    num_failed = 0
+    for family, error in results:
+        if error is not None:
+            num_failed += 1
+            print('%s: %s' % (family, error), file=sys.stderr)
+    if num_failed:
+        print('%d of %d font families failed to convert' % (
+            num_failed, len(results)), file=sys.stderr)
+        sys.exit(1)
+
+def serve_main(argv):
+    options, args = parse_subcommand_args(argv, serve_usage,
+        ['--host', '--port', '--workers', '--queue-size', '--max-upload-size',
+            '--engines'],
+        ['--verbose'])
+    host = options.get('--host', DEFAULT_HOST)
+    try:
+        port_str = options.get('--port')
+        port = DEFAULT_PORT if port_str is None else parse_count(port_str, 'port')
+        if port > 65535:
+            raise Error('Invalid port: %r' % port_str)
+        workers_str = options.get('--workers')
+        if workers_str is None:
+            workers = os.cpu_count() or 1
+        else:
+            workers = parse_count(workers_str, 'workers')
+        queue_size_str = options.get('--queue-size')
+        if queue_size_str is None:
+            queue_size = DEFAULT_QUEUE_SIZE
+        else:
+            queue_size = parse_count(queue_size_str, 'queued requests')
+        max_upload_size_str = options.get('--max-upload-size')
+        if max_upload_size_str is None:
+            max_upload_size = DEFAULT_MAX_UPLOAD_SIZE
+        else:
+            try:
+                max_upload_size = parse_size(max_upload_size_str)
+            except ValueError:
+                raise Error('Invalid upload size: %r' % max_upload_size_str)
+        engines = parse_engines(options.get('--engines'))
+    except Error as e:
+        exit_with_usage(serve_usage, e)
+    logger = make_logger(options.get('--verbose', False))
+    service = ConversionService(workers, queue_size, engines, logger)
+    service.start()
+    try:
+        server = ConversionServer((host, port), service, max_upload_size)
+    except OSError as e:
+        print('Cannot listen on %s:%d: %s' % (host, port, e), file=sys.stderr)
+        sys.exit(1)
+    print('Listening on http://%s:%d/' % (host, server.server_address[1]),
+        file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+
 def print_dot_code(root_vertex, out):
     print('digraph {', file=out)
     for vertex in depth_first_traversal(root_vertex):
@@ -72,7 +498,90 @@ def print_dot_code(root_vertex, out):
             print(';', file=out)
     print('}', file=out)
 
+def parse_subcommand_args(argv, print_usage, value_options=(),
+        flag_options=(), allow_positional=False):
+    """Parse the arguments of a subcommand. `value_options` are the options
+    which take a value, and `flag_options` those which do not. Return a dict
+    mapping the options given to their values, or True for flags, and a list
+    of the other arguments, which are only allowed if `allow_positional` is
+    set. -h and --help show the usage text of the subcommand and exit."""
+    options = {}
+    positional = []
+    args = argv[::-1]
+    while args:
+        arg = args.pop()
+        if arg in value_options:
+            if not args:
+                exit_with_usage(print_usage)
+            options[arg] = args.pop()
+        elif arg in flag_options:
+            options[arg] = True
+        elif arg == '-h' or arg == '--help':
+            print_usage(sys.stdout)
+            sys.exit(0)
+        elif allow_positional:
+            positional.append(arg)
+        else:
+            exit_with_usage(print_usage)
+    return options, positional
+
+def exit_with_usage(print_usage, error=None):
+    """Report an invalid command line, followed by the usage text, and
+    exit."""
+    if error is not None:
+        print('%s\n' % error, file=sys.stderr)
+    print_usage(sys.stderr)
+    sys.exit(1)
+
+def make_logger(be_verbose):
+    """Set up the logger of the command line tool, which shows verbose
+    output if `be_verbose` is set, and return it."""
+    logger = logging.getLogger('webfont-generator')
+    if not logger.handlers:
+        logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.INFO if be_verbose else logging.WARNING)
+    return logger
+
+def parse_seconds(seconds_str, default):
+    if seconds_str is None:
+        return default
+    try:
+        seconds = float(seconds_str)
+    except ValueError:
+        seconds = 0
+    if not seconds > 0:
+        raise Error('Invalid number of seconds: %r' % seconds_str)
+    return seconds
+
+def make_cache(cache_dir, cache_size_str):
+    if cache_dir is None:
+        if cache_size_str is not None:
+            raise Error('--cache-size requires --cache')
+        return None
+    if cache_size_str is None:
+        cache_size = DEFAULT_MAX_SIZE
+    else:
+        try:
+            cache_size = parse_size(cache_size_str)
+        except ValueError:
+            raise Error('Invalid cache size: %r' % cache_size_str)
+    return ConversionCache(cache_dir, cache_size)
+
 def main():
+    if sys.argv[1:2] == ['serve']:
+        serve_main(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ['step']:
+        step_main(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ['worker']:
+        worker_main(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ['collect']:
+        collect_main(sys.argv[2:])
+        return
+    # The submit command takes the same options as a conversion
+    submit = sys.argv[1:2] == ['submit']
     # Parse command line arguments
     input_file_names = []
     output_formats_str = None
@@ -80,9 +589,33 @@ def main():
     css_file_name = None
     prefix_str = None
     font_family = None
+    manifest_file_name = None
+    jobs_str = None
+    threads_str = None
+    cache_dir = None
+    cache_size_str = None
+    prune_cache = False
+    incremental = False
+    engines_str = None
+    cost_model_file_name = None
+    subset_strs = []
+    subset_frequency_file_name = None
+    profile_format = None
+    profile_file_name = None
+    precompress_str = None
+    hash_names = False
+    asset_manifest = None
+    font_display_str = None
+    preload_file_name = None
+    inline_under_str = None
+    browser_profile = 'all'
+    ninja_file_name = None
+    plan_file_name = None
+    spool_dir = None
+    watch_mode = False
     be_verbose = False
     print_dot = False
-    args = sys.argv[:0:-1]
+    args = (sys.argv[2:] if submit else sys.argv[1:])[::-1]
     while args:
         arg = args.pop()
         if arg == '-o' or arg == '--output':
@@ -95,6 +628,58 @@ def main():
             prefix_str = args.pop()
         elif arg == '--font-family' or arg == '--family':
             font_family = args.pop()
+        elif arg == '--font-display':
+            font_display_str = args.pop()
+        elif arg == '--preload':
+            preload_file_name = args.pop()
+        elif arg == '--inline-under':
+            inline_under_str = args.pop()
+        elif arg == '--browsers':
+            browser_profile = args.pop()
+        elif arg == '--batch':
+            manifest_file_name = args.pop()
+        elif arg == '-j' or arg == '--jobs':
+            jobs_str = args.pop()
+        elif arg == '--threads':
+            threads_str = args.pop()
+        elif arg == '--cache':
+            cache_dir = args.pop()
+        elif arg == '--cache-size':
+            cache_size_str = args.pop()
+        elif arg == '--prune-cache':
+            prune_cache = True
+        elif arg == '--incremental':
+            incremental = True
+        elif arg == '--engines':
+            engines_str = args.pop()
+        elif arg == '--subset':
+            subset_strs.append(args.pop())
+        elif arg == '--subset-frequency':
+            subset_frequency_file_name = args.pop()
+        elif arg == '--cost-model':
+            cost_model_file_name = args.pop()
+        elif arg == '--watch':
+            watch_mode = True
+        elif arg == '--profile':
+            profile_format = 'text'
+        elif arg.startswith('--profile='):
+            profile_format = arg[len('--profile='):]
+        elif arg == '--profile-output':
+            profile_file_name = args.pop()
+        elif arg == '--hash-names':
+            hash_names = True
+        elif arg == '--asset-manifest':
+            asset_manifest = args.pop()
+        elif arg == '--precompress':
+            precompress_str = ''
+        elif arg.startswith('--precompress='):
+            precompress_str = arg[len('--precompress='):]
+        elif arg == '--spool':
+            spool_dir = args.pop()
+        elif arg == '--emit-ninja':
+            ninja_file_name = args.pop()
+        elif arg == '--emit-plan':
+            plan_file_name = args.pop()
         elif arg == '--verbose':
             be_verbose = True
         elif arg == '--dot':
@@ -110,89 +695,332 @@ def main():
             break
         else:
             input_file_names.append(arg)
+    try:
+        cache = make_cache(cache_dir, cache_size_str)
+    except Error as e:
+        exit_with_usage(usage, e)
+    if prune_cache:
+        if cache is None:
+            exit_with_usage(usage)
+        num_removed, bytes_removed = cache.prune()
+        print('Removed %d files (%d bytes) from the cache' % (
+            num_removed, bytes_removed))
+        sys.exit(0)
     # Require the presence of input files and an output directory
-    if not input_file_names or output_dir is None:
-        usage(sys.stderr)
-        sys.exit(1)
-    # Deduce the formats of the input files
-    input_files = []
-    for input_file_name in input_file_names:
-        name, ext = os.path.splitext(input_file_name)
-        ext = ext[1:]
-        if ext not in FORMATS_SET:
-            if ext:
-                print('Unrecognized input format: %r\n' % ext, file=sys.stderr)
-            else:
-                print('Cannot determine format of %r\n' % input_file_name, file=sys.stderr)
-            usage(sys.stderr)
-            sys.exit(1)
-        input_files.append(FontFile(input_file_name, name, ext))
-    # Parse output formats, or use defaults if not specified
-    if output_formats_str is None:
-        output_formats = ['eot', 'woff2', 'woff', 'ttf', 'svg']
-        parsed_output_formats = [(f, False) for f in output_formats]
+    is_batch = manifest_file_name is not None
+    if is_batch == bool(input_file_names) or output_dir is None:
+        exit_with_usage(usage)
+    try:
+        # Deduce the formats of the input files
+        input_files = input_font_files(input_file_names)
+        # Parse output formats, or use defaults if not specified
+        parsed_output_formats = apply_browser_profile(
+            parse_output_formats(output_formats_str), browser_profile)
+        engines = parse_engines(engines_str)
+        if inline_under_str is None:
+            inline_under = None
+        else:
+            try:
+                inline_under = parse_size(inline_under_str)
+            except ValueError:
+                raise Error('Invalid size: %r' % inline_under_str)
+        font_display = parse_font_display(font_display_str)
+        if jobs_str is None:
+            jobs = os.cpu_count() or 1
+        else:
+            jobs = parse_count(jobs_str, 'jobs')
+        if threads_str is None:
+            # In batch mode, every job runs this many conversions, so share
+            # the CPUs among the jobs
+            threads = max(1, (os.cpu_count() or 1) // (jobs if is_batch else 1))
+        else:
+            threads = parse_count(threads_str, 'threads')
+        if profile_format is not None and profile_format not in PROFILE_FORMATS:
+            raise Error('Unrecognized profile format: %r' % profile_format)
+        subsets = parse_subsets(subset_strs) if subset_strs else None
+        if precompress_str is None:
+            precompress = None
+        else:
+            precompress = parse_encodings(precompress_str or None)
+        if subset_frequency_file_name is None:
+            subset_frequency = ()
+        else:
+            try:
+                subset_frequency = read_frequency_file(subset_frequency_file_name)
+            except (OSError, ValueError) as e:
+                raise Error('Cannot read %s: %s' % (subset_frequency_file_name, e))
+        if ninja_file_name is not None or plan_file_name is not None:
+            # These are decided while converting, so they cannot be planned
+            # in advance
+            for flag, value in [
+                    ('--subset', subsets),
+                    ('--hash-names', hash_names),
+                    ('--precompress', precompress),
+                    ('--watch', watch_mode),
+                    ('--dot', print_dot) ]:
+                if value:
+                    raise Error('Cannot use %s with --emit-ninja or '
+                        '--emit-plan' % flag)
+        if submit:
+            # These are up to the workers, or do not apply to jobs
+            for flag, value in [
+                    ('--jobs', jobs_str),
+                    ('--threads', threads_str),
+                    ('--cache', cache_dir),
+                    ('--cost-model', cost_model_file_name),
+                    ('--watch', watch_mode),
+                    ('--profile', profile_format),
+                    ('--dot', print_dot),
+                    ('--emit-ninja', ninja_file_name),
+                    ('--emit-plan', plan_file_name) ]:
+                if value is not None and value is not False:
+                    raise Error('Cannot use %s with submit' % flag)
+            if spool_dir is None or not is_batch:
+                raise Error('submit requires --spool and --batch')
+            if css_file_name == '-' or preload_file_name == '-':
+                raise Error('Cannot write to stdout in batch mode')
+            if font_family is not None:
+                raise Error('Cannot set a font family name in batch mode')
+        elif spool_dir is not None:
+            raise Error('--spool is only for submit, worker and collect')
+    except Error as e:
+        exit_with_usage(usage, e)
+    if cost_model_file_name is None:
+        cost_model = None
     else:
-        output_formats = output_formats_str.split(',')
-        # Check if any formats are suffixed with `:inline`
-        parsed_output_formats = [remove_suffix(f, ':inline') for f in output_formats]
-        # Check for unrecognized formats
-        unrecognized_formats = set(f for f, inline in parsed_output_formats) - FORMATS_SET
-        if unrecognized_formats:
-            print('Unrecognized output formats: %s\n' % ', '.join(unrecognized_formats), file=sys.stderr)
-            usage(sys.stderr)
+        cost_model = CostModel(cost_model_file_name)
+    logger = make_logger(be_verbose)
+    if watch_mode:
+        # Watch mode relies on incremental builds to convert only what
+        # changed
+        incremental = True
+    options = ConversionOptions(parsed_output_formats, css_file_name,
+        preload_file_name, prefix_str, font_family, font_display,
+        inline_under, threads, cache, incremental, engines, cost_model,
+        subsets, subset_frequency, precompress, hash_names, asset_manifest)
+    if submit:
+        sys.exit(submit_batch(spool_dir, manifest_file_name, output_dir,
+            job_options(options, subset_strs, subset_frequency_file_name)))
+    if ninja_file_name is not None or plan_file_name is not None:
+        if is_batch:
+            try:
+                families = read_manifest_file(manifest_file_name)
+            except (Error, OSError) as e:
+                print(e, file=sys.stderr)
+                sys.exit(1)
+            if css_file_name == '-' or preload_file_name == '-':
+                print('Cannot write to stdout in batch mode', file=sys.stderr)
+                sys.exit(1)
+            if font_family is not None:
+                print('Cannot set a font family name in batch mode',
+                    file=sys.stderr)
+                sys.exit(1)
+        else:
+            families = None
+        sys.exit(emit_plan(families, input_files, output_dir, options,
+            ninja_file_name, plan_file_name))
+    if is_batch:
+        if profile_format is not None:
+            print('Cannot profile in batch mode', file=sys.stderr)
             sys.exit(1)
-    # Check if CSS will be generated
-    do_generate_css = css_file_name is not None
-    if do_generate_css:
-        # If no prefix is specified, use a default
-        if prefix_str is None:
-            output_dir_parts = output_dir.split(os.sep)
-            if not output_dir_parts[-1]:
-                output_dir_parts.pop()
-            if output_dir_parts:
-                output_dir_parts.append('')
-            prefix_str = '/'.join(output_dir_parts)
-        # If no font family name is specified, use a default
-        if font_family is None:
-            font_family = os.path.splitext(os.path.basename(input_file_names[0]))[0]
-    # Configure the logger for verbosity
-    logger = logging.getLogger('webfont-generator')
-    logger.addHandler(logging.StreamHandler())
-    if be_verbose:
-        logger.setLevel(logging.INFO)
-    else:
-        logger.setLevel(logging.WARNING)
-    # Figure out which files to generate
-    # Include the inline font formats that are not already included in the
-    # input files, since inlining requires the contents of those files
-    css_inline_files_dict = { f.format : f for f in input_files }
-    output_formats = {
-        f for f, inline in parsed_output_formats
-        if (not inline) or (inline and f not in css_inline_files_dict) }
-    if print_dot:
+        if css_file_name == '-' or preload_file_name == '-':
+            print('Cannot write to stdout in batch mode', file=sys.stderr)
+            sys.exit(1)
+        if font_family is not None:
+            print('Cannot set a font family name in batch mode', file=sys.stderr)
+            sys.exit(1)
+        status = run_batch(manifest_file_name, output_dir, options, jobs,
+            logger)
+        if not watch_mode:
+            sys.exit(status)
+        watch_batch(manifest_file_name, output_dir, options, logger)
+    elif print_dot:
         # If given --dot, do not convert the files, just print the dot code
         # for the dependency graph
         input_files_dict, output_files_dict = make_file_dicts(
             input_files, output_dir)
         source_vertex, output_vertices = construct_dependency_graph(
-            input_files_dict, output_files_dict)
+            input_files_dict, output_files_dict, engines)
         print_dot_code(source_vertex, sys.stdout)
     else:
         # Actually convert font files and generate CSS
-        try:
-            output_files_dict = convert_files(input_files, output_dir, output_formats, logger)
-            if do_generate_css:
-                css_inline_files_dict.update(output_files_dict)
-                if css_file_name == '-':
-                    css_fout = sys.stdout
+        build = lambda: run_single(input_files, output_dir, options,
+            profile_format, profile_file_name, logger)
+        status = build()
+        if not watch_mode:
+            sys.exit(status)
+        watch_single(input_file_names, build, logger)
+
+def run_single(input_files, output_dir, options, profile_format,
+        profile_file_name, logger):
+    profiler = None if profile_format is None else Profiler()
+    try:
+        with contextlib.ExitStack() as stack:
+            css_fout = open_output_file(stack, options.css_file_name)
+            generate_family(input_files, output_dir, options, logger,
+                css_fout, open_output_file(stack, options.preload_file_name),
+                profiler)
+    except Error as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        if options.cache is not None:
+            options.cache.prune_if_full()
+        if profiler is not None:
+            write_profile(profiler, profile_format, profile_file_name)
+    return 0
+
+def submit_batch(spool_dir, manifest_file_name, output_dir, options):
+    try:
+        families = read_manifest_file(manifest_file_name)
+    except (Error, OSError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(Spool(spool_dir).submit(families, output_dir, options))
+    return 0
+
+def emit_plan(families, input_files, output_dir, options, ninja_file_name,
+        plan_file_name):
+    parsed_output_formats = options.parsed_output_formats
+    css_file_name = options.css_file_name
+    preload_file_name = options.preload_file_name
+    engines = options.engines
+    def css_args(prefix):
+        # Arguments passed on to the generate-webfonts run which writes the
+        # CSS
+        args = []
+        if prefix is not None:
+            args.extend(['-p', prefix])
+        if options.font_family is not None:
+            args.extend(['--font-family', options.font_family])
+        if options.font_display is not None:
+            args.extend(['--font-display', options.font_display])
+        if options.inline_under is not None:
+            args.extend(['--inline-under', str(options.inline_under)])
+        return args
+    try:
+        if families is None:
+            edges = plan_family(input_files, output_dir,
+                parsed_output_formats, engines, css_file_name,
+                preload_file_name, css_args(options.prefix))
+        else:
+            # Lay out the families as batch mode does
+            edges = []
+            for family in families:
+                family_output_dir = os.path.join(output_dir, family.name)
+                def in_family_dir(file_name):
+                    if file_name is None:
+                        return None
+                    return os.path.join(family_output_dir, file_name)
+                if options.prefix is None:
+                    family_prefix = None
                 else:
-                    css_fout = open(css_file_name, 'w')
-                with css_fout:
-                    generate_css(css_fout, parsed_output_formats,
-                        css_inline_files_dict, prefix_str, font_family)
-        except Error as e:
+                    family_prefix = options.prefix + family.name + '/'
+                edges.extend(plan_family(
+                    input_font_files(family.input_file_names),
+                    family_output_dir, parsed_output_formats, engines,
+                    in_family_dir(css_file_name),
+                    in_family_dir(preload_file_name),
+                    css_args(family_prefix)))
+        with contextlib.ExitStack() as stack:
+            for file_name, write in [
+                    (ninja_file_name, write_ninja),
+                    (plan_file_name, write_plan_json) ]:
+                fout = open_output_file(stack, file_name)
+                if fout is not None:
+                    write(fout, edges)
+    except Error as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+def open_output_file(stack, file_name):
+    """Open a file for writing, and close it on leaving `stack`. The name `-`
+    means stdout, and None means no file."""
+    if file_name is None:
+        return None
+    if file_name == '-':
+        return sys.stdout
+    return stack.enter_context(open(file_name, 'w'))
+
+def watch_single(input_file_names, build, logger):
+    def on_change(changed):
+        print('%s changed, converting again' % ', '.join(sorted(changed)),
+            file=sys.stderr)
+        build()
+    print('Watching for changes', file=sys.stderr)
+    try:
+        watch(make_watcher(input_file_names, logger), on_change)
+    except KeyboardInterrupt:
+        pass
+
+def write_profile(profiler, profile_format, profile_file_name):
+    # Report the stages that ran, even if the conversion failed
+    if profile_file_name is None:
+        profiler.write_report(sys.stderr, profile_format)
+    else:
+        with open(profile_file_name, 'w') as fout:
+            profiler.write_report(fout, profile_format)
+
+def run_batch(manifest_file_name, output_dir, options, jobs, logger):
+    try:
+        families = read_manifest_file(manifest_file_name)
+    except (Error, OSError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    return convert_batch(families, output_dir, options, jobs, logger)
+
+def convert_batch(families, output_dir, options, jobs, logger):
+    num_failed = 0
+    for family, error in convert_families(families, output_dir, options,
+            jobs, logger.level):
+        if error is not None:
+            num_failed += 1
+            print('%s: %s' % (family.name, error), file=sys.stderr)
+    if options.cache is not None:
+        options.cache.prune_if_full()
+    if num_failed:
+        print('%d of %d font families failed to convert' % (
+            num_failed, len(families)), file=sys.stderr)
+        return 1
+    return 0
+
+def watch_batch(manifest_file_name, output_dir, options, logger):
+    def read_families():
+        try:
+            return read_manifest_file(manifest_file_name)
+        except (Error, OSError) as e:
             print(e, file=sys.stderr)
-            sys.exit(1)
+            return []
+    def watched_paths():
+        return [manifest_file_name] + [
+            name for family in families for name in family.input_file_names ]
+    def convert(affected_families):
+        # Convert the families in this process, one at a time, so that the
+        # converter processes stay warm between changes
+        convert_batch(affected_families, output_dir,
+            options._replace(incremental=True), 1, logger)
+    def on_change(changed):
+        nonlocal families
+        if os.path.abspath(manifest_file_name) in changed:
+            print('%s changed, converting all font families again' %
+                manifest_file_name, file=sys.stderr)
+            families = read_families()
+            convert(families)
+            return watched_paths()
+        affected_families = [
+            family for family in families
+            if any(os.path.abspath(name) in changed
+                for name in family.input_file_names) ]
+        print('%s changed, converting again' % ', '.join(
+            family.name for family in affected_families), file=sys.stderr)
+        convert(affected_families)
+    families = read_families()
+    print('Watching for changes', file=sys.stderr)
+    try:
+        watch(make_watcher(watched_paths(), logger), on_change)
+    except KeyboardInterrupt:
+        pass
 
 if __name__ == '__main__':
     main()
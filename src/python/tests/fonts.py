@@ -0,0 +1,50 @@
+"""Tiny fonts built with fontTools for the tests."""
+
+import io
+
+def build_font(family='Test', weight=400, italic=False, cff=False,
+        flavor=None, characters='A'):
+    """Return the contents of a font with a glyph for each of `characters`,
+    with TrueType outlines, or CFF outlines if `cff` is set. `flavor` may be
+    woff or woff2 to compress it with fontTools."""
+    from fontTools.fontBuilder import FontBuilder
+    from fontTools.pens.ttGlyphPen import TTGlyphPen
+    from fontTools.pens.t2CharStringPen import T2CharStringPen
+    cmap = { ord(c) : 'uni%04X' % ord(c) for c in characters }
+    glyph_order = ['.notdef'] + sorted(set(cmap.values()))
+    builder = FontBuilder(1000, isTTF=not cff)
+    builder.setupGlyphOrder(glyph_order)
+    builder.setupCharacterMap(cmap)
+    if cff:
+        charstrings = {}
+        for name in glyph_order:
+            pen = T2CharStringPen(500, None)
+            _draw_box(pen)
+            charstrings[name] = pen.getCharString()
+        builder.setupCFF(family, { 'FullName' : family }, charstrings, {})
+    else:
+        glyphs = {}
+        for name in glyph_order:
+            pen = TTGlyphPen(None)
+            _draw_box(pen)
+            glyphs[name] = pen.glyph()
+        builder.setupGlyf(glyphs)
+    builder.setupHorizontalMetrics({ name : (500, 0) for name in glyph_order })
+    builder.setupHorizontalHeader(ascent=800, descent=-200)
+    builder.setupNameTable({ 'familyName' : family,
+        'styleName' : 'Italic' if italic else 'Regular' })
+    builder.setupOS2(usWeightClass=weight,
+        fsSelection=0x1 if italic else 0x40)
+    builder.setupPost()
+    builder.font['head'].macStyle = 0x2 if italic else 0
+    builder.font.flavor = flavor
+    fout = io.BytesIO()
+    builder.save(fout)
+    return fout.getvalue()
+
+def _draw_box(pen):
+    pen.moveTo((0, 0))
+    pen.lineTo((0, 500))
+    pen.lineTo((500, 500))
+    pen.lineTo((500, 0))
+    pen.closePath()
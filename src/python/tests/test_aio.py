@@ -0,0 +1,50 @@
+import os
+import asyncio
+import unittest
+import unittest.mock
+
+from webfont_generator import aio
+from webfont_generator.error import Error
+
+class TestRunCommand(unittest.IsolatedAsyncioTestCase):
+
+    async def start(self, command, timeout=aio.CONVERTER_TIMEOUT):
+        """Start run_command in a task, and return the task and the process
+        it started."""
+        processes = []
+        create = asyncio.create_subprocess_exec
+        async def create_and_record(*args, **kwargs):
+            process = await create(*args, **kwargs)
+            processes.append(process)
+            return process
+        with unittest.mock.patch.object(asyncio, 'create_subprocess_exec',
+                create_and_record):
+            task = asyncio.ensure_future(aio.run_command(command, timeout))
+            while not processes:
+                await asyncio.sleep(0.01)
+        return task, processes[0]
+
+    def assert_killed(self, process):
+        self.assertEqual(process.returncode, -9)
+        with self.assertRaises(ProcessLookupError):
+            os.kill(process.pid, 0)
+
+    async def test_exit_status(self):
+        self.assertEqual(await aio.run_command(['true']), 0)
+        self.assertEqual(await aio.run_command(['false']), 1)
+
+    async def test_cancel_kills_process(self):
+        task, process = await self.start(['sleep', '60'])
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assert_killed(process)
+
+    async def test_timeout_kills_process(self):
+        task, process = await self.start(['sleep', '60'], 0.2)
+        with self.assertRaisesRegex(Error, 'sleep did not finish within'):
+            await task
+        self.assert_killed(process)
+
+if __name__ == '__main__':
+    unittest.main()
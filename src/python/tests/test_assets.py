@@ -0,0 +1,96 @@
+import os
+import json
+import logging
+import tempfile
+import unittest
+
+from webfont_generator import assets
+from webfont_generator.operations import FontFile
+
+class TestAssets(unittest.TestCase):
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.dir = temp_dir.name
+        self.manifest_path = os.path.join(self.dir, 'asset-manifest.json')
+        self.logger = logging.getLogger('test')
+
+    def write(self, name, data):
+        path = os.path.join(self.dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as fout:
+            fout.write(data)
+        return FontFile(path, os.path.splitext(path)[0], name.rsplit('.', 1)[1])
+
+    def hashed(self, name, data):
+        return assets.add_content_hash(self.write(name, data), self.logger)
+
+    def manifest(self):
+        with open(self.manifest_path) as fin:
+            return json.load(fin)
+
+    def files(self):
+        return sorted(
+            os.path.relpath(os.path.join(dir_path, file_name), self.dir)
+            for dir_path, dir_names, file_names in os.walk(self.dir)
+            for file_name in file_names
+            if not file_name.startswith('.') and
+                file_name != 'asset-manifest.json')
+
+    def test_add_content_hash(self):
+        hashed_file = self.hashed('A.woff', b'one')
+        digest = assets.content_hash(hashed_file.full_path)
+        self.assertEqual(len(digest), assets.HASH_LENGTH)
+        self.assertEqual(hashed_file.basename(), 'A.%s.woff' % digest)
+        self.assertEqual(hashed_file.svg_id(), 'A')
+        self.assertEqual(assets.logical_name(hashed_file), 'A.woff')
+        self.assertEqual(self.files(), ['A.%s.woff' % digest, 'A.woff'])
+
+    def test_manifest_names(self):
+        first = self.hashed('A.woff', b'one')
+        second = self.hashed('fonts/B.woff2', b'two')
+        assets.update_asset_manifest(self.manifest_path, [first, second],
+            self.logger)
+        self.assertEqual(self.manifest(), {
+            'A.woff' : first.basename(),
+            'fonts/B.woff2' : 'fonts/' + second.basename()
+        })
+
+    def test_old_copies_are_deleted(self):
+        old = self.hashed('A.woff', b'one')
+        other = self.hashed('B.woff', b'other')
+        assets.update_asset_manifest(self.manifest_path, [old, other],
+            self.logger)
+        for ext in assets.ENCODINGS:
+            self.write(old.basename() + '.' + ext, b'compressed')
+        new = self.hashed('A.woff', b'two')
+        assets.update_asset_manifest(self.manifest_path, [new], self.logger)
+        self.assertEqual(self.manifest(), {
+            'A.woff' : new.basename(),
+            'B.woff' : other.basename()
+        })
+        self.assertEqual(self.files(), sorted([
+            'A.woff', new.basename(), 'B.woff', other.basename()]))
+
+    def test_copy_still_listed_is_kept(self):
+        # Two logical names may refer to copies with the same contents
+        first = self.hashed('A.woff', b'same')
+        assets.update_asset_manifest(self.manifest_path, [first], self.logger)
+        with open(self.manifest_path, 'w') as fout:
+            json.dump({ 'A.woff' : first.basename(),
+                'Alias.woff' : first.basename() }, fout)
+        second = self.hashed('A.woff', b'changed')
+        assets.update_asset_manifest(self.manifest_path, [second], self.logger)
+        self.assertTrue(os.path.exists(first.full_path))
+
+    def test_unchanged_contents(self):
+        first = self.hashed('A.woff', b'one')
+        assets.update_asset_manifest(self.manifest_path, [first], self.logger)
+        second = self.hashed('A.woff', b'one')
+        assets.update_asset_manifest(self.manifest_path, [second], self.logger)
+        self.assertEqual(second.full_path, first.full_path)
+        self.assertTrue(os.path.exists(first.full_path))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import io
+import os
+import logging
+import tempfile
+import threading
+import unittest
+
+from webfont_generator import batch
+from webfont_generator.error import Error
+from webfont_generator.family import ConversionOptions, parse_output_formats
+
+try:
+    import fontTools
+except ImportError:
+    fontTools = None
+
+from .fonts import build_font
+
+def touch(file_name, data=b''):
+    with open(file_name, 'wb') as fout:
+        fout.write(data)
+
+class TestReadManifest(unittest.TestCase):
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.dir = temp_dir.name
+        for name in ['Sans-Bold.ttf', 'Sans-Regular.ttf', 'Serif.otf']:
+            touch(os.path.join(self.dir, name))
+
+    def read(self, text):
+        return [(f.name, f.input_file_names)
+            for f in batch.read_manifest(io.StringIO(text), self.dir)]
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def test_families(self):
+        self.assertEqual(self.read(
+            '# Comment\n'
+            '\n'
+            'Sans-*.ttf\n'
+            '  Serif.otf  Missing.ttf  \n'), [
+            ('Sans-Bold', [self.path('Sans-Bold.ttf'),
+                self.path('Sans-Regular.ttf')]),
+            ('Serif', [self.path('Serif.otf'), self.path('Missing.ttf')])
+        ])
+
+    def test_duplicate_family(self):
+        with self.assertRaisesRegex(Error,
+                "line 3 of manifest: duplicate font family 'Serif'"):
+            self.read('Serif.otf\nSans-*.ttf\nSerif.otf Sans-Bold.ttf\n')
+
+    def test_manifest_file(self):
+        manifest_file_name = self.path('fonts.txt')
+        with open(manifest_file_name, 'w') as fout:
+            fout.write('Serif.otf\n')
+        families = batch.read_manifest_file(manifest_file_name)
+        self.assertEqual([f.input_file_names for f in families],
+            [[self.path('Serif.otf')]])
+
+@unittest.skipIf(fontTools is None, 'requires fontTools')
+class TestConvertFamilies(unittest.TestCase):
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.dir = temp_dir.name
+        self.options = ConversionOptions(parse_output_formats('woff'),
+            css_file_name='fonts.css', prefix='/fonts/',
+            engines=frozenset(['native-woff']))
+
+    def test_errors_are_reported_per_family(self):
+        touch(os.path.join(self.dir, 'Good.ttf'), build_font('Good'))
+        touch(os.path.join(self.dir, 'Bad.ttf'), b'not a font')
+        families = [
+            batch.Family('Bad', [os.path.join(self.dir, 'Bad.ttf')]),
+            batch.Family('Good', [os.path.join(self.dir, 'Good.ttf')])
+        ]
+        output_dir = os.path.join(self.dir, 'out')
+        results = list(batch.convert_families(families, output_dir,
+            self.options, 1, logging.CRITICAL))
+        self.assertEqual([f.name for f, error in results], ['Bad', 'Good'])
+        self.assertIsNotNone(results[0][1])
+        self.assertIsNone(results[1][1])
+        self.assertFalse(os.path.exists(os.path.join(output_dir, 'Bad')))
+        self.assertTrue(os.path.exists(
+            os.path.join(output_dir, 'Good', 'Good.woff')))
+        with open(os.path.join(output_dir, 'Good', 'fonts.css')) as fin:
+            self.assertIn('/fonts/Good/Good.woff', fin.read())
+
+    def test_cancelled(self):
+        touch(os.path.join(self.dir, 'Good.ttf'), build_font('Good'))
+        families = [batch.Family('Good', [os.path.join(self.dir, 'Good.ttf')])]
+        cancelled = threading.Event()
+        cancelled.set()
+        output_dir = os.path.join(self.dir, 'out')
+        (family, error), = batch.convert_families(families, output_dir,
+            self.options, 1, logging.CRITICAL, cancelled)
+        self.assertIsNotNone(error)
+        self.assertFalse(os.path.exists(os.path.join(output_dir, 'Good')))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+import os
+import time
+import logging
+import tempfile
+import unittest
+import unittest.mock
+
+from webfont_generator import cache
+from webfont_generator.operations import FontFile
+
+def fake_convert(input_files, output_files, logger):
+    """Write the contents of the input file, followed by the output format,
+    to every output file."""
+    with open(input_files[0].full_path, 'rb') as fin:
+        data = fin.read()
+    for output_file in output_files:
+        with open(output_file.full_path, 'wb') as fout:
+            fout.write(data + output_file.format.encode('ascii'))
+
+class TestConversionCache(unittest.TestCase):
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.dir = temp_dir.name
+        self.cache_dir = os.path.join(self.dir, 'cache')
+        self.cache = cache.ConversionCache(self.cache_dir)
+        self.operation = unittest.mock.Mock(wraps=fake_convert)
+        patcher = unittest.mock.patch.dict(cache.TOOL_IDENTITIES,
+            { self.operation : lambda: 'fake 1.0' })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.logger = logging.getLogger('test')
+
+    def input_file(self, name, data):
+        path = os.path.join(self.dir, name + '.ttf')
+        with open(path, 'wb') as fout:
+            fout.write(data)
+        return FontFile(path, path[:-4], 'ttf')
+
+    def convert(self, input_file, format='woff'):
+        """Convert a file through the cache. Return whether it came from the
+        cache, and the contents of the output file."""
+        output_file = input_file.moved_and_converted_to(
+            os.path.join(self.dir, 'out'), format)
+        os.makedirs(os.path.join(self.dir, 'out'), exist_ok=True)
+        from_cache = self.cache.run(self.operation, [input_file],
+            [output_file], self.logger)
+        with open(output_file.full_path, 'rb') as fin:
+            return from_cache, fin.read()
+
+    def entries(self):
+        return sorted(
+            os.path.join(os.path.basename(dir_path), file_name)
+            for dir_path, dir_names, file_names in os.walk(self.cache_dir)
+            for file_name in file_names if not file_name.startswith('.'))
+
+    def recorded_size(self):
+        with open(os.path.join(self.cache_dir, '.size')) as fin:
+            return int(fin.read())
+
+    def test_restore(self):
+        input_file = self.input_file('A', b'abc')
+        self.assertEqual(self.convert(input_file), (False, b'abcwoff'))
+        self.assertEqual(self.convert(input_file), (True, b'abcwoff'))
+        self.assertEqual(self.operation.call_count, 1)
+        # A different format or different contents is a different entry
+        self.assertEqual(self.convert(input_file, 'woff2'), (False, b'abcwoff2'))
+        self.assertEqual(self.convert(self.input_file('A', b'xyz')),
+            (False, b'xyzwoff'))
+        self.assertEqual(len(self.entries()), 3)
+
+    def test_tool_identity(self):
+        input_file = self.input_file('A', b'abc')
+        self.convert(input_file)
+        cache.TOOL_IDENTITIES[self.operation] = lambda: 'fake 2.0'
+        self.assertEqual(self.convert(input_file), (False, b'abcwoff'))
+
+    def test_size(self):
+        # The size is unknown until the cache has been walked once
+        self.convert(self.input_file('A', b'a'))
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, '.size')))
+        self.assertEqual(self.cache.prune(), (0, 0))
+        self.assertEqual(self.recorded_size(), 5)
+        self.convert(self.input_file('B', b'bb'))
+        self.assertEqual(self.recorded_size(), 11)
+
+    def test_prune_least_recently_used(self):
+        entries = {}
+        for name in 'ABC':
+            input_file = self.input_file(name, name.encode('ascii') * 2)
+            before = set(self.entries())
+            self.convert(input_file)
+            entries[name], = set(self.entries()) - before
+        for i, name in enumerate('ABC', 1):
+            os.utime(os.path.join(self.cache_dir, entries[name]), (i, i))
+        # Restoring A marks it as recently used, so B is the oldest
+        self.assertEqual(self.convert(self.input_file('A', b'AA')),
+            (True, b'AAwoff'))
+        self.assertEqual(self.cache.prune(13), (1, 6))
+        self.assertEqual(self.entries(), sorted([entries['A'], entries['C']]))
+        self.assertEqual(self.recorded_size(), 12)
+
+    def test_prune_if_full(self):
+        for name in 'AB':
+            self.convert(self.input_file(name, b'x' + name.encode('ascii')))
+        self.cache.max_size = 6
+        with unittest.mock.patch.object(self.cache, 'prune',
+                wraps=self.cache.prune) as prune:
+            # The size is unknown, so the cache is walked
+            self.assertEqual(self.cache.prune_if_full(), (1, 6))
+            self.assertEqual(prune.call_count, 1)
+            # The recorded size is within the limit, so it is not
+            self.assertEqual(self.cache.prune_if_full(), (0, 0))
+            self.assertEqual(prune.call_count, 1)
+            self.convert(self.input_file('C', b'xC'))
+            self.assertEqual(self.cache.prune_if_full(), (1, 6))
+            self.assertEqual(prune.call_count, 2)
+        self.assertEqual(self.recorded_size(), 6)
+
+    def test_stale_temporary_files(self):
+        self.convert(self.input_file('A', b'a'))
+        entry_dir = os.path.join(self.cache_dir,
+            os.path.dirname(self.entries()[0]))
+        stale = os.path.join(entry_dir, '.tmpstale')
+        fresh = os.path.join(entry_dir, '.tmpfresh')
+        for path in (stale, fresh):
+            with open(path, 'wb') as fout:
+                fout.write(b'partial')
+        old = time.time() - cache._STALE_TEMP_AGE - 1
+        os.utime(stale, (old, old))
+        self.cache.prune()
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.exists(fresh))
+        # Temporary files are not counted as entries
+        self.assertEqual(self.recorded_size(), 5)
+
+if __name__ == '__main__':
+    unittest.main()
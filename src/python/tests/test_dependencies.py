@@ -0,0 +1,139 @@
+import itertools
+import threading
+import unittest
+
+from webfont_generator import graph
+from webfont_generator.operations import FontFile
+from webfont_generator.dependencies import (FORMATS, ENGINES,
+    DEFAULT_ENGINES, Vector, make_file_dicts, construct_dependency_graph,
+    compile_plan, instantiate_plan, TreeVertex, process_tree)
+
+def tree_signature(root):
+    return [
+        (vertex.value.__name__, [
+            (edge.vertex_to.value.__name__,
+                None if edge.file is None else edge.file.full_path)
+            for edge in vertex.outgoing_edges ])
+        for vertex in graph.preorder_traversal(root) ]
+
+def unmemoized_plan(input_files_dict, output_files_dict, output_formats,
+        engines):
+    """Plan the conversion on a graph of the real files, as was done before
+    plans were memoized."""
+    source_vertex, output_vertices = construct_dependency_graph(
+        input_files_dict, output_files_dict, engines)
+    destination_vertices = [output_vertices[f] for f in output_formats]
+    reachable_vertices = graph.compute_shortest_paths(
+        source_vertex, destination_vertices, Vector(0, 0, 0))
+    unreachable_formats = [
+        f for f in output_formats
+        if output_vertices[f] not in reachable_vertices ]
+    if unreachable_formats:
+        return None, unreachable_formats
+    return graph.construct_shortest_paths_subtree(
+        source_vertex, destination_vertices), []
+
+class TestCompilePlan(unittest.TestCase):
+
+    def test_matches_unmemoized_plan(self):
+        input_format_sets = [
+            formats for n in (1, 2)
+            for formats in itertools.combinations(FORMATS, n) ]
+        output_format_sets = [(f,) for f in FORMATS] + \
+            list(itertools.combinations(FORMATS, 2)) + [tuple(FORMATS)]
+        for engines in (DEFAULT_ENGINES, frozenset(ENGINES)):
+            for input_formats in input_format_sets:
+                input_files = [
+                    FontFile('in/A.' + f, 'in/A', f) for f in input_formats ]
+                input_files_dict, output_files_dict = make_file_dicts(
+                    input_files, 'out')
+                for output_formats in output_format_sets:
+                    output_formats = sorted(output_formats)
+                    with self.subTest(engines=sorted(engines),
+                            input_formats=input_formats,
+                            output_formats=output_formats):
+                        expected_tree, expected_unreachable = \
+                            unmemoized_plan(input_files_dict,
+                                output_files_dict, output_formats, engines)
+                        plan, unreachable = compile_plan(
+                            input_formats, output_formats, engines)
+                        self.assertEqual(sorted(unreachable),
+                            expected_unreachable)
+                        if expected_tree is not None:
+                            self.assertEqual(
+                                tree_signature(instantiate_plan(plan,
+                                    input_files_dict, output_files_dict)),
+                                tree_signature(expected_tree))
+
+    def test_memoized(self):
+        plan, unreachable = compile_plan(['ttf'], ['woff', 'eot'])
+        self.assertIs(compile_plan(['ttf'], ['eot', 'woff'])[0], plan)
+
+    def test_instances_independent(self):
+        # Instantiating a plan twice must not share vertices, since they
+        # hold the state of a conversion
+        input_files = [FontFile('in/A.ttf', 'in/A', 'ttf')]
+        input_files_dict, output_files_dict = make_file_dicts(input_files,
+            'out')
+        plan, unreachable = compile_plan(['ttf'], ['woff'])
+        first = instantiate_plan(plan, input_files_dict, output_files_dict)
+        second = instantiate_plan(plan, input_files_dict, output_files_dict)
+        self.assertEqual(tree_signature(first), tree_signature(second))
+        first_vertices = set(map(id, graph.preorder_traversal(first)))
+        self.assertFalse(first_vertices & set(map(id,
+            graph.preorder_traversal(second))))
+
+class TestProcessTree(unittest.TestCase):
+
+    def build_tree(self):
+        """Return a tree whose root has two branches of two vertices each,
+        named after their positions in pre-order."""
+        vertices = { name : TreeVertex(name)
+            for name in ['root', 'a', 'a1', 'b', 'b1'] }
+        for vertex_from, vertex_to in [('root', 'a'), ('a', 'a1'),
+                ('root', 'b'), ('b', 'b1')]:
+            vertices[vertex_from].add_edge(vertices[vertex_to])
+        return vertices['root']
+
+    def test_dependencies_first(self):
+        for threads in [1, 4]:
+            with self.subTest(threads=threads):
+                processed = []
+                lock = threading.Lock()
+                def process(vertex):
+                    with lock:
+                        processed.append(vertex.value)
+                process_tree(self.build_tree(), process, threads)
+                self.assertEqual(sorted(processed),
+                    ['a', 'a1', 'b', 'b1', 'root'])
+                for parent, child in [('root', 'a'), ('a', 'a1'),
+                        ('root', 'b'), ('b', 'b1')]:
+                    self.assertLess(processed.index(parent),
+                        processed.index(child))
+
+    def test_branches_run_concurrently(self):
+        # Each branch waits for the other, which only finishes if they run
+        # at the same time
+        barrier = threading.Barrier(2, timeout=5)
+        def process(vertex):
+            if vertex.value in ('a', 'b'):
+                barrier.wait()
+        process_tree(self.build_tree(), process, 2)
+
+    def test_first_error_in_preorder(self):
+        for threads in [1, 4]:
+            with self.subTest(threads=threads):
+                processed = []
+                def process(vertex):
+                    processed.append(vertex.value)
+                    if vertex.value in ('a', 'b1'):
+                        raise ValueError(vertex.value)
+                with self.assertRaisesRegex(ValueError, '^a$'):
+                    process_tree(self.build_tree(), process, threads)
+                self.assertNotIn('a1', processed)
+                if threads > 1:
+                    # The branch which does not depend on a still runs
+                    self.assertIn('b1', processed)
+
+if __name__ == '__main__':
+    unittest.main()
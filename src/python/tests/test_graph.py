@@ -0,0 +1,67 @@
+import unittest
+
+from webfont_generator.graph import (Heap, ShortestPathsVertex,
+    compute_shortest_paths)
+
+class TestHeap(unittest.TestCase):
+
+    def drain(self, heap):
+        result = []
+        while heap:
+            result.append(heap.remove_min())
+        return result
+
+    def test_order(self):
+        heap = Heap()
+        for value, key in [('c', 3), ('a', 1), ('d', 4), ('b', 2)]:
+            heap.insert(value, key)
+        self.assertEqual(len(heap), 4)
+        self.assertEqual(self.drain(heap),
+            [('a', 1), ('b', 2), ('c', 3), ('d', 4)])
+        self.assertEqual(len(heap), 0)
+
+    def test_decrease_key(self):
+        heap = Heap()
+        for value, key in [('a', 1), ('b', 5), ('c', 3)]:
+            heap.insert(value, key)
+        heap.decrease_key('b', 2)
+        heap.decrease_key('c', 0)
+        # The superseded entries are still in the heap, but not counted
+        self.assertEqual(len(heap), 3)
+        self.assertEqual(self.drain(heap), [('c', 0), ('a', 1), ('b', 2)])
+
+    def test_equal_keys_in_insertion_order(self):
+        heap = Heap()
+        for value in ['x', 'y', 'z']:
+            heap.insert(value, 5)
+        heap.decrease_key('x', 7)
+        heap.decrease_key('z', 1)
+        heap.decrease_key('x', 1)
+        # x was inserted before z, which decrease_key does not change
+        self.assertEqual(self.drain(heap), [('x', 1), ('z', 1), ('y', 5)])
+
+class TestShortestPaths(unittest.TestCase):
+
+    def test_decrease_key_path(self):
+        s, a, b, c = (ShortestPathsVertex(name) for name in 'sabc')
+        s.add_edge(a, 1)
+        s.add_edge(b, 5)
+        a.add_edge(b, 1)
+        b.add_edge(c, 1)
+        a.add_edge(c, 10)
+        compute_shortest_paths(s, [c])
+        self.assertEqual((a.length, b.length, c.length), (1, 2, 3))
+        self.assertEqual(
+            [edge.vertex_from.value for edge in c.reversed_path_edges()],
+            ['b', 'a', 's'])
+
+    def test_unreachable(self):
+        s, a, b = (ShortestPathsVertex(name) for name in 'sab')
+        s.add_edge(a, 1)
+        completed = compute_shortest_paths(s, [a, b])
+        self.assertIn(a, completed)
+        self.assertNotIn(b, completed)
+        self.assertIsNone(b.length)
+
+if __name__ == '__main__':
+    unittest.main()
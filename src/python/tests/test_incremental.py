@@ -0,0 +1,102 @@
+import os
+import tempfile
+import unittest
+
+from webfont_generator.incremental import BuildState, STATE_FILE_NAME
+from webfont_generator.operations import FontFile
+
+def convert(input_files, output_files, logger):
+    pass
+
+def other_convert(input_files, output_files, logger):
+    pass
+
+class TestBuildState(unittest.TestCase):
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.dir = temp_dir.name
+        self.input_file = self.write('A.ttf', b'input')
+        self.output_file = self.write('A.woff', b'output')
+
+    def write(self, name, data):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as fout:
+            fout.write(data)
+        return FontFile(path, os.path.splitext(path)[0], name.rsplit('.', 1)[1])
+
+    def set_mtime(self, file, mtime):
+        os.utime(file.full_path, ns=(mtime, mtime))
+
+    def saved_state(self):
+        state = BuildState(self.dir)
+        state.update(convert, [self.input_file], [self.output_file])
+        state.save()
+        return BuildState(self.dir)
+
+    def is_current(self, state, operation=convert, input_files=None):
+        if input_files is None:
+            input_files = [self.input_file]
+        return state.is_current(operation, input_files, [self.output_file])
+
+    def test_current(self):
+        self.assertFalse(self.is_current(BuildState(self.dir)))
+        self.assertTrue(self.is_current(self.saved_state()))
+
+    def test_invalidated(self):
+        cases = [
+            ('input modified',
+                lambda: self.set_mtime(self.input_file, 1)),
+            ('input resized',
+                lambda: self.write('A.ttf', b'longer input')),
+            ('output modified',
+                lambda: self.set_mtime(self.output_file, 1)),
+            ('output deleted',
+                lambda: os.remove(self.output_file.full_path))
+        ]
+        for name, change in cases:
+            with self.subTest(name):
+                state = self.saved_state()
+                change()
+                self.assertFalse(self.is_current(state))
+                self.write('A.ttf', b'input')
+                self.write('A.woff', b'output')
+
+    def test_different_operation(self):
+        state = self.saved_state()
+        self.assertFalse(self.is_current(state, other_convert))
+        extra_file = self.write('B.ttf', b'input')
+        self.assertFalse(self.is_current(state,
+            input_files=[self.input_file, extra_file]))
+
+    def test_save_keeps_other_records(self):
+        other_output_file = self.write('B.woff', b'output')
+        first = BuildState(self.dir)
+        second = BuildState(self.dir)
+        first.update(convert, [self.input_file], [self.output_file])
+        second.update(convert, [self.input_file], [other_output_file])
+        first.save()
+        second.save()
+        state = BuildState(self.dir)
+        self.assertTrue(self.is_current(state))
+        self.assertTrue(state.is_current(convert, [self.input_file],
+            [other_output_file]))
+
+    def test_unreadable_state(self):
+        with open(os.path.join(self.dir, STATE_FILE_NAME), 'w') as fout:
+            fout.write('{')
+        state = BuildState(self.dir)
+        self.assertFalse(self.is_current(state))
+        state.update(convert, [self.input_file], [self.output_file])
+        state.save()
+        self.assertTrue(self.is_current(BuildState(self.dir)))
+
+    def test_missing_output_dir(self):
+        state = BuildState(os.path.join(self.dir, 'missing'))
+        state.update(convert, [self.input_file], [self.output_file])
+        state.save()
+        self.assertFalse(os.path.exists(os.path.join(self.dir, 'missing')))
+
+if __name__ == '__main__':
+    unittest.main()
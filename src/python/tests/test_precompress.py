@@ -0,0 +1,93 @@
+import os
+import gzip
+import logging
+import tempfile
+import unittest
+
+from webfont_generator import precompress
+from webfont_generator.error import Error
+from webfont_generator.operations import FontFile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+class TestParseEncodings(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(precompress.parse_encodings('gz'), ['gz'])
+        with self.assertRaisesRegex(Error, 'Unrecognized precompression formats: xz'):
+            precompress.parse_encodings('gz,xz')
+
+    @unittest.skipIf(brotli is None, 'requires brotli')
+    def test_default(self):
+        self.assertEqual(precompress.parse_encodings(None), ['br', 'gz'])
+
+class TestPrecompressFiles(unittest.TestCase):
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.dir = temp_dir.name
+        self.logger = logging.getLogger('test')
+
+    def write(self, name, data):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as fout:
+            fout.write(data)
+        return FontFile(path, os.path.splitext(path)[0], name.rsplit('.', 1)[1])
+
+    def compressed_names(self):
+        return sorted(f for f in os.listdir(self.dir)
+            if f.endswith(('.gz', '.br')))
+
+    def test_compressible_formats(self):
+        font_files = [self.write('A.' + f, b'\0' * 1000)
+            for f in ['ttf', 'svg', 'woff', 'woff2']]
+        precompress.precompress_files(font_files, ['gz'], self.logger, 2)
+        self.assertEqual(self.compressed_names(), ['A.svg.gz', 'A.ttf.gz'])
+        with gzip.open(os.path.join(self.dir, 'A.ttf.gz')) as fin:
+            self.assertEqual(fin.read(), b'\0' * 1000)
+
+    def test_reproducible(self):
+        font_file = self.write('A.ttf', b'\0' * 1000)
+        precompress.precompress_file(font_file, 'gz', self.logger)
+        with open(font_file.full_path + '.gz', 'rb') as fin:
+            first = fin.read()
+        precompress.precompress_file(font_file, 'gz', self.logger)
+        with open(font_file.full_path + '.gz', 'rb') as fin:
+            self.assertEqual(fin.read(), first)
+
+    def test_incompressible(self):
+        font_file = self.write('A.ttf', b'\0' * 1000)
+        precompress.precompress_file(font_file, 'gz', self.logger)
+        # An old copy is removed once compressing no longer helps
+        self.write('A.ttf', os.urandom(100))
+        precompress.precompress_file(font_file, 'gz', self.logger)
+        self.assertEqual(self.compressed_names(), [])
+
+    def test_incremental(self):
+        font_file = self.write('A.ttf', b'\0' * 1000)
+        compressed_path = font_file.full_path + '.gz'
+        precompress.precompress_file(font_file, 'gz', self.logger)
+        with open(compressed_path, 'wb') as fout:
+            fout.write(b'stale')
+        precompress.precompress_file(font_file, 'gz', self.logger, True)
+        with open(compressed_path, 'rb') as fin:
+            self.assertEqual(fin.read(), b'stale')
+        # A copy older than the file is written again
+        os.utime(compressed_path, ns=(0, 0))
+        precompress.precompress_file(font_file, 'gz', self.logger, True)
+        with gzip.open(compressed_path) as fin:
+            self.assertEqual(fin.read(), b'\0' * 1000)
+
+    @unittest.skipIf(brotli is None, 'requires brotli')
+    def test_brotli(self):
+        font_file = self.write('A.ttf', b'\0' * 1000)
+        precompress.precompress_file(font_file, 'br', self.logger)
+        with open(font_file.full_path + '.br', 'rb') as fin:
+            self.assertEqual(brotli.decompress(fin.read()), b'\0' * 1000)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import io
+import logging
+import zipfile
+import threading
+import http.client
+import unittest
+import unittest.mock
+
+from webfont_generator import server
+
+try:
+    import fontTools
+except ImportError:
+    fontTools = None
+
+from .fonts import build_font
+
+class TestRequestHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.service = server.ConversionService(1, queue_size=1,
+            engines=frozenset(['native-woff']),
+            logger=logging.getLogger('test'))
+        self.service.logger.disabled = True
+        self.addCleanup(setattr, self.service.logger, 'disabled', False)
+        self.service.start()
+        self.addCleanup(self.service.stop)
+        self.server = server.ConversionServer(('127.0.0.1', 0), self.service,
+            max_upload_size=1024 ** 2)
+        thread = threading.Thread(target=self.server.serve_forever,
+            kwargs={ 'poll_interval' : 0.01 })
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def post(self, url, body=b'', headers=()):
+        """Send a POST request with exactly the given headers, and return
+        the response and its body."""
+        connection = http.client.HTTPConnection(*self.server.server_address)
+        self.addCleanup(connection.close)
+        connection.putrequest('POST', url)
+        for name, value in headers:
+            connection.putheader(name, value)
+        connection.endheaders(body)
+        response = connection.getresponse()
+        return response, response.read()
+
+    def test_missing_length(self):
+        response, body = self.post('/convert?filename=A.ttf')
+        self.assertEqual(response.status, 411)
+        self.assertEqual(response.getheader('Connection'), 'close')
+
+    def test_negative_length(self):
+        response, body = self.post('/convert?filename=A.ttf',
+            headers=[('Content-Length', '-1')])
+        self.assertEqual(response.status, 400)
+        self.assertEqual(response.getheader('Connection'), 'close')
+
+    def test_too_large(self):
+        response, body = self.post('/convert?filename=A.ttf',
+            headers=[('Content-Length', str(1024 ** 2 + 1))])
+        self.assertEqual(response.status, 413)
+        self.assertEqual(response.getheader('Connection'), 'close')
+
+    def test_bad_font(self):
+        data = b'not a font'
+        response, body = self.post('/convert?filename=A.ttf', data,
+            [('Content-Length', str(len(data)))])
+        self.assertEqual(response.status, 400)
+
+    @unittest.skipIf(fontTools is None, 'requires fontTools')
+    def test_queue_full(self):
+        data = build_font()
+        with unittest.mock.patch.object(self.service, 'submit',
+                side_effect=server.queue.Full):
+            response, body = self.post('/convert?filename=A.ttf&formats=woff',
+                data, [('Content-Length', str(len(data)))])
+        self.assertEqual(response.status, 503)
+        self.assertEqual(response.getheader('Retry-After'), '1')
+
+    @unittest.skipIf(fontTools is None, 'requires fontTools')
+    def test_zip_round_trip(self):
+        data = build_font()
+        response, body = self.post('/convert?filename=A.ttf&formats=woff',
+            data, [('Content-Length', str(len(data)))])
+        self.assertEqual(response.status, 200, body)
+        self.assertEqual(response.getheader('Content-Type'), 'application/zip')
+        with zipfile.ZipFile(io.BytesIO(body)) as archive:
+            self.assertEqual(sorted(archive.namelist()), ['A.css', 'A.woff'])
+            self.assertEqual(archive.read('A.woff')[:4], b'wOFF')
+            self.assertIn(b'A.woff', archive.read('A.css'))
+        self.assertEqual(self.service.metrics.responses[200], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+import io
+import struct
+import unittest
+
+from webfont_generator import woff
+from webfont_generator.error import Error
+from webfont_generator.operations import FontFile
+from webfont_generator.sniff import (sniff_format, check_font_files,
+    font_metadata, FontMetadata, EOT_HEADER, EOT_MAGIC_NUMBER,
+    EOT_FAMILY_NAME_OFFSET)
+
+try:
+    import fontTools
+except ImportError:
+    fontTools = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from .fonts import build_font
+
+def font_file(data, format):
+    return FontFile('A.' + format, 'A', format, data, in_memory=True)
+
+def build_eot(family, weight, italic, font_data=b'\0' * 16):
+    """Return an EOT file with the given header fields around `font_data`."""
+    family_name = family.encode('utf-16-le')
+    # The fields between the fixed header and the family name are left zero
+    body = b''.join([
+        b'\0' * (EOT_FAMILY_NAME_OFFSET - EOT_HEADER.size),
+        struct.pack('<H', len(family_name)),
+        family_name,
+        font_data ])
+    size = EOT_HEADER.size + len(body)
+    header = EOT_HEADER.pack(size, len(font_data), 0x00020001, 0,
+        b'\0' * 10, 1, 1 if italic else 0, weight, 0, EOT_MAGIC_NUMBER)
+    return header + body
+
+class TestSniffFormat(unittest.TestCase):
+
+    def test_signatures(self):
+        for header, format in [
+                (b'\x00\x01\x00\x00\x00\x0a', 'ttf'),
+                (b'true\x00\x0a', 'ttf'),
+                (b'OTTO\x00\x0a', 'otf'),
+                (b'wOFF\x00\x01\x00\x00', 'woff'),
+                (b'wOF2\x00\x01\x00\x00', 'woff2'),
+                (build_eot('Fam', 400, False)[:100], 'eot'),
+                (b'\xef\xbb\xbf<?xml version="1.0"?>\n<svg>', 'svg'),
+                (b'  <!DOCTYPE svg>\n<svg xmlns="">', 'svg') ]:
+            with self.subTest(format=format):
+                self.assertEqual(sniff_format(header), format)
+
+    def test_unknown(self):
+        for header in [b'', b'PK\x03\x04', b'<html></html>', b'\0' * 64]:
+            with self.subTest(header=header):
+                self.assertIsNone(sniff_format(header))
+
+class TestEot(unittest.TestCase):
+
+    def test_metadata(self):
+        self.assertEqual(
+            font_metadata([font_file(build_eot('My Font', 300, True), 'eot')]),
+            FontMetadata('My Font', 300, 'italic'))
+        self.assertEqual(
+            font_metadata([font_file(build_eot('Fam', 7, False), 'eot')]),
+            FontMetadata('Fam', 700, 'normal'))
+
+    def test_wrong_size(self):
+        data = build_eot('Fam', 400, False)
+        for bad_data in [data + b'\0', data[:-1]]:
+            with self.assertRaisesRegex(Error, 'A.eot is corrupt'):
+                check_font_files([font_file(bad_data, 'eot')])
+
+    def test_font_data_too_long(self):
+        data = bytearray(build_eot('Fam', 400, False))
+        struct.pack_into('<I', data, 4, len(data) + 1)
+        with self.assertRaisesRegex(Error, 'font data'):
+            check_font_files([font_file(bytes(data), 'eot')])
+
+@unittest.skipIf(fontTools is None, 'requires fontTools')
+class TestSfnt(unittest.TestCase):
+
+    def test_metadata(self):
+        for format, data in [
+                ('ttf', build_font('Sans', 300, True)),
+                ('otf', build_font('Sans', 300, True, cff=True)),
+                ('woff', woff.encode(build_font('Sans', 300, True))) ]:
+            with self.subTest(format=format):
+                self.assertEqual(font_metadata([font_file(data, format)]),
+                    FontMetadata('Sans', 300, 'italic'))
+
+    def test_old_weight_scale(self):
+        self.assertEqual(
+            font_metadata([font_file(build_font(weight=7), 'ttf')]),
+            FontMetadata('Test', 700, 'normal'))
+
+    def test_typographic_family_name(self):
+        from fontTools.ttLib import TTFont
+        font = TTFont(io.BytesIO(build_font('Sans Light')))
+        font['name'].setName('Sans', 16, 3, 1, 0x409)
+        fout = io.BytesIO()
+        font.save(fout)
+        self.assertEqual(
+            font_metadata([font_file(fout.getvalue(), 'ttf')]).family, 'Sans')
+
+    def test_ttf_and_otf_interchangeable(self):
+        check_font_files([font_file(build_font(cff=True), 'ttf'),
+            font_file(build_font(), 'otf')])
+
+    def test_mislabeled(self):
+        with self.assertRaisesRegex(Error, 'A.woff is a ttf file, not woff'):
+            check_font_files([font_file(build_font(), 'woff')])
+
+    def test_truncated(self):
+        for format, data in [
+                ('ttf', build_font()),
+                ('woff', woff.encode(build_font())),
+                ('woff2', build_font(flavor='woff2')) ]:
+            with self.subTest(format=format):
+                with self.assertRaisesRegex(Error, 'A.%s is corrupt' % format):
+                    check_font_files([font_file(data[:len(data) // 2], format)])
+
+    @unittest.skipIf(brotli is None, 'requires brotli')
+    def test_woff2_metadata(self):
+        self.assertEqual(
+            font_metadata([font_file(build_font('Sans', 300, True,
+                flavor='woff2'), 'woff2')]),
+            FontMetadata('Sans', 300, 'italic'))
+        self.assertEqual(
+            font_metadata([font_file(build_font('Mono', cff=True,
+                flavor='woff2'), 'woff2')]),
+            FontMetadata('Mono', 400, 'normal'))
+
+class TestSvg(unittest.TestCase):
+
+    def test_metadata(self):
+        data = (b'<?xml version="1.0"?>\n<svg><defs><font id="A">'
+            b'<font-face font-family="Serif &amp; Co" font-weight="bold" '
+            b"font-style='italic'/></font></defs></svg>")
+        self.assertEqual(font_metadata([font_file(data, 'svg')]),
+            FontMetadata('Serif & Co', 700, 'italic'))
+
+    def test_no_font_face(self):
+        data = b'<svg><defs><font id="A"></font></defs></svg>'
+        self.assertEqual(font_metadata([font_file(data, 'svg')]),
+            FontMetadata(None, None, None))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+import os
+import logging
+import tempfile
+import unittest
+
+from webfont_generator import spool
+from webfont_generator.batch import Family
+from webfont_generator.error import Error
+from webfont_generator.family import ConversionOptions, parse_output_formats
+
+try:
+    import fontTools
+except ImportError:
+    fontTools = None
+
+from .fonts import build_font
+
+class TestSpool(unittest.TestCase):
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.dir = temp_dir.name
+        self.spool = spool.Spool(os.path.join(self.dir, 'spool'))
+        self.options = spool.job_options(ConversionOptions(
+            parse_output_formats('woff'), engines=frozenset(['native-woff'])),
+            None, None)
+        self.logger = logging.getLogger('test')
+        self.logger.disabled = True
+        self.addCleanup(setattr, self.logger, 'disabled', False)
+
+    def submit(self, *names):
+        families = [Family(name, [os.path.join(self.dir, name + '.ttf')])
+            for name in names]
+        return self.spool.submit(families, os.path.join(self.dir, 'out'),
+            self.options)
+
+    def listing(self, directory):
+        return sorted(os.listdir(os.path.join(self.spool.path, directory)))
+
+    def make_stale(self, job):
+        os.utime(job.claim_path, (0, 0))
+
+    def outcome(self, batch_id, index=0):
+        return self.spool.batch_results(batch_id)[index][1]
+
+    def test_claim_in_order(self):
+        batch_id = self.submit('A', 'B')
+        first = self.spool.claim()
+        second = self.spool.claim()
+        self.assertEqual([first.record['family'], second.record['family']],
+            ['A', 'B'])
+        self.assertIsNone(self.spool.claim())
+        self.assertEqual(self.listing('jobs'), [])
+        self.assertEqual(len(self.listing('claimed')), 2)
+        self.assertEqual(first.record['input_files'],
+            [os.path.join(self.dir, 'A.ttf')])
+        self.assertEqual(self.spool.batch_results(batch_id),
+            [('A', None), ('B', None)])
+
+    def test_finish(self):
+        batch_id = self.submit('A')
+        job = self.spool.claim()
+        self.assertTrue(self.spool.heartbeat(job))
+        self.assertTrue(self.spool.finish(job, 'broken', 'worker', 1.0))
+        outcome = self.outcome(batch_id)
+        self.assertEqual((outcome['status'], outcome['error'],
+            outcome['attempts']), ('failed', 'broken', 1))
+        self.assertEqual(self.listing('claimed'), [])
+
+    def test_release(self):
+        self.submit('A')
+        job = self.spool.claim()
+        self.spool.release(job)
+        self.assertEqual(self.spool.claim().id, job.id)
+
+    def test_fresh_claim_is_kept(self):
+        self.submit('A')
+        self.spool.claim()
+        self.spool.recover_stale_claims(60, self.logger)
+        self.assertEqual(len(self.listing('claimed')), 1)
+        self.assertEqual(self.listing('jobs'), [])
+
+    def test_stale_claim_is_put_back(self):
+        batch_id = self.submit('A')
+        job = self.spool.claim()
+        self.make_stale(job)
+        self.spool.recover_stale_claims(60, self.logger)
+        # The claim is lost, so the first worker cannot record an outcome
+        self.assertFalse(self.spool.heartbeat(job))
+        self.assertFalse(self.spool.finish(job, None, 'first', 1.0))
+        self.assertIsNone(self.outcome(batch_id))
+        second_job = self.spool.claim()
+        self.assertEqual(second_job.id, job.id)
+        self.assertEqual(second_job.record['attempts'], 1)
+        self.assertNotEqual(second_job.claim_path, job.claim_path)
+        self.assertTrue(self.spool.finish(second_job, None, 'second', 1.0))
+        outcome = self.outcome(batch_id)
+        self.assertEqual((outcome['status'], outcome['worker'],
+            outcome['attempts']), ('ok', 'second', 2))
+
+    def test_max_attempts(self):
+        batch_id = self.submit('A')
+        for attempt in range(spool.MAX_ATTEMPTS):
+            self.assertIsNone(self.outcome(batch_id))
+            job = self.spool.claim()
+            self.assertEqual(job.record['attempts'], attempt)
+            self.make_stale(job)
+            self.spool.recover_stale_claims(60, self.logger)
+        self.assertIsNone(self.spool.claim())
+        outcome = self.outcome(batch_id)
+        self.assertEqual((outcome['status'], outcome['error']),
+            ('failed', 'abandoned by %d workers' % spool.MAX_ATTEMPTS))
+
+    def test_stale_claim_of_finished_job(self):
+        batch_id = self.submit('A')
+        job = self.spool.claim()
+        # The worker died between recording the outcome and removing its
+        # claim
+        self.spool._finish(job.record, None, 'worker', 1.0)
+        self.make_stale(job)
+        self.spool.recover_stale_claims(60, self.logger)
+        self.assertEqual(self.listing('claimed'), [])
+        self.assertEqual(self.listing('jobs'), [])
+        self.assertEqual(self.outcome(batch_id)['status'], 'ok')
+
+    def test_unknown_batch(self):
+        with self.assertRaisesRegex(Error, 'No batch'):
+            self.spool.batch_results('missing')
+
+    def test_wait_for_batch_timeout(self):
+        batch_id = self.submit('A', 'B')
+        with self.assertRaisesRegex(Error, '2 of 2 font families'):
+            spool.wait_for_batch(self.spool, batch_id, 0.01, 0)
+
+    @unittest.skipIf(fontTools is None, 'requires fontTools')
+    def test_run_worker(self):
+        with open(os.path.join(self.dir, 'A.ttf'), 'wb') as fout:
+            fout.write(build_font('A'))
+        batch_id = self.submit('A', 'Missing')
+        spool.run_worker(self.spool, self.logger, exit_when_idle=True)
+        (family_a, error_a), (family_b, error_b) = spool.wait_for_batch(
+            self.spool, batch_id, 0.01, 0)
+        self.assertIsNone(error_a)
+        self.assertIsNotNone(error_b)
+        self.assertTrue(os.path.isfile(
+            os.path.join(self.dir, 'out', 'A', 'A.woff')))
+        self.assertEqual(self.listing('claimed'), [])
+
+if __name__ == '__main__':
+    unittest.main()
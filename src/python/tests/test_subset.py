@@ -0,0 +1,122 @@
+import os
+import tempfile
+import unittest
+
+from webfont_generator import subset
+from webfont_generator.error import Error
+from webfont_generator.operations import FontFile
+
+try:
+    import fontTools
+except ImportError:
+    fontTools = None
+
+from .fonts import build_font
+
+class TestUnicodeRange(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(subset.parse_unicode_range('U+41-43, u+61,U+10FFFF'),
+            { 0x41, 0x42, 0x43, 0x61, 0x10FFFF })
+        for range_str in ['41', 'U+', 'U+XYZ', 'U+43-41', 'U+41,']:
+            with self.subTest(range_str):
+                with self.assertRaises(Error):
+                    subset.parse_unicode_range(range_str)
+
+    def test_format(self):
+        self.assertEqual(subset.format_unicode_range(
+            { 0x41, 0x42, 0x43, 0x61, 0x4E00 }), 'U+41-43, U+61, U+4E00')
+        latin = subset.parse_unicode_range(subset.NAMED_RANGES['latin'])
+        self.assertEqual(subset.parse_unicode_range(
+            subset.format_unicode_range(latin)), latin)
+
+class TestParseSubsets(unittest.TestCase):
+
+    def test_names(self):
+        specs = subset.parse_subsets(['latin,cyrillic', 'cjk:500',
+            'emoji=U+1F600-1F64F', 'other'])
+        self.assertEqual([(name, chunk_size)
+            for name, code_points, chunk_size in specs], [
+            ('latin', None), ('cyrillic', None), ('cjk', 500),
+            ('emoji', None), ('other', None)])
+        self.assertIn(0x4E00, specs[2][1])
+        self.assertEqual(len(specs[3][1]), 0x50)
+        self.assertIsNone(specs[4][1])
+        cjk, = subset.parse_subsets(['cjk'])
+        self.assertEqual(cjk[2], subset.DEFAULT_CJK_CHUNK_SIZE)
+
+    def test_errors(self):
+        for subset_strs, message in [
+                (['klingon'], 'Unrecognized subset'),
+                (['latin:5'], 'Unrecognized subset'),
+                (['cjk:0'], 'Invalid CJK chunk size'),
+                (['cjk:x'], 'Invalid CJK chunk size'),
+                (['latin', 'latin=U+41'], 'different names'),
+                (['custom=41'], 'Invalid Unicode range')]:
+            with self.subTest(subset_strs):
+                with self.assertRaisesRegex(Error, message):
+                    subset.parse_subsets(subset_strs)
+
+class TestSubsetSource(unittest.TestCase):
+
+    def test_preference(self):
+        files = [FontFile('A.' + f, 'A', f) for f in ['eot', 'woff', 'otf']]
+        self.assertEqual(subset.subset_source(files).format, 'otf')
+        with self.assertRaises(Error):
+            subset.subset_source(files[:1])
+
+@unittest.skipIf(fontTools is None, 'requires fontTools')
+class TestShards(unittest.TestCase):
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.dir = temp_dir.name
+        path = os.path.join(self.dir, 'A.ttf')
+        with open(path, 'wb') as fout:
+            fout.write(build_font(characters='ABéЖ一二三'))
+        self.input_file = FontFile(path, path[:-4], 'ttf')
+
+    def plan(self, subset_strs, frequency_order=()):
+        return [(shard.name, ''.join(sorted(map(chr, shard.code_points))))
+            for shard in subset.plan_shards(self.input_file,
+                subset.parse_subsets(subset_strs), frequency_order)]
+
+    def test_plan(self):
+        self.assertEqual(self.plan(['latin,greek,cjk:2,other']), [
+            ('latin', 'ABé'),
+            ('cjk-0', '一三'),
+            ('cjk-1', '二'),
+            ('other', 'Ж')])
+
+    def test_frequency_order(self):
+        self.assertEqual(self.plan(['cjk:2'], list(map(ord, '二A一'))), [
+            ('cjk-0', '一二'),
+            ('cjk-1', '三')])
+
+    def test_overlapping_shards(self):
+        # Named shards may overlap, but `other` gets only what is left
+        self.assertEqual(self.plan(['latin', 'first=U+41', 'other']), [
+            ('latin', 'ABé'),
+            ('first', 'A'),
+            ('other', 'Ж一三二')])
+
+    def test_no_characters(self):
+        with self.assertRaisesRegex(Error, 'no characters'):
+            self.plan(['greek'])
+
+    def test_write_shard(self):
+        from fontTools.ttLib import TTFont
+        shard = subset.Shard('latin', frozenset(map(ord, 'Aé')))
+        shard_file = subset.write_shard(self.input_file, shard, self.dir)
+        self.assertEqual(shard_file.full_path,
+            os.path.join(self.dir, 'A-latin.ttf'))
+        with TTFont(shard_file.full_path) as font:
+            self.assertEqual(set(font.getBestCmap()), set(shard.code_points))
+        # Writing the same shard again leaves the file alone
+        os.utime(shard_file.full_path, ns=(0, 0))
+        subset.write_shard(self.input_file, shard, self.dir)
+        self.assertEqual(os.stat(shard_file.full_path).st_mtime_ns, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import io
+import logging
+import unittest
+import unittest.mock
+import concurrent.futures
+
+from webfont_generator import woff
+from webfont_generator.error import Error
+from webfont_generator.operations import (FontFile,
+    convert_with_native_woff_decode)
+
+try:
+    import fontTools
+except ImportError:
+    fontTools = None
+
+from .fonts import build_font
+
+def sfnt_tables(data):
+    flavor, tables = woff._read_sfnt_tables(memoryview(data))
+    return flavor, {
+        tag : bytes(table_data) for tag, checksum, table_data in tables }
+
+@unittest.skipIf(fontTools is None, 'requires fontTools')
+class TestRoundTrip(unittest.TestCase):
+
+    def assert_round_trip(self, sfnt, expected_format, executor=None):
+        data, format = woff.decode(woff.encode(sfnt, executor))
+        self.assertEqual(format, expected_format)
+        self.assertEqual(sfnt_tables(data), sfnt_tables(sfnt))
+
+    def test_truetype(self):
+        self.assert_round_trip(build_font(), 'ttf')
+
+    def test_cff(self):
+        self.assert_round_trip(build_font(cff=True), 'otf')
+
+    def test_executor(self):
+        # Hand every table to the executor, however small
+        with unittest.mock.patch.object(woff, '_MIN_PARALLEL_TABLE_SIZE', 0), \
+                concurrent.futures.ThreadPoolExecutor(2) as executor:
+            self.assert_round_trip(build_font(), 'ttf', executor)
+            self.assert_round_trip(build_font(cff=True), 'otf', executor)
+
+    def test_fonttools_reads_output(self):
+        from fontTools.ttLib import TTFont
+        for cff in (False, True):
+            font = TTFont(io.BytesIO(woff.encode(build_font(cff=cff))))
+            self.assertEqual(font.flavor, 'woff')
+            self.assertEqual(font['name'].getDebugName(1), 'Test')
+            self.assertEqual('CFF ' in font, cff)
+
+    def test_decode_fonttools_output(self):
+        for cff, expected_format in ((False, 'ttf'), (True, 'otf')):
+            data, format = woff.decode(build_font(cff=cff, flavor='woff'))
+            self.assertEqual(format, expected_format)
+            self.assertEqual(sfnt_tables(data),
+                sfnt_tables(build_font(cff=cff)))
+
+@unittest.skipIf(fontTools is None, 'requires fontTools')
+class TestNativeDecodeOperation(unittest.TestCase):
+
+    def decode_to(self, data, format):
+        input_file = FontFile('A.woff', 'A', 'woff', data, in_memory=True)
+        output_file = FontFile('A.' + format, 'A', format, in_memory=True)
+        convert_with_native_woff_decode([input_file], [output_file],
+            logging.getLogger('test'))
+        return output_file.data
+
+    def test_matching_flavor(self):
+        self.assertEqual(sfnt_tables(self.decode_to(
+            woff.encode(build_font()), 'ttf'))[0], b'\x00\x01\x00\x00')
+        self.assertEqual(sfnt_tables(self.decode_to(
+            woff.encode(build_font(cff=True)), 'otf'))[0], b'OTTO')
+
+    def test_cff_to_ttf_rejected(self):
+        with self.assertRaisesRegex(Error, 'CFF outlines'):
+            self.decode_to(woff.encode(build_font(cff=True)), 'ttf')
+
+class TestBadInput(unittest.TestCase):
+
+    def test_encode_not_sfnt(self):
+        with self.assertRaises(Error):
+            woff.encode(b'not a font at all')
+
+    def test_decode_bad_signature(self):
+        with self.assertRaises(Error):
+            woff.decode(b'x' * woff.WOFF_HEADER.size)
+
+    def test_decode_truncated(self):
+        with self.assertRaises(Error):
+            woff.decode(b'wOFF')
+
+    @unittest.skipIf(fontTools is None, 'requires fontTools')
+    def test_decode_cut_short(self):
+        data = woff.encode(build_font())
+        with self.assertRaises(Error):
+            woff.decode(data[:len(data) // 2])
+
+if __name__ == '__main__':
+    unittest.main()
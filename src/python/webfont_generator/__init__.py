@@ -0,0 +1,6 @@
+"""Convert fonts to web-friendly formats and generate @font-face CSS for
+them. See generate_webfonts."""
+
+from .error import Error
+from .api import generate_webfonts, GeneratedFonts
+from .aio import AsyncConverter
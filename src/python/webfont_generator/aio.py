@@ -0,0 +1,302 @@
+"""Converting fonts from an asyncio event loop. The external tools run as
+child processes started with asyncio.create_subprocess_exec, so waiting for
+them does not tie up a thread, and a semaphore for every tool limits how many
+conversions it runs at once. Cancelling a conversion kills the processes
+running on its behalf."""
+
+import os
+import time
+import asyncio
+import contextlib
+import subprocess
+
+from . import graph
+from .operations import (copy_file, convert_with_fontforge,
+    convert_with_sfntly, convert_with_woff2_compress,
+    convert_with_woff2_decompress, convert_with_fonttools_woff2_compress,
+    convert_with_fonttools_woff2_decompress, convert_with_native_woff_encode,
+    convert_with_native_woff_decode, FONTFORGE_COMMAND, fontforge_commands,
+    check_fontforge_replies, check_fontforge_outputs, SFNTLY_SERVER_COMMAND,
+    sfntly_request, check_sfntly_reply, sfntly_command, WOFF2_COMPRESS_PATH,
+    WOFF2_DECOMPRESS_PATH, ensure_file_directory_exists, files_on_disk,
+    CONVERTER_TIMEOUT)
+from .workers import AsyncWorkerProcess
+from .dependencies import DEFAULT_ENGINES, noop, make_dependency_tree
+from .incremental import BuildState
+from .error import Error
+
+# The tool which runs every operation, for limiting how many conversions
+# each tool runs at once
+TOOLS = {
+    copy_file : 'copy',
+    convert_with_fontforge : 'fontforge',
+    convert_with_sfntly : 'sfntly',
+    convert_with_woff2_compress : 'woff2',
+    convert_with_woff2_decompress : 'woff2',
+    convert_with_fonttools_woff2_compress : 'fonttools',
+    convert_with_fonttools_woff2_decompress : 'fonttools',
+    convert_with_native_woff_encode : 'native-woff',
+    convert_with_native_woff_decode : 'native-woff'
+}
+
+DEFAULT_LIMIT = os.cpu_count() or 1
+
+class AsyncFontForgeWorker(AsyncWorkerProcess):
+
+    timeout = CONVERTER_TIMEOUT
+
+    def __init__(self):
+        super().__init__('FontForge', FONTFORGE_COMMAND)
+
+    async def _wait_until_ready(self):
+        # Skip anything FontForge prints before it starts running the script
+        while await self._read_reply() != 'ready':
+            pass
+
+class AsyncSfntlyWorker(AsyncWorkerProcess):
+
+    timeout = CONVERTER_TIMEOUT
+
+    def __init__(self):
+        super().__init__('sfntly', SFNTLY_SERVER_COMMAND)
+
+async def run_command(command, timeout=CONVERTER_TIMEOUT):
+    """Run a command with its standard streams connected to /dev/null, and
+    return its exit status. If cancelled, or if it takes longer than
+    `timeout` seconds, kill the process."""
+    process = await asyncio.create_subprocess_exec(*command,
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL)
+    try:
+        return await asyncio.wait_for(process.wait(), timeout)
+    except asyncio.TimeoutError:
+        await _kill_process(process)
+        raise Error('%s did not finish within %d seconds, so it was killed' % (
+            os.path.basename(command[0]), timeout))
+    except asyncio.CancelledError:
+        await _kill_process(process)
+        raise
+
+async def _kill_process(process):
+    try:
+        process.kill()
+    except ProcessLookupError:
+        pass
+    await process.wait()
+
+async def process_tree_async(dependency_tree, process):
+    """The counterpart of dependencies.process_tree. `process` is a
+    coroutine function which is called on every vertex once all of its
+    incoming edges are satisfied. Independent vertices are processed
+    concurrently, and errors are reported in the same deterministic way. If
+    this is cancelled, every vertex being processed is cancelled and waited
+    for."""
+    vertices = list(graph.preorder_traversal(dependency_tree))
+    order = { v : i for i, v in enumerate(vertices) }
+    unsatisfied = { v : len(v.incoming_edges) for v in vertices }
+    errors = {}
+    running = {}
+    def submit(vertex):
+        running[asyncio.ensure_future(process(vertex))] = vertex
+    submit(dependency_tree)
+    try:
+        while running:
+            done, not_done = await asyncio.wait(
+                running, return_when=asyncio.FIRST_COMPLETED)
+            # Schedule dependents in a deterministic order
+            for task in sorted(done, key=lambda t: order[running[t]]):
+                vertex = running.pop(task)
+                error = task.exception()
+                if error is not None:
+                    errors[vertex] = error
+                    continue
+                for edge in vertex.outgoing_edges:
+                    unsatisfied[edge.vertex_to] -= 1
+                    if not unsatisfied[edge.vertex_to]:
+                        submit(edge.vertex_to)
+    except asyncio.CancelledError:
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        raise
+    if errors:
+        raise errors[min(errors, key=order.get)]
+
+class AsyncConverter(object):
+    """Converts fonts from an asyncio event loop, so that many fonts can be
+    converted at once without a thread for each.
+
+    `limits` maps the names of tools (fontforge, sfntly, woff2, fonttools,
+    native-woff and copy) to the maximum number of conversions which each
+    runs at once. Tools which are not given get one per CPU. FontForge and
+    sfntly run as persistent processes, as many of each as its limit allows.
+    The tools which run in-process run in `executor`, or in the event loop's
+    default executor if it is None.
+
+    A converter belongs to the event loop in which it is created. Its
+    processes are stopped by `close`, or on leaving `async with`."""
+
+    def __init__(self, limits=None, executor=None):
+        limits = dict(limits or ())
+        tools = set(TOOLS.values())
+        unknown_tools = sorted(set(limits) - tools)
+        if unknown_tools:
+            raise Error('Unrecognized tools: %s' % ', '.join(unknown_tools))
+        self._semaphores = {
+            tool : asyncio.Semaphore(limits.get(tool, DEFAULT_LIMIT))
+            for tool in tools }
+        self._executor = executor
+        self._workers = []
+        self._idle_workers = { AsyncFontForgeWorker : [], AsyncSfntlyWorker : [] }
+        # Operations which run external tools; the others run in the executor
+        self._operations = {
+            convert_with_fontforge : self._convert_with_fontforge,
+            convert_with_sfntly : self._convert_with_sfntly,
+            convert_with_woff2_compress : self._convert_with_woff2_compress,
+            convert_with_woff2_decompress : self._convert_with_woff2_decompress
+        }
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        """Stop the FontForge and sfntly processes."""
+        for worker in self._workers:
+            await worker.close()
+        self._workers = []
+        for idle in self._idle_workers.values():
+            del idle[:]
+
+    async def convert_files(self, input_files, output_dir, output_formats,
+            logger, cache=None, incremental=False, engines=DEFAULT_ENGINES,
+            cost_model=None):
+        """The counterpart of dependencies.convert_files. Return a dict
+        mapping the output formats to the output files."""
+        dependency_tree, output_files = make_dependency_tree(input_files,
+            output_dir, output_formats, engines, cost_model=cost_model)
+        state = BuildState(output_dir) if incremental else None
+        try:
+            await process_tree_async(dependency_tree,
+                lambda v: self.process(v, logger, cache, state, cost_model))
+        finally:
+            if state is not None:
+                await self._call(state.save)
+            if cost_model is not None:
+                await self._call(cost_model.save)
+        return output_files
+
+    async def process(self, vertex, logger, cache=None, state=None,
+            cost_model=None):
+        """The counterpart of TreeVertex.process."""
+        if vertex.value is noop:
+            return
+        input_files = [e.file for e in vertex.incoming_edges]
+        output_files = [e.file for e in vertex.outgoing_edges]
+        if state is not None and await self._call(
+                state.is_current, vertex.value, input_files, output_files):
+            logger.info('skipping %s, already up to date' % ', '.join(
+                f.full_path for f in output_files))
+            return
+        if any(f.in_memory for f in input_files + output_files):
+            # Files held in memory are not cached
+            cache = None
+        entries = None
+        from_cache = False
+        if cache is not None and cache.handles(vertex.value):
+            entries = await self._call(cache.restore,
+                vertex.value, input_files, output_files, logger)
+            from_cache = entries is None
+        if not from_cache:
+            seconds = await self.run(
+                vertex.value, input_files, output_files, logger)
+            if entries is not None:
+                await self._call(cache.store, entries)
+            if cost_model is not None:
+                cost_model.record(vertex.value, input_files, output_files, seconds)
+        if state is not None:
+            state.update(vertex.value, input_files, output_files)
+
+    async def run(self, operation, input_files, output_files, logger):
+        """Run an operation from a conversion plan once its tool has a free
+        slot. Return the number of seconds it took, not counting the wait."""
+        convert = self._operations.get(operation)
+        async with self._semaphores[TOOLS[operation]]:
+            start_time = time.perf_counter()
+            if convert is None:
+                await self._call(operation, input_files, output_files, logger)
+            elif any(f.in_memory for f in input_files + output_files):
+                # The external tools need real files
+                with files_on_disk(input_files, output_files) as (
+                        disk_input_files, disk_output_files):
+                    await convert(disk_input_files, disk_output_files, logger)
+            else:
+                await convert(input_files, output_files, logger)
+            return time.perf_counter() - start_time
+
+    async def _call(self, function, *args):
+        future = asyncio.get_running_loop().run_in_executor(
+            self._executor, function, *args)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # A thread cannot be interrupted, so wait for it to finish, lest
+            # it go on writing files after the cancellation
+            await asyncio.wait([future])
+            raise
+
+    @contextlib.asynccontextmanager
+    async def _worker(self, worker_class):
+        # The semaphore of the tool is held, so there are never more
+        # workers than its limit
+        idle = self._idle_workers[worker_class]
+        if idle:
+            worker = idle.pop()
+        else:
+            worker = worker_class()
+            self._workers.append(worker)
+        try:
+            yield worker
+        finally:
+            idle.append(worker)
+
+    async def _convert_with_fontforge(self, input_files, output_files, logger):
+        input_path = input_files[0].full_path
+        output_paths = [f.full_path for f in output_files]
+        logger.info('using FontForge to convert %s to %s' % (input_path, ', '.join(output_paths)))
+        ensure_file_directory_exists(output_paths[0])
+        async with self._worker(AsyncFontForgeWorker) as worker:
+            replies, output = await worker.request(
+                fontforge_commands(input_path, output_paths))
+        check_fontforge_replies(replies, output)
+        check_fontforge_outputs(output_paths, output)
+
+    async def _convert_with_sfntly(self, input_files, output_files, logger):
+        input_path = input_files[0].full_path
+        output_paths = [f.full_path for f in output_files]
+        logger.info('using sfntly to convert %s to %s' % (input_path, ', '.join(output_paths)))
+        ensure_file_directory_exists(output_paths[0])
+        request = sfntly_request(input_path, output_paths)
+        if request is None:
+            # These file names cannot be sent to the server, so fall back to
+            # running a separate JVM
+            if await run_command(sfntly_command(input_path, output_paths)) != 0:
+                raise Error('sfntly conversion failed')
+        else:
+            async with self._worker(AsyncSfntlyWorker) as worker:
+                (reply,), output = await worker.request([request])
+            check_sfntly_reply(reply)
+
+    async def _convert_with_woff2_compress(self, input_files, output_files, logger):
+        input_path = input_files[0].full_path
+        logger.info('using woff2_compress to convert %s to woff2' % input_path)
+        if await run_command([WOFF2_COMPRESS_PATH, input_path]) != 0:
+            raise Error('conversion with woff2_compress failed')
+
+    async def _convert_with_woff2_decompress(self, input_files, output_files, logger):
+        input_path = input_files[0].full_path
+        logger.info('using woff2_decompress to convert %s to ttf' % input_path)
+        if await run_command([WOFF2_DECOMPRESS_PATH, input_path]) != 0:
+            raise Error('conversion with woff2_decompress failed')
@@ -0,0 +1,58 @@
+"""Converting fonts held in memory, for use as a library."""
+
+import io
+import logging
+import collections
+
+from .family import (input_font_files, parse_output_formats,
+    group_faces, generate_family, ConversionOptions)
+from .dependencies import DEFAULT_ENGINES
+
+GeneratedFonts = collections.namedtuple('GeneratedFonts', ['files', 'css'])
+GeneratedFonts.__doc__ = """The result of generate_webfonts. `files` maps the
+names of the generated font files to their contents, as bytes, and `css` is
+the @font-face rule for them."""
+
+def generate_webfonts(fonts, formats=None, font_family=None, prefix='',
+        threads=1, engines=DEFAULT_ENGINES, logger=None, profiler=None,
+        font_display=None):
+    """Convert fonts held in memory to web-friendly formats and generate
+    their CSS, without writing any files where the converters allow it.
+
+    `fonts` maps file names, whose extensions give the formats of the fonts
+    (or, for names without extensions, the contents do), to their contents,
+    as bytes-like objects or binary file objects. The fonts may be several
+    faces of a family, each of which gets its own @font-face rule, and the
+    names of the generated files are those of the first font of each face.
+    `formats` is a list of output formats, each of which may be suffixed with
+    `:inline`, as for the --format option. URLs in the CSS are the names of
+    the generated files prefixed with `prefix`. Return a GeneratedFonts
+    tuple holding the files in the requested formats which are not inlined.
+
+    The fonttools and native-woff engines work entirely in memory. Other
+    converters are given temporary files, but their processes are reused
+    from one call to the next. Every stage is timed with `profiler` if
+    given. `font_display` is the font-display of the rules, if given."""
+    if logger is None:
+        logger = logging.getLogger('webfont-generator')
+    input_files = input_font_files(list(fonts.keys()), [
+        source.read() if hasattr(source, 'read') else source
+        for source in fonts.values() ])
+    parsed_output_formats = parse_output_formats(
+        None if formats is None else ','.join(formats))
+    css_fout = io.StringIO()
+    options = ConversionOptions(parsed_output_formats, prefix=prefix,
+        font_family=font_family, font_display=font_display, threads=threads,
+        engines=engines)
+    result = generate_family(input_files, None, options, logger, css_fout,
+        profiler=profiler)
+    if len(group_faces(input_files)) == 1:
+        output_files_dicts = [result]
+    else:
+        # The result maps the name of every face to its output files
+        output_files_dicts = result.values()
+    files = collections.OrderedDict(
+        (output_files_dict[f].basename(), bytes(output_files_dict[f].data))
+        for output_files_dict in output_files_dicts
+        for f, inline in parsed_output_formats if not inline)
+    return GeneratedFonts(files, css_fout.getvalue())
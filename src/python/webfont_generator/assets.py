@@ -0,0 +1,97 @@
+"""Naming output files after their contents, so that web servers can let
+clients cache them forever, and recording the names in an asset manifest."""
+
+import os
+import os.path
+import json
+import fcntl
+import shutil
+import hashlib
+
+from .operations import FontFile
+from .precompress import ENCODINGS
+
+ASSET_MANIFEST_FILE_NAME = 'asset-manifest.json'
+
+# Number of hex digits of the SHA-256 hash of the contents put in file names
+HASH_LENGTH = 8
+
+def content_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as fin:
+        for chunk in iter(lambda: fin.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()[:HASH_LENGTH]
+
+def logical_name(font_file):
+    """Return the name of a file without its content hash."""
+    return os.path.basename(font_file.path_without_extension) + \
+        os.extsep + font_file.format
+
+def add_content_hash(font_file, logger):
+    """Copy a file to a name which includes a hash of its contents, such as
+    `MyFont.1a2b3c4d.woff2`, and return the copy. The original is kept, since
+    later builds convert from it and check whether it is up to date. The copy
+    keeps the SVG font ID of the original, which does not change."""
+    digest = content_hash(font_file.full_path)
+    hashed_path = '%s.%s%s%s' % (font_file.path_without_extension, digest,
+        os.extsep, font_file.format)
+    # A file with this name has these contents, so it need not be copied
+    # again
+    if not os.path.isfile(hashed_path):
+        logger.info('copying %s to %s' % (font_file.full_path, hashed_path))
+        # Copy rather than link, since converters may overwrite the original
+        # in place
+        temp_path = hashed_path + '.tmp'
+        shutil.copyfile(font_file.full_path, temp_path)
+        os.replace(temp_path, hashed_path)
+    return FontFile(hashed_path, font_file.path_without_extension,
+        font_file.format)
+
+def update_asset_manifest(path, hashed_files, logger):
+    """Record in the JSON asset manifest at `path` that the logical name of
+    each of `hashed_files` now refers to it. Names are relative to the
+    directory of the manifest. Entries for other files are kept, and several
+    processes may update one manifest. The copies which the manifest listed
+    before for these files are deleted, along with their precompressed
+    copies, so that old copies do not pile up in the output directory."""
+    directory = os.path.dirname(path) or '.'
+    updated = {}
+    for hashed_file in hashed_files:
+        file_dir = os.path.relpath(
+            os.path.dirname(hashed_file.full_path) or '.', directory)
+        def relative(name):
+            return name if file_dir == os.curdir else '/'.join([file_dir, name])
+        updated[relative(logical_name(hashed_file))] = relative(
+            hashed_file.basename())
+    os.makedirs(directory, exist_ok=True)
+    # Hold a lock while reading and rewriting the file, so that entries
+    # recorded by other processes in the meantime are kept. The lock file is
+    # hidden, since the directory is likely to be deployed.
+    lock_path = os.path.join(directory, '.%s.lock' % os.path.basename(path))
+    with open(lock_path, 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            with open(path) as fin:
+                manifest = json.load(fin)
+        except (OSError, ValueError):
+            manifest = {}
+        old_names = set(
+            manifest[name] for name in updated
+            if name in manifest and manifest[name] != updated[name])
+        manifest.update(updated)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as fout:
+            json.dump(manifest, fout, indent=1, sort_keys=True)
+            fout.write('\n')
+        os.replace(temp_path, path)
+        # Delete the old copies only once the manifest no longer lists them
+        for old_name in old_names - set(manifest.values()):
+            old_path = os.path.join(directory, old_name)
+            logger.info('removing old copy %s' % old_path)
+            for stale_path in [old_path] + [
+                    old_path + os.extsep + ext for ext in ENCODINGS ]:
+                try:
+                    os.remove(stale_path)
+                except FileNotFoundError:
+                    pass
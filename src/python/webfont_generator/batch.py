@@ -0,0 +1,113 @@
+import io
+import os.path
+import glob
+import logging
+import multiprocessing
+
+from .error import Error
+from .operations import ensure_directory_exists
+from .dependencies import check_cancelled
+from .family import (input_font_files, default_prefix, default_font_family,
+    generate_family)
+
+class Family(object):
+    """A named group of input files which make up one font family."""
+
+    def __init__(self, name, input_file_names):
+        self.name = name
+        self.input_file_names = input_file_names
+
+def read_manifest(fin, base_dir=''):
+    """Read a batch manifest. Every non-blank line lists the input files of
+    one font family, separated by whitespace. Glob patterns are expanded, and
+    relative paths are relative to `base_dir`. Lines starting with `#` are
+    comments."""
+    families = []
+    names = set()
+    for line_no, line in enumerate(fin, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        input_file_names = []
+        for pattern in line.split():
+            pattern = os.path.join(base_dir, pattern)
+            # Leave patterns which match nothing alone so that the missing
+            # file is reported for this family
+            input_file_names.extend(sorted(glob.glob(pattern)) or [pattern])
+        name = default_font_family(input_file_names)
+        if name in names:
+            raise Error('line %d of manifest: duplicate font family %r' % (
+                line_no, name))
+        names.add(name)
+        families.append(Family(name, input_file_names))
+    return families
+
+def read_manifest_file(file_name):
+    with open(file_name) as fin:
+        return read_manifest(fin, os.path.dirname(file_name))
+
+def convert_families(families, output_dir, options, jobs, log_level,
+        cancelled=None):
+    """Convert a list of font families as set by `options`, a
+    ConversionOptions tuple, splitting them across a pool of `jobs` worker
+    processes, each of which runs up to `options.threads` conversions at a
+    time. Every family is written to its own subdirectory of `output_dir`,
+    along with the CSS and preload link files named in `options`, if any.
+    Yield a (family, error message) pair for every family in order, where
+    the error message is None if the family was converted successfully.
+
+    Once the threading.Event `cancelled`, if given, is set, nothing more is
+    written. It can only be given if `jobs` is 1, in which case the families
+    are converted in this process."""
+    tasks = [(family, output_dir, options, cancelled) for family in families]
+    if jobs == 1:
+        # Avoid the overhead of a process pool when it would not help
+        _init_worker(log_level)
+        results = map(_convert_family, tasks)
+        yield from zip(families, results)
+    else:
+        with multiprocessing.Pool(jobs, _init_worker, (log_level,)) as pool:
+            results = pool.imap(_convert_family, tasks)
+            yield from zip(families, results)
+
+def _init_worker(log_level):
+    logger = logging.getLogger('webfont-generator')
+    if not logger.handlers:
+        logger.addHandler(logging.StreamHandler())
+    logger.setLevel(log_level)
+
+def _convert_family(task):
+    family, output_dir, options, cancelled = task
+    logger = logging.getLogger('webfont-generator')
+    family_output_dir = os.path.join(output_dir, family.name)
+    if options.prefix is None:
+        family_prefix = default_prefix(family_output_dir)
+    else:
+        family_prefix = options.prefix + family.name + '/'
+    # Every family is named after its own input files
+    family_options = options._replace(prefix=family_prefix, font_family=None)
+    css_file_name = options.css_file_name
+    preload_file_name = options.preload_file_name
+    try:
+        input_files = input_font_files(family.input_file_names)
+        # Only write the CSS and preload files once the family has been
+        # converted
+        css_fout = None if css_file_name is None else io.StringIO()
+        preload_fout = None if preload_file_name is None else io.StringIO()
+        generate_family(input_files, family_output_dir, family_options,
+            logger, css_fout, preload_fout, cancelled=cancelled)
+        check_cancelled(cancelled)
+        for file_name, fout in [(css_file_name, css_fout),
+                (preload_file_name, preload_fout)]:
+            if fout is not None:
+                ensure_directory_exists(family_output_dir)
+                with open(os.path.join(family_output_dir, file_name),
+                        'w') as family_fout:
+                    family_fout.write(fout.getvalue())
+    except Error as e:
+        return str(e)
+    except Exception as e:
+        # Report anything unexpected against this family rather than
+        # bringing down the whole batch
+        return '%s: %s' % (type(e).__name__, e)
+    return None
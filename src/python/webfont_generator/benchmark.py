@@ -0,0 +1,242 @@
+import os
+import os.path
+import json
+import shutil
+import random
+import statistics
+import collections
+
+from .error import Error
+from .operations import FontFile, copy_file, ensure_directory_exists
+from .dependencies import (FORMATS, construct_dependency_graph, convert_files,
+    make_file_dicts, noop)
+from .measure import Measurement
+from .workers import close_workers
+
+# Synthetic fonts, from a small Latin font to a CJK-sized one, by number of
+# glyphs
+SYNTHETIC_FONTS = collections.OrderedDict([
+    ('latin', 200),
+    ('latin-ext', 1000),
+    ('large', 5000),
+    ('cjk', 30000)
+])
+
+# Blocks of code points assigned to the glyphs of synthetic fonts, in order
+_CODE_POINT_RANGES = [
+    (0x0020, 0x007E), (0x00A0, 0x024F), (0x0370, 0x03FF), (0x0400, 0x04FF),
+    (0x4E00, 0x9FFF), (0x3400, 0x4DBF), (0x20000, 0x2A6DF)
+]
+
+DEFAULT_FORMAT_SETS = [
+    ['eot', 'woff2', 'woff', 'ttf', 'svg'],
+    ['woff2', 'woff'],
+    ['woff2']
+]
+
+METRICS = ['wall_time', 'user_time', 'system_time', 'child_user_time',
+    'child_system_time', 'peak_rss', 'peak_child_rss']
+
+def _code_points(n):
+    for first, last in _CODE_POINT_RANGES:
+        for c in range(first, last + 1):
+            if not n:
+                return
+            yield c
+            n -= 1
+    raise ValueError('too many glyphs')
+
+def _draw_glyph(pen, rng):
+    # A few closed quadratic contours with random points, so that glyph
+    # data compresses roughly like real outlines do
+    for contour in range(rng.randint(1, 3)):
+        x0, y0 = rng.randint(50, 450), rng.randint(0, 350)
+        pen.moveTo((x0, y0))
+        for point in range(rng.randint(3, 8)):
+            pen.qCurveTo(
+                (rng.randint(0, 600), rng.randint(-100, 800)),
+                (rng.randint(0, 600), rng.randint(-100, 800)))
+        pen.closePath()
+
+def build_synthetic_font(path, family_name, num_glyphs, seed=0):
+    """Build a TrueType font with the given number of randomly drawn glyphs.
+    Requires fontTools."""
+    try:
+        from fontTools.fontBuilder import FontBuilder
+        from fontTools.pens.ttGlyphPen import TTGlyphPen
+    except ImportError:
+        raise Error('building synthetic fonts requires the fontTools package')
+    rng = random.Random(seed)
+    glyph_names = ['.notdef'] + ['g%d' % i for i in range(num_glyphs)]
+    builder = FontBuilder(1000, isTTF=True)
+    builder.setupGlyphOrder(glyph_names)
+    builder.setupCharacterMap({
+        c : 'g%d' % i for i, c in enumerate(_code_points(num_glyphs)) })
+    glyphs = {}
+    for name in glyph_names:
+        pen = TTGlyphPen(None)
+        _draw_glyph(pen, rng)
+        glyphs[name] = pen.glyph()
+    builder.setupGlyf(glyphs)
+    builder.setupHorizontalMetrics({ name : (600, 0) for name in glyph_names })
+    builder.setupHorizontalHeader(ascent=800, descent=-200)
+    builder.setupNameTable({ 'familyName' : family_name, 'styleName' : 'Regular' })
+    builder.setupOS2()
+    builder.setupPost()
+    ensure_directory_exists(os.path.dirname(path))
+    builder.save(path)
+
+def _measure(run, repeat, cold):
+    """Run a function `repeat` times and return the median of every metric,
+    or the error it raised. Unless `cold` is set, the function is run once
+    beforehand so that persistent workers are already running."""
+    if not cold:
+        try:
+            run()
+        except Error as e:
+            return { 'error' : str(e) }
+    samples = []
+    for i in range(repeat):
+        if cold:
+            close_workers()
+        try:
+            with Measurement() as m:
+                run()
+        except Error as e:
+            return { 'error' : str(e) }
+        samples.append(m.as_dict())
+    result = {
+        metric : statistics.median(s[metric] for s in samples)
+        for metric in METRICS }
+    result['samples'] = repeat
+    return result
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+def conversion_edges(input_files, output_dir, engines):
+    """List every conversion that the given engines can perform directly on
+    the given input files, as (operation, input file, output file)
+    triples."""
+    input_files_dict, output_files_dict = make_file_dicts(input_files, output_dir)
+    source_vertex, output_vertices = construct_dependency_graph(
+        input_files_dict, output_files_dict, engines)
+    edges = []
+    for input_edge in source_vertex.outgoing_edges:
+        for edge in input_edge.vertex_to.outgoing_edges:
+            operation_vertex = edge.vertex_to
+            if operation_vertex.value in (noop, copy_file):
+                continue
+            for output_edge in operation_vertex.outgoing_edges:
+                if output_edge.file.format == edge.file.format:
+                    continue
+                edges.append((operation_vertex.value, edge.file, output_edge.file))
+    return edges
+
+def run_benchmarks(work_dir, font_names, format_sets, engines, threads,
+        repeat, cold, logger):
+    """Time every conversion edge and a full conversion for every format
+    set, for each of the named synthetic fonts. Return a list of result
+    dicts."""
+    results = []
+    for font_name in font_names:
+        num_glyphs = SYNTHETIC_FONTS[font_name]
+        font_dir = os.path.join(work_dir, font_name)
+        ttf_path = os.path.join(font_dir, 'fonts', font_name + '.ttf')
+        logger.info('building synthetic font %s with %d glyphs' % (font_name, num_glyphs))
+        build_synthetic_font(ttf_path, font_name, num_glyphs)
+        ttf_file = FontFile(ttf_path, os.path.splitext(ttf_path)[0], 'ttf')
+        base = {
+            'font' : font_name,
+            'glyphs' : num_glyphs,
+            'input_size' : _file_size(ttf_path)
+        }
+        # Produce the font in every format that can be produced, to serve as
+        # inputs for the individual conversions
+        inputs_dir = os.path.join(font_dir, 'inputs')
+        input_files = [ttf_file]
+        for f in FORMATS:
+            if f == 'ttf':
+                continue
+            try:
+                input_files.extend(convert_files(
+                    [ttf_file], inputs_dir, [f], logger, threads,
+                    engines=engines).values())
+            except Error as e:
+                logger.warning('cannot produce %s input for %s: %s' % (f, font_name, e))
+        # Time each conversion edge on its own
+        for operation, input_file, output_file in conversion_edges(
+                input_files, os.path.join(font_dir, 'edges'), engines):
+            name = 'edge %s %s-%s' % (
+                operation.__name__, input_file.format, output_file.format)
+            logger.info('timing %s on %s' % (name, font_name))
+            edge_dir = os.path.dirname(output_file.full_path)
+            # Some converters write next to their input, so convert a copy
+            # of the input in the output directory
+            local_input = input_file.moved_and_converted_to(
+                edge_dir, input_file.format)
+            ensure_directory_exists(edge_dir)
+            shutil.copyfile(input_file.full_path, local_input.full_path)
+            result = dict(base, name=name, input_size=_file_size(local_input.full_path))
+            result.update(_measure(
+                lambda: operation([local_input], [output_file], logger),
+                repeat, cold))
+            result['output_sizes'] = { output_file.format : _file_size(output_file.full_path) }
+            results.append(result)
+        # Time full runs of convert_files
+        for formats in format_sets:
+            name = 'convert_files %s' % ','.join(formats)
+            logger.info('timing %s on %s' % (name, font_name))
+            run_dir = os.path.join(font_dir, 'runs', '-'.join(formats))
+            result = dict(base, name=name)
+            result.update(_measure(
+                lambda: convert_files([ttf_file], run_dir, formats, logger,
+                    threads, engines=engines),
+                repeat, cold))
+            result['output_sizes'] = {
+                f : _file_size(ttf_file.moved_and_converted_to(run_dir, f).full_path)
+                for f in formats }
+            results.append(result)
+    return results
+
+def write_results(fout, results, settings):
+    json.dump({ 'settings' : settings, 'results' : results }, fout,
+        indent=2, sort_keys=True)
+    fout.write('\n')
+
+def read_results(file_name):
+    with open(file_name) as fin:
+        return json.load(fin)['results']
+
+def compare_results(out, old_results, new_results, threshold):
+    """Print a comparison of the wall times of two benchmark runs. Return
+    the number of benchmarks which became slower by more than `threshold`
+    (a fraction)."""
+    old_dict = { (r['name'], r['font']) : r for r in old_results }
+    num_regressions = 0
+    print('%-60s %-10s %10s %10s %8s' % ('benchmark', 'font', 'old', 'new', 'change'), file=out)
+    for new in new_results:
+        key = (new['name'], new['font'])
+        old = old_dict.get(key)
+        if old is None:
+            print('%-60s %-10s %10s %10s' % (key + ('-', _format_time(new))), file=out)
+            continue
+        if 'error' in old or 'error' in new:
+            print('%-60s %-10s %10s %10s' % (key + (_format_time(old), _format_time(new))), file=out)
+            continue
+        change = (new['wall_time'] - old['wall_time']) / old['wall_time']
+        is_regression = change > threshold
+        if is_regression:
+            num_regressions += 1
+        print('%-60s %-10s %10s %10s %+7.1f%%%s' % (key + (
+            _format_time(old), _format_time(new), change * 100,
+            ' REGRESSION' if is_regression else '')), file=out)
+    return num_regressions
+
+def _format_time(result):
+    if 'error' in result:
+        return 'error'
+    return '%.4fs' % result['wall_time']
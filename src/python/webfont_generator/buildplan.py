@@ -0,0 +1,179 @@
+"""Exporting conversion plans to other build systems, which then take care
+of running conversions in parallel and of skipping those which are up to
+date. Every operation in a plan becomes a build edge which runs
+`generate-webfonts step`, and the CSS is generated by running
+generate-webfonts on the converted files. Plans are written as Ninja build
+files or as JSON."""
+
+import os.path
+import json
+import shlex
+import collections
+
+from .operations import (BASE_DIR, copy_file, convert_with_fontforge,
+    convert_with_sfntly, convert_with_woff2_compress,
+    convert_with_woff2_decompress, convert_with_fonttools_woff2_compress,
+    convert_with_fonttools_woff2_decompress, convert_with_native_woff_encode,
+    convert_with_native_woff_decode)
+from .dependencies import noop, make_dependency_tree
+from .family import (group_faces, required_output_formats,
+    format_output_formats)
+from .error import Error
+
+# The operations which `generate-webfonts step` runs, by name
+STEP_OPERATIONS = collections.OrderedDict(
+    (operation.__name__, operation) for operation in [
+        copy_file,
+        convert_with_fontforge,
+        convert_with_sfntly,
+        convert_with_woff2_compress,
+        convert_with_woff2_decompress,
+        convert_with_fonttools_woff2_compress,
+        convert_with_fonttools_woff2_decompress,
+        convert_with_native_woff_encode,
+        convert_with_native_woff_decode ])
+
+COMMAND = os.path.join(BASE_DIR, 'bin', 'generate-webfonts')
+
+# The rule of the edges which generate CSS
+CSS_RULE = 'css'
+
+BuildEdge = collections.namedtuple('BuildEdge',
+    ['rule', 'inputs', 'outputs', 'args'])
+BuildEdge.__doc__ = """A command which generates the files `outputs` from
+the files `inputs`. `rule` is the name of an operation, whose command is
+`generate-webfonts step <rule> <inputs> -- <outputs>`, or `css`, whose
+command is `generate-webfonts <args> -- <inputs>`."""
+
+def edge_command(edge, command=COMMAND):
+    """Return the command line of a build edge, as a list of arguments."""
+    if edge.rule == CSS_RULE:
+        return [command] + edge.args + ['--'] + edge.inputs
+    return [command, 'step', edge.rule] + edge.inputs + ['--'] + edge.outputs
+
+def plan_edges(dependency_tree):
+    """Return the operations in a dependency tree as build edges, in an
+    order in which they can be run."""
+    unsatisfied = collections.Counter()
+    for vertex in _vertices(dependency_tree):
+        for edge in vertex.outgoing_edges:
+            unsatisfied[edge.vertex_to] += 1
+    edges = []
+    ready = collections.deque([dependency_tree])
+    while ready:
+        vertex = ready.popleft()
+        if vertex.value is not noop:
+            inputs = _paths(e.file for e in vertex.incoming_edges)
+            # A file which is copied onto itself is already there
+            outputs = [
+                path for path in _paths(e.file for e in vertex.outgoing_edges)
+                if path not in inputs ]
+            if outputs:
+                edges.append(BuildEdge(vertex.value.__name__, inputs,
+                    outputs, None))
+        for edge in vertex.outgoing_edges:
+            unsatisfied[edge.vertex_to] -= 1
+            if not unsatisfied[edge.vertex_to]:
+                ready.append(edge.vertex_to)
+    return edges
+
+def _vertices(root_vertex):
+    seen = { root_vertex }
+    agenda = [root_vertex]
+    while agenda:
+        vertex = agenda.pop()
+        yield vertex
+        for edge in vertex.outgoing_edges:
+            if edge.vertex_to not in seen:
+                seen.add(edge.vertex_to)
+                agenda.append(edge.vertex_to)
+
+def _paths(font_files):
+    # Every output is listed once, even if several operations use it
+    return list(collections.OrderedDict.fromkeys(
+        f.full_path for f in font_files if f is not None))
+
+def plan_family(input_files, output_dir, parsed_output_formats, engines,
+        css_file_name=None, preload_file_name=None, css_args=()):
+    """Plan the conversion of a font family, and return it as a list of
+    build edges. If `css_file_name` or `preload_file_name` is given, the last
+    edge generates them from the converted files, passing `css_args` to
+    generate-webfonts as well."""
+    edges = []
+    css_inputs = []
+    for face in group_faces(input_files):
+        dependency_tree, output_files = make_dependency_tree(
+            face.input_files, output_dir,
+            required_output_formats(face.input_files, parsed_output_formats),
+            engines)
+        edges.extend(plan_edges(dependency_tree))
+        input_files_dict = { f.format : f for f in face.input_files }
+        css_inputs.extend(
+            (output_files.get(f) or input_files_dict[f]).full_path
+            for f, inline in parsed_output_formats)
+    if css_file_name is not None or preload_file_name is not None:
+        args = ['-o', output_dir, '-f',
+            format_output_formats(parsed_output_formats)]
+        outputs = []
+        if css_file_name is not None:
+            args.extend(['-c', css_file_name])
+            outputs.append(css_file_name)
+        if preload_file_name is not None:
+            args.extend(['--preload', preload_file_name])
+            outputs.append(preload_file_name)
+        edges.append(BuildEdge(CSS_RULE, _paths_list(css_inputs), outputs,
+            args + list(css_args)))
+    return edges
+
+def _paths_list(paths):
+    return list(collections.OrderedDict.fromkeys(paths))
+
+def _ninja_path(path):
+    for c in '$ :':
+        path = path.replace(c, '$' + c)
+    if '\n' in path:
+        raise Error('Cannot write a path with a newline to a Ninja file: %r' %
+            path)
+    return path
+
+def _ninja_command(args):
+    return ' '.join(shlex.quote(arg) for arg in args).replace('$', '$$')
+
+def write_ninja(out, edges, command=COMMAND):
+    """Write build edges as a Ninja build file, with a rule for every
+    operation."""
+    out.write('# Generated by generate-webfonts --emit-ninja\n\n')
+    out.write('generate_webfonts = %s\n\n' % _ninja_command([command]))
+    rules = collections.OrderedDict.fromkeys(edge.rule for edge in edges)
+    for rule in rules:
+        out.write('rule %s\n' % rule)
+        if rule == CSS_RULE:
+            out.write('  command = $generate_webfonts $args -- $in\n')
+        else:
+            out.write('  command = $generate_webfonts step %s $in -- $out\n' %
+                rule)
+        out.write('  description = %s $out\n\n' % rule)
+    for edge in edges:
+        out.write('build %s: %s %s\n' % (
+            ' '.join(_ninja_path(path) for path in edge.outputs),
+            edge.rule,
+            ' '.join(_ninja_path(path) for path in edge.inputs)))
+        if edge.args is not None:
+            out.write('  args = %s\n' % _ninja_command(edge.args))
+    out.write('\ndefault %s\n' % ' '.join(
+        _ninja_path(path) for edge in edges for path in edge.outputs))
+
+def write_plan_json(out, edges, command=COMMAND):
+    """Write build edges as JSON, with the full command line of each, in an
+    order in which they can be run."""
+    json.dump({
+        'steps' : [
+            collections.OrderedDict([
+                ('rule', edge.rule),
+                ('inputs', edge.inputs),
+                ('outputs', edge.outputs),
+                ('command', edge_command(edge, command))
+            ])
+            for edge in edges ]
+    }, out, indent=1)
+    out.write('\n')
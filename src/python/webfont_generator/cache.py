@@ -0,0 +1,273 @@
+import os
+import os.path
+import re
+import zlib
+import time
+import fcntl
+import shutil
+import hashlib
+import tempfile
+import functools
+import contextlib
+import subprocess
+
+from .operations import (BASE_DIR, convert_with_fontforge, convert_with_sfntly,
+    convert_with_woff2_compress, convert_with_woff2_decompress,
+    convert_with_fonttools_woff2_compress,
+    convert_with_fonttools_woff2_decompress, convert_with_native_woff_encode,
+    convert_with_native_woff_decode, ensure_file_directory_exists)
+
+DEFAULT_MAX_SIZE = 1024 ** 3
+
+_CHUNK_SIZE = 1024 * 1024
+
+# Temporary files older than this are assumed to be left over from a
+# process which died while storing an entry
+_STALE_TEMP_AGE = 3600
+
+# File in the cache directory which records the total size of the entries,
+# so that the cache need not be walked to find out whether it is full
+_SIZE_FILE_NAME = '.size'
+
+@functools.lru_cache(maxsize=None)
+def fontforge_identity():
+    try:
+        output = subprocess.check_output(['fontforge', '--version'],
+            stdin=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        # The conversion itself will report that FontForge is missing
+        return 'fontforge unavailable'
+    return 'fontforge ' + output.decode('utf-8', 'replace').strip()
+
+@functools.lru_cache(maxsize=None)
+def setup_variable(name):
+    """Read the value of a variable, such as the commit of a third-party
+    library, from the setup script."""
+    with open(os.path.join(BASE_DIR, 'setup')) as fin:
+        m = re.search(r"^%s='([^']*)'$" % re.escape(name), fin.read(), re.M)
+    return m.group(1) if m else 'unknown'
+
+@functools.lru_cache(maxsize=None)
+def sfntly_identity():
+    # ConvertFont is part of the sfntly toolchain, so include its source
+    with open(os.path.join(BASE_DIR, 'src', 'java', 'ConvertFont.java'), 'rb') as fin:
+        convert_font_hash = hashlib.sha256(fin.read()).hexdigest()
+    return 'sfntly %s ConvertFont %s' % (
+        setup_variable('SFNTLY_COMMIT'), convert_font_hash)
+
+def woff2_identity():
+    return 'woff2 ' + setup_variable('WOFF2_COMMIT')
+
+@functools.lru_cache(maxsize=None)
+def fonttools_identity():
+    try:
+        import fontTools
+        import brotli
+    except ImportError:
+        # The conversion itself will report what is missing
+        return 'fonttools unavailable'
+    return 'fonttools %s brotli %s' % (
+        fontTools.version, getattr(brotli, '__version__', 'unknown'))
+
+@functools.lru_cache(maxsize=None)
+def native_woff_identity():
+    # The encoder's output depends on its own code and on zlib
+    with open(os.path.join(os.path.dirname(__file__), 'woff.py'), 'rb') as fin:
+        source_hash = hashlib.sha256(fin.read()).hexdigest()
+    return 'native-woff %s zlib %s' % (source_hash, zlib.ZLIB_RUNTIME_VERSION)
+
+# Identifies the tool behind every cacheable operation, so that upgrading a
+# tool invalidates the files it produced
+TOOL_IDENTITIES = {
+    convert_with_fontforge : fontforge_identity,
+    convert_with_sfntly : sfntly_identity,
+    convert_with_woff2_compress : woff2_identity,
+    convert_with_woff2_decompress : woff2_identity,
+    convert_with_fonttools_woff2_compress : fonttools_identity,
+    convert_with_fonttools_woff2_decompress : fonttools_identity,
+    convert_with_native_woff_encode : native_woff_identity,
+    convert_with_native_woff_decode : native_woff_identity
+}
+
+def hash_file(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as fin:
+        for chunk in iter(lambda: fin.read(_CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+class ConversionCache(object):
+    """An on-disk cache of converted files, keyed on a hash of the input
+    file's contents, the output format, and the identity of the tool which
+    converted it. Entries are evicted in least-recently-used order once the
+    cache grows beyond `max_size` bytes."""
+
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self._input_hashes = {}
+
+    def handles(self, operation):
+        return operation in TOOL_IDENTITIES
+
+    def _input_hash(self, path):
+        # Avoid hashing the same input file again for every operation that
+        # reads it
+        st = os.stat(path)
+        memo_key = (path, st.st_size, st.st_mtime_ns)
+        result = self._input_hashes.get(memo_key)
+        if result is None:
+            result = self._input_hashes[memo_key] = hash_file(path)
+        return result
+
+    def _entry_path(self, operation, input_file, output_file):
+        h = hashlib.sha256()
+        for part in (self._input_hash(input_file.full_path),
+                TOOL_IDENTITIES[operation](), output_file.format):
+            h.update(part.encode('utf-8'))
+            h.update(b'\0')
+        key = h.hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key + os.extsep + output_file.format)
+
+    def run(self, operation, input_files, output_files, logger):
+        """Run a conversion, unless all of its output files can be copied
+        from the cache instead. Store the output files in the cache
+        afterwards. Return whether the output files came from the cache."""
+        entries = self.restore(operation, input_files, output_files, logger)
+        if entries is None:
+            return True
+        operation(input_files, output_files, logger)
+        self.store(entries)
+        return False
+
+    def restore(self, operation, input_files, output_files, logger):
+        """Copy the output files of a conversion from the cache if all of them
+        are there, and return None. Otherwise, return the entries in which
+        the output files should be stored with `store` once the conversion
+        has been run."""
+        input_files = list(input_files)
+        output_files = list(output_files)
+        # Every operation converts only the first of its input files
+        entries = [
+            (self._entry_path(operation, input_files[0], f), f)
+            for f in output_files ]
+        if all(os.path.isfile(entry) for entry, f in entries):
+            try:
+                for entry, output_file in entries:
+                    logger.info('restoring %s from cache' % output_file.full_path)
+                    ensure_file_directory_exists(output_file.full_path)
+                    shutil.copyfile(entry, output_file.full_path)
+                    # Mark the entry as recently used
+                    os.utime(entry)
+                return None
+            except FileNotFoundError:
+                # The entry was evicted in the meantime
+                pass
+        return entries
+
+    def store(self, entries):
+        for entry, output_file in entries:
+            self._store(entry, output_file.full_path)
+        self._update_size(lambda size: size + sum(
+            os.path.getsize(output_file.full_path)
+            for entry, output_file in entries))
+
+    @contextlib.contextmanager
+    def _size_lock(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(os.path.join(self.cache_dir, _SIZE_FILE_NAME + '.lock'),
+                'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _read_size(self):
+        try:
+            with open(os.path.join(self.cache_dir, _SIZE_FILE_NAME)) as fin:
+                return int(fin.read())
+        except (OSError, ValueError):
+            return None
+
+    def _update_size(self, update):
+        # Several processes may share the cache, so hold a lock while
+        # reading and rewriting the size
+        with self._size_lock():
+            size = self._read_size()
+            # An unknown size is left unknown until the next walk
+            if size is not None:
+                self._write_size(update(size))
+
+    def _write_size(self, size):
+        path = os.path.join(self.cache_dir, _SIZE_FILE_NAME)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as fout:
+            fout.write('%d\n' % size)
+        os.replace(temp_path, path)
+
+    def prune_if_full(self):
+        """Prune the cache, but only if the recorded size of its entries
+        is more than the maximum size, or unknown. This avoids walking the
+        whole cache after every conversion."""
+        size = self._read_size()
+        if size is not None and size <= self.max_size:
+            return 0, 0
+        return self.prune()
+
+    def _store(self, entry, path):
+        ensure_file_directory_exists(entry)
+        # Write to a temporary file first so that other processes sharing
+        # the cache never see a partial entry
+        fd, temp_path = tempfile.mkstemp(prefix='.tmp', dir=os.path.dirname(entry))
+        try:
+            with open(fd, 'wb') as fout, open(path, 'rb') as fin:
+                shutil.copyfileobj(fin, fout)
+            os.replace(temp_path, entry)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def prune(self, max_size=None):
+        """Evict the least recently used entries until the cache is no
+        larger than `max_size` bytes. Return the number of entries and bytes
+        removed."""
+        if max_size is None:
+            max_size = self.max_size
+        entries = []
+        total_size = 0
+        now = time.time()
+        for dir_path, dir_names, file_names in os.walk(self.cache_dir):
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if file_name.startswith('.'):
+                    if file_name.startswith('.tmp') and \
+                            now - st.st_mtime > _STALE_TEMP_AGE:
+                        _remove_if_exists(path)
+                    # Other hidden files keep track of the cache
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total_size += st.st_size
+        entries.sort()
+        num_removed = bytes_removed = 0
+        for mtime, size, path in entries:
+            if total_size <= max_size:
+                break
+            if _remove_if_exists(path):
+                num_removed += 1
+                bytes_removed += size
+            total_size -= size
+        # Entries stored while the cache was being walked may be left out,
+        # but they are counted again by the next walk
+        with self._size_lock():
+            self._write_size(total_size)
+        return num_removed, bytes_removed
+
+def _remove_if_exists(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        # Another process got to it first
+        return False
+    return True
@@ -0,0 +1,127 @@
+import os
+import os.path
+import json
+import fcntl
+import threading
+
+# How much weight each new observation takes away from older ones, so that
+# the model adapts when a tool or machine gets faster or slower
+DECAY = 0.9
+
+def _key(operation, output_format):
+    return '%s %s' % (operation.__name__, output_format)
+
+class _Stats(object):
+    """Exponentially decaying sums for a least-squares fit of the running
+    time of a conversion against the size of its input."""
+
+    def __init__(self, sums=None):
+        self.n, self.x, self.y, self.xx, self.xy = sums or (0, 0, 0, 0, 0)
+
+    def add(self, size, seconds):
+        self.n = self.n * DECAY + 1
+        self.x = self.x * DECAY + size
+        self.y = self.y * DECAY + seconds
+        self.xx = self.xx * DECAY + size * size
+        self.xy = self.xy * DECAY + size * seconds
+
+    def predict(self, size):
+        mean_x = self.x / self.n
+        mean_y = self.y / self.n
+        var_x = self.xx / self.n - mean_x * mean_x
+        # Fit a line if the input sizes vary enough, otherwise assume that
+        # the running time is proportional to the size of the input
+        if var_x > 1e-6 * mean_x * mean_x:
+            slope = (self.xy / self.n - mean_x * mean_y) / var_x
+            result = mean_y + slope * (size - mean_x)
+        elif mean_x > 0:
+            result = mean_y * size / mean_x
+        else:
+            result = mean_y
+        return max(result, 0.0)
+
+    def as_list(self):
+        return [self.n, self.x, self.y, self.xx, self.xy]
+
+class CostModel(object):
+    """Records how long each tool takes to generate each output format,
+    relative to the size of its input, in a JSON stats file. Conversion
+    plans use these times as edge weights, so that the fastest tools on this
+    machine are preferred.
+
+    Observations are kept in memory until `save` is called, which merges
+    them into the stats file, so several processes can share one file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._pending = []
+        self._stats = self._load()
+
+    def __getstate__(self):
+        # Locks cannot be sent to other processes
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.path) as fin:
+                data = json.load(fin)
+            return { key : _Stats(sums) for key, sums in data.items() }
+        except (OSError, ValueError, TypeError):
+            # Start over if the stats are missing or unreadable
+            return {}
+
+    def expected_time(self, operation, output_format, input_size):
+        """Return the expected number of seconds that `operation` takes to
+        generate `output_format` from an input of `input_size` bytes, or
+        None if it has never been observed."""
+        with self._lock:
+            stats = self._stats.get(_key(operation, output_format))
+            if stats is None:
+                return None
+            return stats.predict(input_size)
+
+    def record(self, operation, input_files, output_files, seconds):
+        try:
+            input_size = os.path.getsize(input_files[0].full_path)
+        except (IndexError, OSError):
+            return
+        with self._lock:
+            for output_file in output_files:
+                key = _key(operation, output_file.format)
+                self._stats.setdefault(key, _Stats()).add(input_size, seconds)
+                self._pending.append((key, input_size, seconds))
+
+    def save(self):
+        """Merge the observations made since the last save into the stats
+        file."""
+        with self._lock:
+            pending = self._pending
+            self._pending = []
+        if not pending:
+            return
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        # Hold a lock while reading and rewriting the file, so that
+        # observations saved by other processes in the meantime are kept
+        with open(self.path + '.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            stats = self._load()
+            for key, input_size, seconds in pending:
+                stats.setdefault(key, _Stats()).add(input_size, seconds)
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w') as fout:
+                json.dump({ key : s.as_list() for key, s in stats.items() },
+                    fout, indent=1, sort_keys=True)
+            os.replace(temp_path, self.path)
+        with self._lock:
+            # Keep observations made while the file was being written
+            for key, input_size, seconds in self._pending:
+                stats.setdefault(key, _Stats()).add(input_size, seconds)
+            self._stats = stats
@@ -1,4 +1,5 @@
 import re
+import html
 import base64
 import urllib.parse
 
@@ -39,18 +40,40 @@ MEDIA_TYPE_MAPPING = {
 def media_type(format):
     return MEDIA_TYPE_MAPPING[format]
 
-def write_data_url(out, format, file_path):
+# A multiple of 3 bytes, so that each chunk encodes to base64 without padding
+DATA_URL_CHUNK_SIZE = 3 * 64 * 1024
+
+def data_url_size(format, size):
+    """Return the length of the data URL of a font of `size` bytes."""
+    return len('data:;base64,') + len(media_type(format)) + 4 * ((size + 2) // 3)
+
+def write_data_url(out, format, source):
+    """Write a base64-encoded data URL for a font. The font is given either
+    as the path to a file or as a bytes-like object, such as bytes or an
+    mmap. It is encoded in fixed-size chunks, so memory usage does not depend
+    on the size of the font."""
     out.write('data:')
     out.write(media_type(format))
     out.write(';base64,')
-    with open(file_path, 'rb') as fin:
-        data = fin.read()
-    out.write(base64.b64encode(data).decode('ascii'))
+    if isinstance(source, str):
+        with open(source, 'rb') as fin:
+            for chunk in iter(lambda: fin.read(DATA_URL_CHUNK_SIZE), b''):
+                out.write(base64.b64encode(chunk).decode('ascii'))
+    else:
+        with memoryview(source) as view, view.cast('B') as data:
+            for i in range(0, len(data), DATA_URL_CHUNK_SIZE):
+                chunk = data[i:i + DATA_URL_CHUNK_SIZE]
+                out.write(base64.b64encode(chunk).decode('ascii'))
 
 def _file_url(prefix, font_file):
     return escape_css_url(prefix + urllib.parse.quote_plus(font_file.basename()))
 
-def generate_css(out, formats, output_files, prefix, font_family):
+def generate_css(out, formats, output_files, prefix, font_family,
+        unicode_range=None, font_weight=None, font_style=None,
+        font_display=None):
+    """Write an @font-face rule. If `unicode_range` is given, the rule
+    applies only to those characters. `font_weight`, `font_style` and
+    `font_display` are written if given."""
     formats = list(formats)
     out.write("""\
 @font-face {
@@ -81,7 +104,11 @@ def generate_css(out, formats, output_files, prefix, font_family):
         out.write('url(')
         font_file = output_files[f]
         if inline:
-            write_data_url(out, f, font_file.full_path)
+            # Use the contents of the file if they are already in memory
+            if font_file.data is not None:
+                write_data_url(out, f, font_file.data)
+            else:
+                write_data_url(out, f, font_file.full_path)
         else:
             out.write(_file_url(prefix, font_file))
         if f == 'svg':
@@ -90,6 +117,43 @@ def generate_css(out, formats, output_files, prefix, font_family):
         out.write(") format('")
         out.write(css_format(f))
         out.write("')")
-    out.write(''';
+    out.write(';\n')
+    if font_weight is not None:
+        out.write('  font-weight: %d;\n' % font_weight)
+    if font_style is not None:
+        out.write('  font-style: %s;\n' % font_style)
+    if font_display is not None:
+        out.write('  font-display: %s;\n' % font_display)
+    if unicode_range is not None:
+        out.write('  unicode-range: ')
+        out.write(unicode_range)
+        out.write(';\n')
+    out.write('}\n')
+
+# Media types which browsers expect in the type attribute of a preload link.
+# Browsers which can preload fonts support at least woff, so the older
+# formats are never preloaded.
+PRELOAD_MEDIA_TYPES = {
+    'woff2' : 'font/woff2',
+    'woff' : 'font/woff',
+    'ttf' : 'font/ttf',
+    'otf' : 'font/otf'
 }
-''')
+
+def generate_preload_links(out, fonts, prefix):
+    """Write a <link rel="preload"> tag for every font, so that pages can
+    start fetching the fonts before their CSS is applied. `fonts` is a list
+    of (formats, output files) pairs. Only the first format in the CSS which
+    browsers that can preload fonts support is preloaded, since they use it
+    rather than the ones after it, and nothing is if it is inlined. The URLs
+    are the same as in the CSS, so that browsers use the preloaded files."""
+    for formats, output_files in fonts:
+        for f, inline in formats:
+            if f in PRELOAD_MEDIA_TYPES:
+                if not inline:
+                    url = prefix + urllib.parse.quote_plus(
+                        output_files[f].basename())
+                    out.write('<link rel="preload" href="%s" as="font" '
+                        'type="%s" crossorigin>\n' % (html.escape(url),
+                            PRELOAD_MEDIA_TYPES[f]))
+                break
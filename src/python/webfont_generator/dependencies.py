@@ -1,14 +1,29 @@
+import time
 import operator
+import functools
 import collections
+import concurrent.futures
 
 from . import graph
 from .operations import (copy_file, convert_with_fontforge, convert_with_sfntly,
-    convert_with_woff2_compress, convert_with_woff2_decompress)
+    convert_with_woff2_compress, convert_with_woff2_decompress,
+    convert_with_fonttools_woff2_compress,
+    convert_with_fonttools_woff2_decompress, convert_with_native_woff_encode,
+    convert_with_native_woff_decode, IN_MEMORY_OPERATIONS, run_on_disk)
 from .error import Error
+from .incremental import BuildState
+from .profile import profile_stage, font_file_size
 
 FORMATS = ['ttf', 'otf', 'svg', 'eot', 'woff', 'woff2']
 FORMATS_SET = set(FORMATS)
 
+# The programs which can be used to convert fonts. The fonttools and
+# native-woff engines are only used when requested; fonttools depends on
+# optional Python packages.
+ENGINES = ['fontforge', 'sfntly', 'woff2', 'fonttools', 'native-woff']
+ENGINES_SET = set(ENGINES)
+DEFAULT_ENGINES = frozenset(['fontforge', 'sfntly', 'woff2'])
+
 class ShortestPathsVertex(graph.ShortestPathsVertex):
 
     def create_copy(self):
@@ -43,16 +58,39 @@ class TreeVertex(graph.Vertex):
     def incoming_edges(self):
         return self._incoming_edges.values()
 
-    def process(self, logger):
-        input_files = (e.file for e in self.incoming_edges)
-        output_files = (e.file for e in self.outgoing_edges)
-        self.value(input_files, output_files, logger)
+    def process(self, logger, cache=None, state=None, cost_model=None):
+        if self.value is noop:
+            return
+        input_files = [e.file for e in self.incoming_edges]
+        output_files = [e.file for e in self.outgoing_edges]
+        if state is not None and state.is_current(self.value, input_files, output_files):
+            logger.info('skipping %s, already up to date' % ', '.join(
+                f.full_path for f in output_files))
+            return
+        operation = self.value
+        if any(f.in_memory for f in input_files + output_files):
+            # Files held in memory are not cached, and tools which need real
+            # files get temporary ones
+            cache = None
+            if operation not in IN_MEMORY_OPERATIONS:
+                operation = functools.partial(run_on_disk, operation)
+        start_time = time.perf_counter()
+        if cache is not None and cache.handles(self.value):
+            from_cache = cache.run(self.value, input_files, output_files, logger)
+        else:
+            operation(input_files, output_files, logger)
+            from_cache = False
+        if cost_model is not None and not from_cache:
+            cost_model.record(self.value, input_files, output_files,
+                time.perf_counter() - start_time)
+        if state is not None:
+            state.update(self.value, input_files, output_files)
 
 class Vector:
     """Simple vector class for lexicographically orderable edge weights."""
 
-    def __init__(self, x, y, z):
-        self.value = (x, y, z)
+    def __init__(self, *value):
+        self.value = value
 
     def __add__(self, other):
         value = map(lambda p: operator.add(*p), zip(self.value, other.value))
@@ -61,6 +99,12 @@ class Vector:
     def __lt__(self, other):
         return self.value < other.value
 
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __hash__(self):
+        return hash(self.value)
+
 Vertex = ShortestPathsVertex
 
 def noop(input_files, output_files, logger):
@@ -68,16 +112,23 @@ def noop(input_files, output_files, logger):
 
 def make_file_dicts(input_files, output_dir):
     # Use the first input file to determine the names for the output files
+    # If there is no output directory, the output files are held in memory
     input_files = list(input_files)
     input_files_dict = { f.format : f for f in input_files }
-    output_files_dict = {
-        f : input_files[0].moved_and_converted_to(output_dir, f)
-        for f in FORMATS }
+    if output_dir is None:
+        output_files_dict = {
+            f : input_files[0].converted_in_memory_to(f) for f in FORMATS }
+    else:
+        output_files_dict = {
+            f : input_files[0].moved_and_converted_to(output_dir, f)
+            for f in FORMATS }
     return input_files_dict, output_files_dict
 
-def construct_dependency_graph(input_files_dict, output_files_dict):
+def construct_dependency_graph(input_files_dict, output_files_dict,
+        engines=DEFAULT_ENGINES):
     """Construct the dependency graph which describes which programs can be
-    used to convert which files."""
+    used to convert which files. Only the programs named in `engines` are
+    included."""
     # Create a super-source vertex
     source_vertex = Vertex(noop)
     # Create a vertex for every possible input format
@@ -99,71 +150,265 @@ def construct_dependency_graph(input_files_dict, output_files_dict):
                 copy_vertex, Vector(0, 0, 0), input_files_dict[f])
         copy_vertex.add_edge(
             output_vertices[f], Vector(0, 0, 1), output_files_dict[f])
-    # FontForge can convert any one of ttf, otf, woff, svg to any of ttf, otf,
-    # svg
-    fontforge_vertex = Vertex(convert_with_fontforge)
-    for f in ('ttf', 'otf', 'woff', 'svg'):
-        if f in input_files_dict:
-            input_vertices[f].add_edge(
-                fontforge_vertex, Vector(0, 0, 0), input_files_dict[f])
-        output_vertices[f].add_edge(
-            fontforge_vertex, Vector(0, 0, 0), output_files_dict[f])
-    for f in ('ttf', 'otf', 'svg'):
-        fontforge_vertex.add_edge(
-            output_vertices[f], Vector(1, 0, 0), output_files_dict[f])
-    # sfntly can convert ttf to any of woff, eot
-    sfntly_vertex = Vertex(convert_with_sfntly)
-    if 'ttf' in input_files_dict:
-        input_vertices['ttf'].add_edge(
-            sfntly_vertex, Vector(0, 0, 0), input_files_dict['ttf'])
-    output_vertices['ttf'].add_edge(
-        sfntly_vertex, Vector(0, 0, 0), output_files_dict['ttf'])
-    for f in ('woff', 'eot'):
-        sfntly_vertex.add_edge(
-            output_vertices[f], Vector(0, 1, 0), output_files_dict[f])
-    # woff2_compress can convert ttf to woff2
-    # Note that it requires the input file to be in the destination directory
-    woff2_compress_vertex = Vertex(convert_with_woff2_compress)
-    output_vertices['ttf'].add_edge(
-        woff2_compress_vertex, Vector(0, 0, 0), output_files_dict['ttf'])
-    woff2_compress_vertex.add_edge(
-        output_vertices['woff2'], Vector(0, 1, 0), output_files_dict['woff2'])
-    # woff2_decompress can convert woff2 to ttf
-    woff2_decompress_vertex = Vertex(convert_with_woff2_decompress)
-    output_vertices['woff2'].add_edge(
-        woff2_decompress_vertex, Vector(0, 0, 0), output_files_dict['woff2'])
-    woff2_decompress_vertex.add_edge(
-        output_vertices['ttf'], Vector(0, 1, 0), output_files_dict['ttf'])
+    if 'fontforge' in engines:
+        # FontForge can convert any one of ttf, otf, woff, svg to any of ttf,
+        # otf, svg
+        fontforge_vertex = Vertex(convert_with_fontforge)
+        for f in ('ttf', 'otf', 'woff', 'svg'):
+            if f in input_files_dict:
+                input_vertices[f].add_edge(
+                    fontforge_vertex, Vector(0, 0, 0), input_files_dict[f])
+            output_vertices[f].add_edge(
+                fontforge_vertex, Vector(0, 0, 0), output_files_dict[f])
+        for f in ('ttf', 'otf', 'svg'):
+            fontforge_vertex.add_edge(
+                output_vertices[f], Vector(1, 0, 0), output_files_dict[f])
+    if 'sfntly' in engines:
+        # sfntly can convert ttf to any of woff, eot
+        sfntly_vertex = Vertex(convert_with_sfntly)
+        if 'ttf' in input_files_dict:
+            input_vertices['ttf'].add_edge(
+                sfntly_vertex, Vector(0, 0, 0), input_files_dict['ttf'])
+        output_vertices['ttf'].add_edge(
+            sfntly_vertex, Vector(0, 0, 0), output_files_dict['ttf'])
+        for f in ('woff', 'eot'):
+            sfntly_vertex.add_edge(
+                output_vertices[f], Vector(0, 1, 0), output_files_dict[f])
+    if 'woff2' in engines:
+        # woff2_compress can convert ttf to woff2
+        # Note that it requires the input file to be in the destination
+        # directory
+        woff2_compress_vertex = Vertex(convert_with_woff2_compress)
+        output_vertices['ttf'].add_edge(
+            woff2_compress_vertex, Vector(0, 0, 0), output_files_dict['ttf'])
+        woff2_compress_vertex.add_edge(
+            output_vertices['woff2'], Vector(0, 1, 0), output_files_dict['woff2'])
+        # woff2_decompress can convert woff2 to ttf
+        woff2_decompress_vertex = Vertex(convert_with_woff2_decompress)
+        output_vertices['woff2'].add_edge(
+            woff2_decompress_vertex, Vector(0, 0, 0), output_files_dict['woff2'])
+        woff2_decompress_vertex.add_edge(
+            output_vertices['ttf'], Vector(0, 1, 0), output_files_dict['ttf'])
+    if 'fonttools' in engines:
+        # fontTools can convert ttf or otf to woff2 in-process, reading the
+        # input file from wherever it is
+        fonttools_compress_vertex = Vertex(convert_with_fonttools_woff2_compress)
+        for f in ('ttf', 'otf'):
+            if f in input_files_dict:
+                input_vertices[f].add_edge(
+                    fonttools_compress_vertex, Vector(0, 0, 0), input_files_dict[f])
+            output_vertices[f].add_edge(
+                fonttools_compress_vertex, Vector(0, 0, 0), output_files_dict[f])
+        fonttools_compress_vertex.add_edge(
+            output_vertices['woff2'], Vector(0, 1, 0), output_files_dict['woff2'])
+        # fontTools can also convert woff2 to ttf
+        fonttools_decompress_vertex = Vertex(convert_with_fonttools_woff2_decompress)
+        if 'woff2' in input_files_dict:
+            input_vertices['woff2'].add_edge(
+                fonttools_decompress_vertex, Vector(0, 0, 0), input_files_dict['woff2'])
+        output_vertices['woff2'].add_edge(
+            fonttools_decompress_vertex, Vector(0, 0, 0), output_files_dict['woff2'])
+        fonttools_decompress_vertex.add_edge(
+            output_vertices['ttf'], Vector(0, 1, 0), output_files_dict['ttf'])
+    if 'native-woff' in engines:
+        # The native WOFF encoder can convert ttf or otf to woff in-process
+        native_woff_encode_vertex = Vertex(convert_with_native_woff_encode)
+        for f in ('ttf', 'otf'):
+            if f in input_files_dict:
+                input_vertices[f].add_edge(
+                    native_woff_encode_vertex, Vector(0, 0, 0), input_files_dict[f])
+            output_vertices[f].add_edge(
+                native_woff_encode_vertex, Vector(0, 0, 0), output_files_dict[f])
+        native_woff_encode_vertex.add_edge(
+            output_vertices['woff'], Vector(0, 1, 0), output_files_dict['woff'])
+        # The native WOFF decoder can convert woff to ttf
+        native_woff_decode_vertex = Vertex(convert_with_native_woff_decode)
+        if 'woff' in input_files_dict:
+            input_vertices['woff'].add_edge(
+                native_woff_decode_vertex, Vector(0, 0, 0), input_files_dict['woff'])
+        output_vertices['woff'].add_edge(
+            native_woff_decode_vertex, Vector(0, 0, 0), output_files_dict['woff'])
+        native_woff_decode_vertex.add_edge(
+            output_vertices['ttf'], Vector(0, 1, 0), output_files_dict['ttf'])
     # Return the super-source and output vertices
     return source_vertex, output_vertices
 
-def convert_files(input_files, output_dir, output_formats, logger):
-    # Construct the conversion dependency graph
-    input_files_dict, output_files_dict = make_file_dicts(
-        input_files, output_dir)
+def process_tree(dependency_tree, process, threads=1):
+    """Execute the tasks in a dependency tree by calling `process` on every
+    vertex. A vertex is processed once all of its incoming edges are
+    satisfied, and up to `threads` independent vertices are processed at the
+    same time.
+
+    Errors are reported deterministically: every branch of the tree which does
+    not depend on a failed vertex still runs to completion, and the error
+    raised is that of the first failed vertex in pre-order, which is the same
+    error that processing the tree sequentially would raise."""
+    vertices = list(graph.preorder_traversal(dependency_tree))
+    if threads == 1:
+        for vertex in vertices:
+            process(vertex)
+        return
+    order = { v : i for i, v in enumerate(vertices) }
+    unsatisfied = { v : len(v.incoming_edges) for v in vertices }
+    errors = {}
+    with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+        running = {}
+        def submit(vertex):
+            running[executor.submit(process, vertex)] = vertex
+        submit(dependency_tree)
+        while running:
+            done, not_done = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+            # Schedule dependents in a deterministic order
+            for future in sorted(done, key=lambda f: order[running[f]]):
+                vertex = running.pop(future)
+                error = future.exception()
+                if error is not None:
+                    errors[vertex] = error
+                    continue
+                for edge in vertex.outgoing_edges:
+                    unsatisfied[edge.vertex_to] -= 1
+                    if not unsatisfied[edge.vertex_to]:
+                        submit(edge.vertex_to)
+    if errors:
+        raise errors[min(errors, key=order.get)]
+
+def apply_expected_times(source_vertex, expected_time):
+    """Prepend the expected running time of every operation to the weights
+    of the edges leading to its output files, so that the fastest plan is
+    chosen. `expected_time(operation, output_format)` returns a number of
+    seconds, or None if unknown. Unknown times count as zero, so that every
+    tool gets measured, and the static weights break ties."""
+    for vertex in graph.depth_first_traversal(source_vertex):
+        for edge in vertex.outgoing_edges:
+            seconds = None
+            if vertex.value is not noop and edge.file is not None:
+                kind, f = edge.file
+                seconds = expected_time(vertex.value, f)
+            edge.weight = Vector(seconds or 0, *edge.weight.value)
+
+def _build_plan(input_formats, output_formats, engines, expected_time=None):
+    # Plan with placeholders in place of real files, which are substituted
+    # when the plan is instantiated
+    input_files_dict = { f : ('input', f) for f in input_formats }
+    output_files_dict = { f : ('output', f) for f in FORMATS }
     source_vertex, output_vertices = construct_dependency_graph(
-        input_files_dict, output_files_dict)
-    # Sort the output formats so that their order is deterministic
-    output_formats = sorted(output_formats)
+        input_files_dict, output_files_dict, engines)
+    zero = Vector(0, 0, 0)
+    if expected_time is not None:
+        apply_expected_times(source_vertex, expected_time)
+        zero = Vector(0, *zero.value)
     destination_vertices = [output_vertices[f] for f in output_formats]
     # Compute the shortest paths from the super-source vertex to the vertices
     # corresponding to each of the requested output formats
     reachable_vertices = graph.compute_shortest_paths(
-        source_vertex, destination_vertices, Vector(0, 0, 0))
-    # Raise an error if any of the output formats cannot be generated
-    unreachable_vertices = set(destination_vertices) - reachable_vertices
-    if unreachable_vertices:
-        unreachable_files = sorted({
-            e.file.full_path
-            for v in unreachable_vertices
-            for e in v.outgoing_edges })
-        raise Error('unable to generate the following files: %s' % ' '.join(
-            unreachable_files))
+        source_vertex, destination_vertices, zero)
+    unreachable_formats = tuple(
+        f for f in output_formats
+        if output_vertices[f] not in reachable_vertices)
+    if unreachable_formats:
+        return None, unreachable_formats
     # Follow the shortest-paths backpointers and construct a dependency sub-tree
     dependency_tree = graph.construct_shortest_paths_subtree(
         source_vertex, destination_vertices)
+    return dependency_tree, ()
+
+_compile_plan = functools.lru_cache(maxsize=None)(_build_plan)
+
+def compile_plan(input_formats, output_formats, engines=DEFAULT_ENGINES,
+        expected_time=None):
+    """Return the conversion plan for a set of input formats and a set of
+    output formats using the given engines, as a dependency tree whose edges refer to the files
+    `('input', format)` and `('output', format)`, along with the list of
+    output formats which cannot be generated. Since there are only so many
+    combinations of formats, plans are computed once and memoized, unless
+    they are based on the measured running times given by
+    `expected_time`."""
+    args = (frozenset(input_formats), tuple(sorted(output_formats)),
+        frozenset(engines))
+    if expected_time is not None:
+        return _build_plan(*args, expected_time)
+    return _compile_plan(*args)
+
+def instantiate_plan(plan_vertex, input_files_dict, output_files_dict):
+    """Copy a dependency tree returned by compile_plan, substituting the
+    given files for its placeholders."""
+    files_dicts = { 'input' : input_files_dict, 'output' : output_files_dict }
+    vertex = TreeVertex(plan_vertex.value)
+    for edge in plan_vertex.outgoing_edges:
+        if edge.file is None:
+            file = None
+        else:
+            kind, f = edge.file
+            file = files_dicts[kind][f]
+        vertex.add_edge_object(ShortestPathsVertex.Edge(
+            vertex,
+            instantiate_plan(edge.vertex_to, input_files_dict, output_files_dict),
+            edge.weight,
+            file))
+    return vertex
+
+def make_dependency_tree(input_files, output_dir, output_formats,
+        engines=DEFAULT_ENGINES, profiler=None, cost_model=None):
+    """Plan the conversion of a font to the given output formats. Return the
+    dependency tree of operations to execute, along with a dict mapping the
+    output formats to the output files."""
+    input_files_dict, output_files_dict = make_file_dicts(
+        input_files, output_dir)
+    # Sort the output formats so that their order is deterministic
+    output_formats = sorted(output_formats)
+    # Look up the plan for converting these formats
+    if cost_model is None:
+        expected_time = None
+    else:
+        # Estimate running times from the size of the largest input file
+        input_size = max(font_file_size(f) for f in input_files)
+        expected_time = lambda operation, f: cost_model.expected_time(
+            operation, f, input_size)
+    with profile_stage(profiler, 'plan', 'planning'):
+        plan, unreachable_formats = compile_plan(
+            input_files_dict.keys(), output_formats, engines, expected_time)
+    # Raise an error if any of the output formats cannot be generated
+    if unreachable_formats:
+        unreachable_files = sorted(
+            output_files_dict[f].full_path for f in unreachable_formats)
+        raise Error('unable to generate the following files: %s' % ' '.join(
+            unreachable_files))
+    with profile_stage(profiler, 'instantiate plan', 'planning'):
+        dependency_tree = instantiate_plan(
+            plan, input_files_dict, output_files_dict)
+    return dependency_tree, { f : output_files_dict[f] for f in output_formats }
+
+class ConversionCancelled(Error):
+    pass
+
+def check_cancelled(cancelled):
+    """Raise ConversionCancelled if the event `cancelled` has been set."""
+    if cancelled is not None and cancelled.is_set():
+        raise ConversionCancelled('the conversion was cancelled')
+
+def convert_files(input_files, output_dir, output_formats, logger, threads=1,
+        cache=None, incremental=False, engines=DEFAULT_ENGINES, profiler=None,
+        cost_model=None, cancelled=None):
+    dependency_tree, output_files = make_dependency_tree(input_files,
+        output_dir, output_formats, engines, profiler, cost_model)
     # Execute the tasks in topological order
-    for vertex in graph.preorder_traversal(dependency_tree):
-        vertex.process(logger)
+    # Outputs of conversions which have been done before are copied from
+    # the cache if one is given. In incremental mode, operations whose
+    # outputs are newer than their inputs are skipped entirely.
+    # Once the event `cancelled` is set, no more operations are started.
+    state = BuildState(output_dir) if incremental else None
+    def process(vertex):
+        check_cancelled(cancelled)
+        vertex.process(logger, cache, state, cost_model)
+    if profiler is not None:
+        process = profiler.wrap_process(process, (noop,))
+    try:
+        process_tree(dependency_tree, process, threads)
+    finally:
+        if state is not None:
+            state.save()
+        if cost_model is not None:
+            cost_model.save()
     # Return the output file objects
-    return { f : output_files_dict[f] for f in output_formats }
+    return output_files
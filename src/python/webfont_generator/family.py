@@ -0,0 +1,392 @@
+import os
+import os.path
+import collections
+import concurrent.futures
+
+from .util import remove_suffix
+from .error import Error
+from .operations import FontFile
+from .dependencies import (FORMATS_SET, ENGINES_SET, DEFAULT_ENGINES,
+    convert_files, check_cancelled)
+from .css import generate_css, generate_preload_links, data_url_size
+from .profile import CountingWriter, font_file_size, profile_stage
+from .subset import subset_source, plan_shards, write_shard, format_unicode_range
+from .precompress import precompress_files
+from .assets import (ASSET_MANIFEST_FILE_NAME, add_content_hash,
+    update_asset_manifest)
+from .sniff import (SNIFF_SIZE, sniff_format, sniff_file_format,
+    check_font_files, font_metadata)
+
+DEFAULT_OUTPUT_FORMATS = ['eot', 'woff2', 'woff', 'ttf', 'svg']
+
+def input_font_files(input_file_names, contents=None):
+    """Deduce the formats of the input files from their extensions, or from
+    their first bytes if they have no extension. If `contents` is given, it
+    lists the contents of the files, which are held in memory rather than
+    read from disk."""
+    if contents is None:
+        contents = [None] * len(input_file_names)
+    input_files = []
+    for input_file_name, data in zip(input_file_names, contents):
+        name, ext = os.path.splitext(input_file_name)
+        ext = ext[1:]
+        if not ext:
+            if data is None:
+                ext = sniff_file_format(input_file_name)
+            else:
+                ext = sniff_format(memoryview(data)[:SNIFF_SIZE])
+            if ext is None:
+                raise Error('Cannot determine format of %r' % input_file_name)
+        elif ext not in FORMATS_SET:
+            raise Error('Unrecognized input format: %r' % ext)
+        input_files.append(FontFile(input_file_name, name, ext, data,
+            in_memory=data is not None))
+    return input_files
+
+def parse_output_formats(output_formats_str):
+    """Parse a comma-separated list of output formats, each of which may be
+    suffixed with `:inline`. Return a list of (format, inline) pairs."""
+    if output_formats_str is None:
+        return [(f, False) for f in DEFAULT_OUTPUT_FORMATS]
+    output_formats = output_formats_str.split(',')
+    # Check if any formats are suffixed with `:inline`
+    parsed_output_formats = [remove_suffix(f, ':inline') for f in output_formats]
+    # Check for unrecognized formats
+    unrecognized_formats = set(f for f, inline in parsed_output_formats) - FORMATS_SET
+    if unrecognized_formats:
+        raise Error('Unrecognized output formats: %s' % ', '.join(unrecognized_formats))
+    return parsed_output_formats
+
+def format_output_formats(parsed_output_formats):
+    """The inverse of parse_output_formats."""
+    return ','.join(
+        f + (':inline' if inline else '')
+        for f, inline in parsed_output_formats)
+
+# Formats which only old browsers need: eot for Internet Explorer 8 and
+# earlier, and svg for Safari on iOS 4.1 and earlier
+LEGACY_FORMATS = frozenset(['eot', 'svg'])
+
+# Formats in order of preference for browsers which support all of them
+BEST_FORMATS = ['woff2', 'woff', 'ttf', 'otf']
+
+BROWSER_PROFILES = ['all', 'modern', 'evergreen']
+
+def apply_browser_profile(parsed_output_formats, profile):
+    """Leave out the output formats which no browser in a profile needs.
+    `all` keeps every format, `modern` leaves out the legacy formats, and
+    `evergreen`, for browsers which keep themselves up to date, keeps only
+    the best format."""
+    if profile not in BROWSER_PROFILES:
+        raise Error('Unrecognized browser profile: %r' % profile)
+    if profile == 'all':
+        return parsed_output_formats
+    formats = [
+        (f, inline) for f, inline in parsed_output_formats
+        if f not in LEGACY_FORMATS ]
+    if profile == 'evergreen':
+        for best_format in BEST_FORMATS:
+            best_formats = [(f, inline) for f, inline in formats
+                if f == best_format]
+            if best_formats:
+                formats = best_formats
+                break
+    if not formats:
+        raise Error('Browsers in the %s profile need none of the output '
+            'formats' % profile)
+    return formats
+
+def parse_engines(engines_str):
+    """Parse a comma-separated list of engines."""
+    if engines_str is None:
+        return DEFAULT_ENGINES
+    engines = frozenset(engines_str.split(','))
+    unrecognized_engines = engines - ENGINES_SET
+    if unrecognized_engines:
+        raise Error('Unrecognized engines: %s' % ', '.join(sorted(unrecognized_engines)))
+    return engines
+
+def default_prefix(output_dir):
+    """The default CSS prefix is the name of the output directory."""
+    output_dir_parts = output_dir.split(os.sep)
+    if not output_dir_parts[-1]:
+        output_dir_parts.pop()
+    if output_dir_parts:
+        output_dir_parts.append('')
+    return '/'.join(output_dir_parts)
+
+def default_font_family(input_file_names):
+    """The default font family is the base name of the first input file."""
+    return os.path.splitext(os.path.basename(input_file_names[0]))[0]
+
+FONT_DISPLAY_VALUES = ['auto', 'block', 'swap', 'fallback', 'optional']
+
+def parse_font_display(font_display_str):
+    """Check a value of the font-display descriptor."""
+    if font_display_str is not None and \
+            font_display_str not in FONT_DISPLAY_VALUES:
+        raise Error('Unrecognized font-display value: %r' % font_display_str)
+    return font_display_str
+
+Face = collections.namedtuple('Face',
+    ['name', 'input_files', 'font_weight', 'font_style'])
+Face.__doc__ = """One weight and style of a font family, with its input files
+in different formats. `font_weight` and `font_style` are None if they are the
+defaults."""
+
+def group_faces(input_files):
+    """Group the input files of a family into faces by the weight and style
+    recorded in them, in the order in which the faces first appear. Files
+    which record neither, such as some SVG fonts, belong to the face of a
+    file with the same base name, or else to the regular face. Every face is
+    named after its first file."""
+    faces = collections.OrderedDict()
+    unknown_files = []
+    for input_file in input_files:
+        metadata = font_metadata([input_file])
+        if metadata.weight is None and metadata.style is None:
+            unknown_files.append(input_file)
+        else:
+            faces.setdefault(css_descriptors(metadata), []).append(input_file)
+    for input_file in unknown_files:
+        descriptors = next((
+            descriptors for descriptors, face_files in faces.items()
+            if any(f.svg_id() == input_file.svg_id() for f in face_files) ),
+            (None, None))
+        faces.setdefault(descriptors, []).append(input_file)
+    # Keep the files and faces in the order given
+    order = { f : i for i, f in enumerate(input_files) }
+    result = []
+    names = {}
+    for (font_weight, font_style), face_files in sorted(faces.items(),
+            key=lambda item: min(order[f] for f in item[1])):
+        face_files.sort(key=order.get)
+        name = face_files[0].svg_id()
+        if name in names:
+            # The outputs of both would be written to the same files
+            raise Error('%s and %s are different faces with the same name' % (
+                names[name], face_files[0].full_path))
+        names[name] = face_files[0].full_path
+        result.append(Face(name, face_files, font_weight, font_style))
+    return result
+
+ConversionOptions = collections.namedtuple('ConversionOptions', [
+    'parsed_output_formats', 'css_file_name', 'preload_file_name', 'prefix',
+    'font_family', 'font_display', 'inline_under', 'threads', 'cache',
+    'incremental', 'engines', 'cost_model', 'subsets', 'subset_frequency',
+    'precompress', 'hash_names', 'asset_manifest'])
+ConversionOptions.__new__.__defaults__ = (None, None, None, None, None,
+    None, 1, None, False, DEFAULT_ENGINES, None, None, (), None, False, None)
+ConversionOptions.__doc__ = """How to convert font families, which is the
+same for every family of a batch.
+
+`parsed_output_formats` are the output formats, as returned by
+parse_output_formats. `css_file_name` and `preload_file_name` are the names
+of the CSS and preload link files to write, for callers which write them to
+files. URLs in the CSS are prefixed with `prefix`, by default the name of the
+output directory. The family name is read from the input files, unless
+`font_family` is given, and `font_display` is the font-display of every
+@font-face rule, if given. If `inline_under` is given, the first of the
+output formats which are not marked as inline, leaving out eot and svg, is
+inlined in the CSS anyway if its data URL would be shorter than that.
+
+Up to `threads` independent conversions are run at the same time, and
+conversions are looked up in `cache` if given. In `incremental` mode, output
+files which are up to date are not generated again. Only the converters in
+`engines` are used. If a `cost_model` is given, the fastest tools according
+to it are used, and their running times are recorded in it.
+
+If `subsets` (as returned by parse_subsets) is given, fonts are split into
+shards covering different ranges of Unicode, with the CJK characters in
+`subset_frequency` first. If `precompress` (as returned by parse_encodings)
+is given, compressed copies of the output files which are not inlined are
+written next to them. If `hash_names` is set, the output files which are not
+inlined are copied to names which include hashes of their contents, and the
+names are recorded in the asset manifest file `asset_manifest`, by default in
+the output directory."""
+
+def generate_family(input_files, output_dir, options, logger, css_fout=None,
+        preload_fout=None, profiler=None, cancelled=None):
+    """Convert the input files of a font family as set by `options`, a
+    ConversionOptions tuple, and write its CSS to `css_fout` if given. Every
+    stage is timed with `profiler` if given. Once the threading.Event
+    `cancelled`, if given, is set, nothing more is written, and
+    ConversionCancelled is raised.
+
+    The input files are grouped into faces by their weights and styles (see
+    group_faces), each of which is converted separately and gets its own
+    @font-face rule with the right font-weight and font-style. If
+    `preload_fout` is given, a <link rel="preload"> tag for the best format
+    of every face is written to it. If there are several faces, return a
+    dict mapping each face name to what would be returned for it alone.
+
+    If fonts are split into shards, each shard is converted separately and
+    gets its own @font-face rule. In that case, return a dict mapping each
+    shard name to its output files. If output files are named after their
+    contents, the returned dicts refer to the copies."""
+    input_files = list(input_files)
+    prefix = options.prefix
+    font_family = options.font_family
+    # Reject bad input before starting any converters
+    with profile_stage(profiler, 'check input files', 'planning'):
+        check_font_files(input_files)
+        faces = group_faces(input_files)
+    if prefix is None and (css_fout is not None or preload_fout is not None):
+        prefix = default_prefix(output_dir)
+    if css_fout is not None and font_family is None:
+        font_family = font_metadata(input_files).family or \
+            default_font_family([f.full_path for f in input_files])
+    # Faces are converted in parallel, so split the threads between them
+    face_threads = max(1, options.threads // len(faces))
+    def convert_face(face):
+        if options.subsets is not None:
+            return _generate_shards(face.input_files, output_dir, options,
+                logger, face_threads, profiler, cancelled)
+        return [_convert_font(face.input_files, output_dir, options, logger,
+            face_threads, profiler, cancelled)]
+    if len(faces) == 1:
+        face_results = [convert_face(faces[0])]
+    else:
+        with concurrent.futures.ThreadPoolExecutor(options.threads) as executor:
+            futures = [executor.submit(convert_face, face) for face in faces]
+            # Report the error of the first face which failed
+            face_results = [future.result() for future in futures]
+    check_cancelled(cancelled)
+    if css_fout is not None:
+        for face, converted_fonts in zip(faces, face_results):
+            for converted in converted_fonts:
+                _write_css(css_fout, converted, prefix, font_family, face,
+                    options.font_display, logger, profiler)
+    if preload_fout is not None:
+        # Only preload the first shard, which holds the characters listed
+        # first with --subset; the browser fetches the others when needed
+        generate_preload_links(preload_fout, [
+            (converted_fonts[0].formats, converted_fonts[0].output_files)
+            for converted_fonts in face_results ], prefix)
+    served_files = [
+        converted.output_files[f]
+        for converted_fonts in face_results
+        for converted in converted_fonts
+        for f, inline in converted.formats if not inline ]
+    if options.hash_names:
+        asset_manifest = options.asset_manifest
+        if asset_manifest is None:
+            asset_manifest = os.path.join(output_dir, ASSET_MANIFEST_FILE_NAME)
+        update_asset_manifest(asset_manifest, served_files, logger)
+    if options.precompress is not None:
+        precompress_files(served_files, options.precompress, logger,
+            options.threads, options.incremental, profiler)
+    results = [
+        converted_fonts[0].output_files if options.subsets is None else
+            collections.OrderedDict(
+                (converted.shard.name, converted.output_files)
+                for converted in converted_fonts)
+        for converted_fonts in face_results ]
+    if len(faces) == 1:
+        return results[0]
+    return collections.OrderedDict(
+        (face.name, result) for face, result in zip(faces, results))
+
+def required_output_formats(input_files, parsed_output_formats):
+    """Figure out which files to generate for a font. Include the inline
+    font formats that are not already included in the input files, since
+    inlining requires the contents of those files."""
+    input_formats = { f.format for f in input_files }
+    return {
+        f for f, inline in parsed_output_formats
+        if (not inline) or (inline and f not in input_formats) }
+
+# A font converted to the output formats. `formats` are the output formats,
+# with those which are inlined because of their sizes marked as such.
+# `css_files` includes the input files used for inlining.
+_ConvertedFont = collections.namedtuple('_ConvertedFont',
+    ['shard', 'formats', 'output_files', 'css_files'])
+
+def _convert_font(input_files, output_dir, options, logger, threads,
+        profiler, cancelled):
+    parsed_output_formats = options.parsed_output_formats
+    css_inline_files_dict = { f.format : f for f in input_files }
+    output_formats = required_output_formats(input_files,
+        parsed_output_formats)
+    output_files_dict = convert_files(
+        input_files, output_dir, output_formats, logger, threads,
+        options.cache, options.incremental, options.engines, profiler,
+        options.cost_model, cancelled)
+    if options.inline_under is not None:
+        parsed_output_formats = _inline_small_file(parsed_output_formats,
+            output_files_dict, options.inline_under)
+    if options.hash_names:
+        check_cancelled(cancelled)
+        for f, inline in parsed_output_formats:
+            if not inline:
+                output_files_dict[f] = add_content_hash(
+                    output_files_dict[f], logger)
+    css_inline_files_dict.update(output_files_dict)
+    return _ConvertedFont(None, parsed_output_formats, output_files_dict,
+        css_inline_files_dict)
+
+def _inline_small_file(parsed_output_formats, output_files_dict,
+        inline_under):
+    # Inline the first modern format which is not inlined already if it is
+    # small enough that a request for it would cost more than the bytes it
+    # adds to the CSS. Browsers which support it never fetch the formats
+    # after it, so inlining those too would only make the CSS bigger.
+    for i, (f, inline) in enumerate(parsed_output_formats):
+        if not inline and f not in LEGACY_FORMATS:
+            size = data_url_size(f, font_file_size(output_files_dict[f]))
+            if size < inline_under:
+                parsed_output_formats = list(parsed_output_formats)
+                parsed_output_formats[i] = (f, True)
+            break
+    return parsed_output_formats
+
+def css_descriptors(metadata):
+    """Return the font-weight and font-style descriptors for a font with the
+    given metadata. Those which are the defaults, or are unknown, are None,
+    and need not be written."""
+    weight = None if metadata.weight in (None, 400) else metadata.weight
+    style = None if metadata.style in (None, 'normal') else metadata.style
+    return weight, style
+
+def _write_css(css_fout, converted, prefix, font_family, face,
+        font_display, logger, profiler):
+    unicode_range = None if converted.shard is None else \
+        format_unicode_range(converted.shard.code_points)
+    with profile_stage(profiler, 'generate css', 'css') as stage:
+        counting_fout = CountingWriter(css_fout)
+        generate_css(counting_fout, converted.formats, converted.css_files,
+            prefix, font_family, unicode_range, face.font_weight,
+            face.font_style, font_display)
+        inlined_sizes = [
+            (f, font_file_size(converted.css_files[f]))
+            for f, inline in converted.formats if inline ]
+        if stage is not None:
+            stage.bytes_read = sum(size for f, size in inlined_sizes)
+            stage.bytes_written = counting_fout.count
+    name = face.name if converted.shard is None else '%s %s' % (
+        face.name, converted.shard.name)
+    logger.info('wrote %d bytes of CSS for %s, %d of them inlined fonts' % (
+        counting_fout.count, name,
+        sum(data_url_size(f, size) for f, size in inlined_sizes)))
+
+def _generate_shards(input_files, output_dir, options, logger, threads,
+        profiler, cancelled):
+    source_file = subset_source(input_files)
+    with profile_stage(profiler, 'plan shards', 'planning'):
+        shards = plan_shards(source_file, options.subsets,
+            options.subset_frequency)
+    # Shards are converted in parallel, so split the threads between them
+    shard_threads = max(1, threads // len(shards))
+    def convert_shard(shard):
+        check_cancelled(cancelled)
+        with profile_stage(profiler, 'subset %s' % shard.name, 'subset'):
+            shard_file = write_shard(source_file, shard, output_dir)
+        logger.info('cut shard %s with %d characters into %s' % (
+            shard.name, len(shard.code_points), shard_file.full_path))
+        converted = _convert_font([shard_file], output_dir, options, logger,
+            shard_threads, profiler, cancelled)
+        return converted._replace(shard=shard)
+    with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+        futures = [executor.submit(convert_shard, shard) for shard in shards]
+        # Report the error of the first shard which failed
+        return [future.result() for future in futures]
@@ -1,3 +1,4 @@
+import heapq
 import collections
 
 class Vertex:
@@ -59,33 +60,41 @@ class ShortestPathsVertex(Vertex):
             self.weight = weight
 
 class Heap:
-    """An uncomplicated implementation of the heap data structure utilized by
-    Dijkstra's algorithm. This has abysmal remove-min performance. Don't try
-    this at home, kids."""
+    """A binary heap for Dijkstra's algorithm. Rather than moving entries
+    around, decrease-key pushes a new entry and leaves the old one in place,
+    to be skipped when it reaches the top. Values with equal keys are removed
+    in the order in which they were first inserted."""
 
     def __init__(self):
-        self.values = {}
+        self.entries = []
+        self.keys = {}
+        self.order = {}
 
     def insert(self, value, key):
-        """Constant time complexity."""
-        self.values[value] = key
+        """Logarithmic time complexity."""
+        self.keys[value] = key
+        order = self.order.setdefault(value, len(self.order))
+        heapq.heappush(self.entries, (key, order, value))
 
     def remove_min(self):
-        """Linear time complexity."""
-        value, key = min(self.values.items(), key=lambda p: p[1])
-        del self.values[value]
-        return value, key
+        """Amortized logarithmic time complexity."""
+        while True:
+            key, order, value = heapq.heappop(self.entries)
+            # Skip entries which have been superseded by decrease_key
+            if self.keys.get(value) is key:
+                del self.keys[value]
+                return value, key
 
     def decrease_key(self, value, new_key):
-        """Constant time complexity."""
-        self.values[value] = new_key
+        """Logarithmic time complexity."""
+        self.insert(value, new_key)
 
     def __len__(self):
-        return len(self.values)
+        return len(self.keys)
 
 def compute_shortest_paths(source_vertex, destination_vertices, zero=0):
     """An implementation of Dijkstra's algorithm with time complexity
-    O(V^2 + E).
+    O((V + E) log V).
     
     After this procedure finishes, the vertices of the graph will have their
     shortest path metadata filled in. Note that the resulting sub-graph of
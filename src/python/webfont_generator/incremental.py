@@ -0,0 +1,81 @@
+import os
+import os.path
+import json
+import threading
+
+STATE_FILE_NAME = '.webfont-generator-state.json'
+
+# Serializes saving, since several conversions may share an output directory
+_save_lock = threading.Lock()
+
+def _file_signature(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+class BuildState(object):
+    """Records how every output file in a directory was generated: which
+    operation generated it, from which input files, and the sizes and
+    modification times of the input and output files at the time. This
+    makes it possible to skip operations whose output files are up to
+    date."""
+
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, STATE_FILE_NAME)
+        self._lock = threading.Lock()
+        self._records = self._load()
+        self._updated = set()
+
+    def _load(self):
+        try:
+            with open(self.path) as fin:
+                return json.load(fin)
+        except (OSError, ValueError):
+            # Start over if the state is missing or unreadable
+            return {}
+
+    def _record(self, operation, input_files, output_file):
+        return {
+            'operation' : operation.__name__,
+            'inputs' : [
+                [os.path.abspath(f.full_path), _file_signature(f.full_path)]
+                for f in input_files ],
+            'output' : _file_signature(output_file.full_path)
+        }
+
+    def is_current(self, operation, input_files, output_files):
+        """Return whether the output files of an operation were generated by
+        the same operation from the same, unchanged input files, and have not
+        changed since."""
+        for output_file in output_files:
+            record = self._records.get(os.path.abspath(output_file.full_path))
+            if (record is None or
+                    record['output'] is None or
+                    record != self._record(operation, input_files, output_file)):
+                return False
+        return True
+
+    def update(self, operation, input_files, output_files):
+        for output_file in output_files:
+            record = self._record(operation, input_files, output_file)
+            with self._lock:
+                path = os.path.abspath(output_file.full_path)
+                self._records[path] = record
+                self._updated.add(path)
+
+    def save(self):
+        with self._lock:
+            updated = { path : self._records[path] for path in self._updated }
+        if not os.path.isdir(os.path.dirname(self.path) or '.'):
+            return
+        with _save_lock:
+            # Keep the records saved by other conversions into the same
+            # directory in the meantime
+            records = self._load()
+            records.update(updated)
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w') as fout:
+                json.dump(records, fout, indent=1, sort_keys=True)
+            os.replace(temp_path, self.path)
@@ -0,0 +1,89 @@
+import os
+import time
+import resource
+
+from .workers import shared_worker_pids
+
+_CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+# ru_maxrss is in kilobytes on Linux, but in bytes on macOS
+_MAXRSS_UNIT = 1 if os.uname().sysname == 'Darwin' else 1024
+
+def _proc_cpu_time(pid):
+    """Return the user and system CPU time of a running process, or None if
+    it cannot be determined (e.g. there is no /proc)."""
+    try:
+        with open('/proc/%d/stat' % pid) as fin:
+            stat = fin.read()
+    except OSError:
+        return None
+    # The command name may contain spaces, so split after it
+    fields = stat[stat.rindex(')') + 2:].split()
+    return int(fields[11]) / _CLOCK_TICKS, int(fields[12]) / _CLOCK_TICKS
+
+def _proc_peak_rss(pid):
+    try:
+        with open('/proc/%d/status' % pid) as fin:
+            for line in fin:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+def _worker_cpu_times():
+    times = {}
+    for pid in shared_worker_pids():
+        cpu_time = _proc_cpu_time(pid)
+        if cpu_time is not None:
+            times[pid] = cpu_time
+    return times
+
+class Measurement(object):
+    """Measures the wall time, CPU time and peak memory usage of a block of
+    code, used as a context manager.
+
+    CPU time is split between this process and its children. Child CPU time
+    covers child processes which have exited as well as the persistent
+    worker processes, which never exit while they are in use. Peak RSS
+    figures are high-water marks for the whole process so far, since the
+    kernel has no way to reset them."""
+
+    def __enter__(self):
+        self._start_self = resource.getrusage(resource.RUSAGE_SELF)
+        self._start_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self._start_workers = _worker_cpu_times()
+        self._start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wall_time = time.perf_counter() - self._start_time
+        end_self = resource.getrusage(resource.RUSAGE_SELF)
+        end_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        end_workers = _worker_cpu_times()
+        self.user_time = end_self.ru_utime - self._start_self.ru_utime
+        self.system_time = end_self.ru_stime - self._start_self.ru_stime
+        self.child_user_time = end_children.ru_utime - self._start_children.ru_utime
+        self.child_system_time = end_children.ru_stime - self._start_children.ru_stime
+        for pid, (user_time, system_time) in end_workers.items():
+            # Workers started during the measurement count from zero
+            start_user_time, start_system_time = \
+                self._start_workers.get(pid, (0, 0))
+            self.child_user_time += user_time - start_user_time
+            self.child_system_time += system_time - start_system_time
+        self.peak_rss = end_self.ru_maxrss * _MAXRSS_UNIT
+        self.peak_child_rss = max(
+            [end_children.ru_maxrss * _MAXRSS_UNIT] +
+            [_proc_peak_rss(pid) for pid in end_workers])
+        return False
+
+    def as_dict(self):
+        return {
+            'wall_time' : self.wall_time,
+            'user_time' : self.user_time,
+            'system_time' : self.system_time,
+            'child_user_time' : self.child_user_time,
+            'child_system_time' : self.child_system_time,
+            'peak_rss' : self.peak_rss,
+            'peak_child_rss' : self.peak_child_rss
+        }
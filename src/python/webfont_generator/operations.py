@@ -1,10 +1,16 @@
+import io
 import os.path
+import json
 import errno
 import shutil
+import contextlib
+import tempfile
 import subprocess
 
+from . import woff
 from .util import indent
 from .error import Error
+from .workers import WorkerProcess, shared_pool
 
 _d = os.path.dirname
 
@@ -12,12 +18,18 @@ BASE_DIR = _d(_d(_d(_d(os.path.realpath(__file__)))))
 VENDOR_DIR = os.path.join(BASE_DIR, 'vendor')
 
 class FontFile(object):
-    """Represents a font file in a particular format."""
+    """Represents a font file in a particular format. If the contents of the
+    file are already held in memory, they may be given as `data`, which is
+    any bytes-like object. If `in_memory` is set, the file exists only in
+    memory, and its path serves only as its name."""
 
-    def __init__(self, full_path, path_without_extension, format):
+    def __init__(self, full_path, path_without_extension, format, data=None,
+            in_memory=False):
         self.full_path = full_path
         self.path_without_extension = path_without_extension
         self.format = format
+        self.data = data
+        self.in_memory = in_memory
 
     def moved_and_converted_to(self, output_dir, format):
         basename_without_ext = os.path.basename(self.path_without_extension)
@@ -25,6 +37,11 @@ class FontFile(object):
         new_full_path = new_path_without_ext + os.extsep + format
         return FontFile(new_full_path, new_path_without_ext, format)
 
+    def converted_in_memory_to(self, format):
+        basename_without_ext = os.path.basename(self.path_without_extension)
+        return FontFile(basename_without_ext + os.extsep + format,
+            basename_without_ext, format, in_memory=True)
+
     def basename(self):
         return os.path.basename(self.full_path)
 
@@ -47,7 +64,10 @@ def copy_file(input_files, output_files, logger):
             input_path = input_file.full_path
             output_path = output_file.full_path
             logger.info('copying %s to %s' % (input_path, output_path))
-            _copy_file(input_path, output_path)
+            if input_file.in_memory or output_file.in_memory:
+                _write_output(output_file, _read_input(input_file))
+            else:
+                _copy_file(input_path, output_path)
             return
 
 def _copy_file(input_path, output_path):
@@ -60,9 +80,6 @@ def _copy_file(input_path, output_path):
 def _devnull(mode):
     return open(os.devnull, mode)
 
-def _ff_escape(s):
-    return s.replace('"', '\\"')
-
 def convert_with_fontforge(input_files, output_files, logger):
     for input_file in input_files:
         input_path = input_file.full_path
@@ -71,26 +88,54 @@ def convert_with_fontforge(input_files, output_files, logger):
         _convert_with_fontforge(input_path, output_paths)
         return
 
-def _convert_with_fontforge(input_path, output_paths):
-    output_paths = list(output_paths)
-    ensure_file_directory_exists(output_paths[0])
-    with _devnull('w') as fout:
-        p = subprocess.Popen(['fontforge', '-lang=ff', '-script', '-'],
-            stdin=subprocess.PIPE, stdout=fout, stderr=subprocess.PIPE)
-        # CIDFlatten flattens CID-based fonts (e.g. otf) with multiple
-        # sub-fonts into one single font.
-        # See https://github.com/bdusell/webfont-generator/issues/20
-        p.stdin.write(('Open("%s")\nCIDFlatten()\n' % _ff_escape(input_path)).encode('utf-8'))
-        for output_path in output_paths:
-            p.stdin.write(('Generate("%s")\n' % _ff_escape(output_path)).encode('utf-8'))
-        p.stdin.close()
-        err = p.stderr.read()
-        p.stderr.close()
-        if p.wait() != 0:
-            raise Error(
-                'FontForge conversion failed:\n'
-                'Output from FontForge:\n' +
-                indent(err.decode('ascii'), '  '))
+FONTFORGE_WORKER_PATH = os.path.join(BASE_DIR, 'src', 'fontforge', 'worker.py')
+FONTFORGE_COMMAND = ['fontforge', '-lang=py', '-script', FONTFORGE_WORKER_PATH]
+
+# Seconds a converter may spend on one font before it is taken to be hung.
+# Large CJK fonts take FontForge minutes, so this is generous.
+CONVERTER_TIMEOUT = 600
+
+class FontForgeWorker(WorkerProcess):
+    """A long-running FontForge process which converts one font after another
+    by running the commands it receives on stdin. See
+    src/fontforge/worker.py for the protocol."""
+
+    timeout = CONVERTER_TIMEOUT
+
+    def __init__(self):
+        super().__init__('FontForge', FONTFORGE_COMMAND)
+
+    def _wait_until_ready(self):
+        # Skip anything FontForge prints before it starts running the script
+        while self._read_reply() != 'ready':
+            pass
+
+    def convert(self, input_path, output_paths):
+        replies, output = self.request(
+            fontforge_commands(input_path, output_paths))
+        check_fontforge_replies(replies, output)
+        return output
+
+def fontforge_commands(input_path, output_paths):
+    """Return the commands which make a FontForge worker convert a font."""
+    commands = ['Open ' + json.dumps(input_path), 'CIDFlatten']
+    for output_path in output_paths:
+        commands.append('Generate ' + json.dumps(output_path))
+    commands.append('Close')
+    return commands
+
+def check_fontforge_replies(replies, output):
+    # A failed command causes the ones after it to fail as well, so the
+    # first error is the one to report
+    errors = [r for r in replies if r != 'ok']
+    if errors:
+        status, _, message = errors[0].partition(' ')
+        raise Error(
+            'FontForge conversion failed: %s\n'
+            'Output from FontForge:\n'
+            '%s' % (json.loads(message), indent(output, '  ')))
+
+def check_fontforge_outputs(output_paths, output):
     # Ensure that the files were actually generated
     bad_files = [p for p in output_paths if not os.path.isfile(p)]
     if bad_files:
@@ -99,9 +144,18 @@ def _convert_with_fontforge(input_path, output_paths):
             'Output from FontForge:\n'
             '%s' % (
                 ', '.join(bad_files),
-                indent(err.decode('ascii'), '  ')
+                indent(output, '  ')
             ))
 
+def _convert_with_fontforge(input_path, output_paths):
+    output_paths = list(output_paths)
+    ensure_file_directory_exists(output_paths[0])
+    # Reuse FontForge processes from one conversion to the next, since
+    # starting FontForge is a large part of the cost of converting a font
+    with shared_pool(FontForgeWorker).worker() as worker:
+        output = worker.convert(input_path, output_paths)
+    check_fontforge_outputs(output_paths, output)
+
 def convert_with_sfntly(input_files, output_files, logger):
     for input_file in input_files:
         input_path = input_file.full_path
@@ -113,16 +167,63 @@ SFNTLY_CLASSPATH = ':'.join([
     os.path.join(BASE_DIR, 'src', 'java'),
     os.path.join(VENDOR_DIR, 'sfntly', 'java', 'target', 'classes')
 ])
+SFNTLY_SERVER_COMMAND = [
+    'java', '-cp', SFNTLY_CLASSPATH, 'ConvertFont', '--server']
 
-def _convert_with_sfntly(input_path, output_paths):
-    output_paths = list(output_paths)
-    ensure_file_directory_exists(output_paths[0])
+class SfntlyWorker(WorkerProcess):
+    """A long-running JVM which converts one font after another using
+    `ConvertFont --server`. Reusing it avoids paying for JVM startup and
+    class loading on every font, and keeps the JIT-compiled conversion code
+    warm."""
+
+    # Includes starting the JVM on the first request
+    timeout = CONVERTER_TIMEOUT
+
+    def __init__(self):
+        super().__init__('sfntly', SFNTLY_SERVER_COMMAND)
+
+    def convert(self, input_path, output_paths):
+        (reply,), output = self.request(
+            [sfntly_request(input_path, output_paths)])
+        check_sfntly_reply(reply)
+
+def sfntly_request(input_path, output_paths):
+    """Return the request line which makes the sfntly server convert a font,
+    or None if the file names cannot be sent to it."""
+    if any('\t' in p or '\n' in p for p in [input_path] + output_paths):
+        return None
+    return '\t'.join([input_path] + output_paths)
+
+def check_sfntly_reply(reply):
+    if reply != 'ok':
+        status, _, message = reply.partition(' ')
+        raise Error('sfntly conversion failed: %s' % message)
+
+def sfntly_command(input_path, output_paths):
+    """Return the command which converts a font in a separate JVM."""
     command = ['java', '-cp', SFNTLY_CLASSPATH, 'ConvertFont', input_path]
     for output_path in output_paths:
         command.append('-o')
         command.append(output_path)
-    if subprocess.call(command) != 0:
-        raise Error('sfntly conversion failed')
+    return command
+
+def _convert_with_sfntly(input_path, output_paths):
+    output_paths = list(output_paths)
+    ensure_file_directory_exists(output_paths[0])
+    if sfntly_request(input_path, output_paths) is None:
+        # These file names cannot be sent to the server, so fall back to
+        # running a separate JVM
+        try:
+            status = subprocess.call(sfntly_command(input_path, output_paths),
+                timeout=CONVERTER_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            raise Error('sfntly did not finish within %d seconds, so it was '
+                'killed' % CONVERTER_TIMEOUT)
+        if status != 0:
+            raise Error('sfntly conversion failed')
+    else:
+        with shared_pool(SfntlyWorker).worker() as worker:
+            worker.convert(input_path, output_paths)
 
 def convert_with_woff2_compress(input_files, output_files, logger):
     for input_file in input_files:
@@ -135,8 +236,12 @@ WOFF2_COMPRESS_PATH = os.path.join(VENDOR_DIR, 'woff2', 'woff2_compress')
 
 def _convert_with_woff2_compress(input_path):
     with _devnull('r') as fin, _devnull('w') as fout:
-        code = subprocess.call([WOFF2_COMPRESS_PATH, input_path],
-            stdin=fin, stdout=fout, stderr=fout)
+        try:
+            code = subprocess.call([WOFF2_COMPRESS_PATH, input_path],
+                stdin=fin, stdout=fout, stderr=fout, timeout=CONVERTER_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            raise Error('woff2_compress did not finish within %d seconds, '
+                'so it was killed' % CONVERTER_TIMEOUT)
         if code != 0:
             raise Error('conversion with woff2_compress failed')
 
@@ -151,7 +256,133 @@ WOFF2_DECOMPRESS_PATH = os.path.join(VENDOR_DIR, 'woff2', 'woff2_decompress')
 
 def _convert_with_woff2_decompress(input_path):
     with _devnull('r') as fin, _devnull('w') as fout:
-        code = subprocess.call([WOFF2_DECOMPRESS_PATH, input_path],
-            stdin=fin, stdout=fout, stderr=fout)
+        try:
+            code = subprocess.call([WOFF2_DECOMPRESS_PATH, input_path],
+                stdin=fin, stdout=fout, stderr=fout, timeout=CONVERTER_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            raise Error('woff2_decompress did not finish within %d seconds, '
+                'so it was killed' % CONVERTER_TIMEOUT)
         if code != 0:
             raise Error('conversion with woff2_decompress failed')
+
+def _fonttools_woff2():
+    # fontTools is an optional dependency, needed only by this engine
+    try:
+        from fontTools.ttLib import woff2
+    except ImportError:
+        raise Error('the fonttools engine requires the fontTools package')
+    return woff2
+
+def _fonttools_input(input_file):
+    # Read from memory if the contents of the file are already there
+    if input_file.data is not None:
+        return io.BytesIO(input_file.data)
+    return input_file.full_path
+
+def convert_with_fonttools_woff2_compress(input_files, output_files, logger):
+    for input_file in input_files:
+        for output_file in output_files:
+            logger.info('using fontTools to convert %s to %s' % (input_file.full_path, output_file.full_path))
+            _convert_with_fonttools(
+                _fonttools_woff2().compress, input_file, output_file)
+            return
+
+def convert_with_fonttools_woff2_decompress(input_files, output_files, logger):
+    for input_file in input_files:
+        for output_file in output_files:
+            logger.info('using fontTools to convert %s to %s' % (input_file.full_path, output_file.full_path))
+            _convert_with_fonttools(
+                _fonttools_woff2().decompress, input_file, output_file)
+            return
+
+def _convert_with_fonttools(convert, input_file, output_file):
+    if output_file.in_memory:
+        output = io.BytesIO()
+    else:
+        output = output_file.full_path
+        ensure_file_directory_exists(output)
+    try:
+        convert(_fonttools_input(input_file), output)
+        if output_file.in_memory:
+            output_file.data = output.getvalue()
+    except ImportError:
+        # fontTools needs brotli for woff2
+        raise Error('the fonttools engine requires the brotli package')
+    except Exception as e:
+        raise Error('conversion with fontTools failed: %s' % e)
+
+def _read_input(input_file):
+    if input_file.data is not None:
+        return input_file.data
+    with open(input_file.full_path, 'rb') as fin:
+        return fin.read()
+
+def _write_output(output_file, data):
+    if output_file.in_memory:
+        output_file.data = data
+        return
+    ensure_file_directory_exists(output_file.full_path)
+    with open(output_file.full_path, 'wb') as fout:
+        fout.write(data)
+
+def convert_with_native_woff_encode(input_files, output_files, logger):
+    for input_file in input_files:
+        for output_file in output_files:
+            logger.info('using the native WOFF encoder to convert %s to %s' % (input_file.full_path, output_file.full_path))
+            data = woff.encode(_read_input(input_file), woff.shared_executor())
+            _write_output(output_file, data)
+            return
+
+def convert_with_native_woff_decode(input_files, output_files, logger):
+    for input_file in input_files:
+        for output_file in output_files:
+            logger.info('using the native WOFF decoder to convert %s to %s' % (input_file.full_path, output_file.full_path))
+            data, format = woff.decode(_read_input(input_file))
+            # A WOFF font wraps either TrueType or CFF outlines, and writing
+            # CFF outlines to a ttf file would mislabel them
+            if format != output_file.format:
+                raise Error('%s holds %s outlines, so it cannot be converted '
+                    'to %s with the native WOFF decoder' % (
+                    input_file.full_path,
+                    'CFF' if format == 'otf' else 'TrueType',
+                    output_file.format))
+            _write_output(output_file, data)
+            return
+
+# Operations which can read and write files which exist only in memory
+IN_MEMORY_OPERATIONS = frozenset([
+    copy_file,
+    convert_with_fonttools_woff2_compress,
+    convert_with_fonttools_woff2_decompress,
+    convert_with_native_woff_encode,
+    convert_with_native_woff_decode
+])
+
+@contextlib.contextmanager
+def files_on_disk(input_files, output_files):
+    """Stand in real files for files which may exist only in memory. Yield
+    lists of files corresponding to the input and output files, where files
+    held in memory are replaced by files in a temporary directory. The input
+    files are written there first, and the output files are read back
+    afterwards."""
+    with tempfile.TemporaryDirectory(prefix='webfont-generator-') as temp_dir:
+        def on_disk(font_file):
+            if not font_file.in_memory:
+                return font_file
+            return font_file.moved_and_converted_to(temp_dir, font_file.format)
+        disk_input_files = [on_disk(f) for f in input_files]
+        disk_output_files = [on_disk(f) for f in output_files]
+        for font_file, disk_file in zip(input_files, disk_input_files):
+            if font_file.in_memory:
+                _write_output(disk_file, font_file.data)
+        yield disk_input_files, disk_output_files
+        for font_file, disk_file in zip(output_files, disk_output_files):
+            if font_file.in_memory:
+                font_file.data = _read_input(disk_file)
+
+def run_on_disk(operation, input_files, output_files, logger):
+    """Run an operation which needs real files on files which may exist only
+    in memory."""
+    with files_on_disk(input_files, output_files) as (
+            disk_input_files, disk_output_files):
+        operation(disk_input_files, disk_output_files, logger)
@@ -0,0 +1,116 @@
+"""Writing compressed copies of generated files next to them, so that web
+servers can serve them as they are rather than compressing them for every
+request."""
+
+import os
+import os.path
+import gzip
+import concurrent.futures
+
+from .error import Error
+from .profile import profile_stage
+
+# woff and woff2 are compressed already, so only these formats benefit
+COMPRESSIBLE_FORMATS = frozenset(['ttf', 'otf', 'svg', 'eot'])
+
+# File name extensions of the compressed copies, in order of preference
+ENCODINGS = ['br', 'gz']
+
+def _brotli():
+    # brotli is an optional dependency, needed only for .br files
+    try:
+        import brotli
+    except ImportError:
+        raise Error('brotli precompression requires the brotli package')
+    return brotli
+
+def parse_encodings(encodings_str):
+    """Parse a comma-separated list of encodings. By default, both are
+    used."""
+    if encodings_str is None:
+        encodings = list(ENCODINGS)
+    else:
+        encodings = encodings_str.split(',')
+        unrecognized_encodings = set(encodings) - set(ENCODINGS)
+        if unrecognized_encodings:
+            raise Error('Unrecognized precompression formats: %s' % ', '.join(
+                sorted(unrecognized_encodings)))
+    if 'br' in encodings:
+        # Fail before converting anything
+        _brotli()
+    return encodings
+
+def _compress_gz(data, format):
+    # Leave out the modification time so that the output is reproducible
+    return gzip.compress(data, 9, mtime=0)
+
+def _compress_br(data, format):
+    brotli = _brotli()
+    mode = brotli.MODE_TEXT if format == 'svg' else brotli.MODE_FONT
+    return brotli.compress(data, mode=mode, quality=11, lgwin=24)
+
+COMPRESSORS = {
+    'gz' : _compress_gz,
+    'br' : _compress_br
+}
+
+def _is_up_to_date(compressed_path, path):
+    try:
+        return os.stat(compressed_path).st_mtime_ns >= os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+def precompress_file(font_file, encoding, logger, incremental=False):
+    """Write a copy of a file compressed with `encoding` next to it, with the
+    encoding appended to its name. If compressing does not make it smaller,
+    no copy is written. In incremental mode, a copy which is newer than the
+    file is left alone."""
+    path = font_file.full_path
+    compressed_path = path + os.extsep + encoding
+    if incremental and _is_up_to_date(compressed_path, path):
+        logger.info('skipping %s, already up to date' % compressed_path)
+        return
+    with open(path, 'rb') as fin:
+        data = fin.read()
+    compressed_data = COMPRESSORS[encoding](data, font_file.format)
+    if len(compressed_data) >= len(data):
+        # Serving the file itself is better, so make sure that an old copy
+        # is not served instead
+        logger.info('not compressing %s, since it would not get smaller' % path)
+        try:
+            os.remove(compressed_path)
+        except FileNotFoundError:
+            pass
+        return
+    logger.info('compressing %s to %s (%d to %d bytes)' % (
+        path, compressed_path, len(data), len(compressed_data)))
+    temp_path = compressed_path + '.tmp'
+    with open(temp_path, 'wb') as fout:
+        fout.write(compressed_data)
+    os.replace(temp_path, compressed_path)
+
+def precompress_files(font_files, encodings, logger, threads=1,
+        incremental=False, profiler=None):
+    """Write compressed copies of the files in compressible formats, with
+    every one of `encodings`. Up to `threads` files are compressed at the
+    same time."""
+    tasks = [
+        (font_file, encoding)
+        for font_file in font_files
+        if font_file.format in COMPRESSIBLE_FORMATS
+        for encoding in encodings ]
+    def compress(task):
+        font_file, encoding = task
+        with profile_stage(profiler,
+                'compress %s to %s' % (font_file.format, encoding), 'compress'):
+            precompress_file(font_file, encoding, logger, incremental)
+    if threads == 1 or len(tasks) <= 1:
+        for task in tasks:
+            compress(task)
+        return
+    # zlib and brotli release the GIL while compressing, so threads run in
+    # parallel
+    with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+        # Report the error of the first file which failed
+        for result in executor.map(compress, tasks):
+            pass
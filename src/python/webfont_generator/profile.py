@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import threading
+import contextlib
+
+from .measure import Measurement
+
+PROFILE_FORMATS = ['text', 'json', 'trace']
+
+def font_file_size(font_file):
+    if font_file is None:
+        return 0
+    if font_file.data is not None:
+        return len(font_file.data)
+    try:
+        return os.path.getsize(font_file.full_path)
+    except OSError:
+        return 0
+
+class Stage(object):
+    """One timed stage of a run, such as planning, a single operation, or
+    generating CSS."""
+
+    def __init__(self, name, category, start_time, thread_id, args):
+        self.name = name
+        self.category = category
+        self.start_time = start_time
+        self.thread_id = thread_id
+        self.args = args
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.measurement = None
+        self.error = None
+
+    def as_dict(self):
+        result = {
+            'name' : self.name,
+            'category' : self.category,
+            'start_time' : self.start_time,
+            'thread' : self.thread_id,
+            'bytes_read' : self.bytes_read,
+            'bytes_written' : self.bytes_written
+        }
+        result.update(self.measurement.as_dict())
+        result.update(self.args)
+        if self.error is not None:
+            result['error'] = self.error
+        return result
+
+class CountingWriter(object):
+    """Wraps a text file object and counts the characters written to it."""
+
+    def __init__(self, fout):
+        self.fout = fout
+        self.count = 0
+
+    def write(self, s):
+        self.count += len(s)
+        return self.fout.write(s)
+
+def profile_stage(profiler, name, category, **args):
+    """Time a stage with `profiler`, which may be None."""
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.stage(name, category, **args)
+
+class Profiler(object):
+    """Records the wall time, CPU time, peak memory usage and I/O of every
+    stage of a run, and writes them out as a report.
+
+    CPU times include those of child processes, including the persistent
+    FontForge and sfntly workers. When stages run concurrently, their CPU
+    times overlap, so profile with one thread to attribute CPU time exactly."""
+
+    def __init__(self):
+        self._start_time = time.perf_counter()
+        self._lock = threading.Lock()
+        self.stages = []
+
+    @contextlib.contextmanager
+    def stage(self, name, category, **args):
+        """Time the enclosed block as a stage. The stage object is yielded so
+        that the block can fill in the number of bytes read and written."""
+        stage = Stage(name, category,
+            time.perf_counter() - self._start_time,
+            threading.get_ident(), args)
+        try:
+            with Measurement() as stage.measurement:
+                yield stage
+        except BaseException as e:
+            stage.error = str(e)
+            raise
+        finally:
+            with self._lock:
+                self.stages.append(stage)
+
+    def wrap_process(self, process, ignored_operations=()):
+        """Wrap a function which processes a dependency tree vertex, so that
+        every operation other than `ignored_operations` is recorded as a
+        stage."""
+        def profiled_process(vertex):
+            if vertex.value in ignored_operations:
+                return process(vertex)
+            input_files = [e.file for e in vertex.incoming_edges]
+            output_files = [e.file for e in vertex.outgoing_edges]
+            name = '%s to %s' % (vertex.value.__name__, ', '.join(
+                f.format for f in output_files if f is not None))
+            with self.stage(name, 'operation',
+                    inputs=[f.full_path for f in input_files if f is not None],
+                    outputs=[f.full_path for f in output_files if f is not None]
+                    ) as stage:
+                stage.bytes_read = sum(map(font_file_size, input_files))
+                process(vertex)
+                stage.bytes_written = sum(map(font_file_size, output_files))
+        return profiled_process
+
+    def _sorted_stages(self):
+        with self._lock:
+            return sorted(self.stages, key=lambda s: s.start_time)
+
+    def write_report(self, out, format):
+        if format == 'json':
+            self.write_json(out)
+        elif format == 'trace':
+            self.write_trace(out)
+        else:
+            self.write_text(out)
+
+    def write_text(self, out):
+        stages = self._sorted_stages()
+        print('%-40s %9s %9s %9s %9s %11s %11s' % ('stage', 'wall',
+            'cpu', 'child cpu', 'child rss', 'read', 'written'), file=out)
+        totals = {}
+        for stage in stages:
+            m = stage.measurement
+            print('%-40s %8.3fs %8.3fs %8.3fs %8dM %11d %11d%s' % (
+                stage.name, m.wall_time, m.user_time + m.system_time,
+                m.child_user_time + m.child_system_time,
+                m.peak_child_rss // (1024 * 1024),
+                stage.bytes_read, stage.bytes_written,
+                ' (failed)' if stage.error is not None else ''), file=out)
+            totals[stage.category] = totals.get(stage.category, 0) + m.wall_time
+        print('Wall time by category:', ', '.join(
+            '%s %.3fs' % (category, wall_time)
+            for category, wall_time in sorted(
+                totals.items(), key=lambda item: -item[1])), file=out)
+
+    def write_json(self, out):
+        json.dump({ 'stages' : [s.as_dict() for s in self._sorted_stages()] },
+            out, indent=2, sort_keys=True)
+        out.write('\n')
+
+    def write_trace(self, out):
+        """Write the stages in the Chrome trace event format, which can be
+        loaded into chrome://tracing or Perfetto."""
+        events = []
+        for stage in self._sorted_stages():
+            args = stage.as_dict()
+            for key in ('name', 'category', 'start_time', 'thread'):
+                del args[key]
+            events.append({
+                'name' : stage.name,
+                'cat' : stage.category,
+                'ph' : 'X',
+                'ts' : stage.start_time * 1e6,
+                'dur' : stage.measurement.wall_time * 1e6,
+                'pid' : os.getpid(),
+                'tid' : stage.thread_id,
+                'args' : args
+            })
+        json.dump({ 'traceEvents' : events, 'displayTimeUnit' : 'ms' }, out)
+        out.write('\n')
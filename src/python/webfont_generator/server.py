@@ -0,0 +1,389 @@
+"""An HTTP service which converts uploaded fonts, so that fonts can be
+converted on demand without starting a process, FontForge and a JVM for
+every font."""
+
+import io
+import json
+import time
+import uuid
+import queue
+import zipfile
+import threading
+import collections
+import email.parser
+import email.policy
+import http.server
+import urllib.parse
+import concurrent.futures
+
+from .error import Error
+from .api import generate_webfonts
+from .family import input_font_files, parse_output_formats
+from .sniff import check_font_files
+from .dependencies import DEFAULT_ENGINES
+from .operations import FontForgeWorker, SfntlyWorker
+from .profile import Profiler
+from .workers import shared_pool, set_shared_pool_size
+
+DEFAULT_QUEUE_SIZE = 64
+DEFAULT_MAX_UPLOAD_SIZE = 32 * 1024 ** 2
+
+# The persistent converter processes used by each engine
+ENGINE_WORKERS = collections.OrderedDict([
+    ('fontforge', FontForgeWorker),
+    ('sfntly', SfntlyWorker)
+])
+
+class Metrics(object):
+    """Counts responses by status, and adds up the latency of every stage of
+    handling a request: waiting in the queue, converting (and every stage of
+    conversion recorded by the profiler), and packing the response."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.responses = collections.Counter()
+        # Map each stage to its count, total seconds and maximum seconds
+        self.stages = collections.OrderedDict()
+
+    def add_response(self, status):
+        with self._lock:
+            self.responses[status] += 1
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            stats = self.stages.setdefault(name, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+
+    def write(self, out, gauges):
+        """Write the metrics, along with the current values of `gauges`
+        (name, help, value triples), in the Prometheus text format."""
+        for name, help, value in gauges:
+            _write_metric_header(out, name, help, 'gauge')
+            out.write('%s %s\n' % (name, value))
+        with self._lock:
+            responses = sorted(self.responses.items())
+            stages = [(name, list(stats)) for name, stats in self.stages.items()]
+        _write_metric_header(out, 'webfont_generator_responses_total',
+            'Responses sent, by HTTP status.', 'counter')
+        for status, count in responses:
+            out.write('webfont_generator_responses_total{status="%d"} %d\n' % (
+                status, count))
+        _write_metric_header(out, 'webfont_generator_stage_seconds',
+            'Latency of every stage of handling a request.', 'summary')
+        for name, (count, total, maximum) in stages:
+            label = _escape_label(name)
+            out.write('webfont_generator_stage_seconds_count{stage="%s"} %d\n' % (label, count))
+            out.write('webfont_generator_stage_seconds_sum{stage="%s"} %f\n' % (label, total))
+        _write_metric_header(out, 'webfont_generator_stage_seconds_max',
+            'Longest latency of every stage of handling a request.', 'gauge')
+        for name, (count, total, maximum) in stages:
+            out.write('webfont_generator_stage_seconds_max{stage="%s"} %f\n' % (
+                _escape_label(name), maximum))
+
+def _write_metric_header(out, name, help, kind):
+    out.write('# HELP %s %s\n# TYPE %s %s\n' % (name, help, name, kind))
+
+def _escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class ConversionService(object):
+    """Converts fonts on a fixed number of worker threads, which take
+    requests from a queue of at most `queue_size` requests. Every worker
+    thread has a FontForge and an sfntly process of its own, which are
+    started up front."""
+
+    def __init__(self, workers, queue_size=DEFAULT_QUEUE_SIZE,
+            engines=DEFAULT_ENGINES, logger=None):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.engines = engines
+        self.logger = logger
+        self.metrics = Metrics()
+        self._queue = queue.Queue(queue_size)
+        self._threads = []
+        self._busy = 0
+        self._busy_lock = threading.Lock()
+
+    def start(self):
+        for engine, worker_class in ENGINE_WORKERS.items():
+            if engine in self.engines:
+                set_shared_pool_size(worker_class, self.workers)
+                try:
+                    shared_pool(worker_class).start()
+                except Error as e:
+                    # Report the problem now, and again for every request
+                    # which needs the converter
+                    self.logger.warning('%s' % e)
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        for thread in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(self, fonts, formats, font_family, prefix):
+        """Queue the conversion of some fonts, as for generate_webfonts.
+        Return a future for its GeneratedFonts. Raise queue.Full if the
+        queue is full."""
+        future = concurrent.futures.Future()
+        self._queue.put_nowait((time.perf_counter(), future,
+            (fonts, formats, font_family, prefix)))
+        return future
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def busy_workers(self):
+        with self._busy_lock:
+            return self._busy
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            queued_time, future, (fonts, formats, font_family, prefix) = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            start_time = time.perf_counter()
+            self.metrics.add_stage('queue', start_time - queued_time)
+            with self._busy_lock:
+                self._busy += 1
+            profiler = Profiler()
+            try:
+                result = generate_webfonts(fonts, formats, font_family,
+                    prefix, engines=self.engines, logger=self.logger,
+                    profiler=profiler)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            finally:
+                with self._busy_lock:
+                    self._busy -= 1
+                self.metrics.add_stage('convert', time.perf_counter() - start_time)
+                for stage in profiler.stages:
+                    self.metrics.add_stage(stage.name, stage.measurement.wall_time)
+
+def parse_uploaded_fonts(content_type, body, query):
+    """Return a dict mapping the file names of the fonts in a request to
+    their contents. The body is either a single font, whose file name is
+    given by the `filename` query parameter, or a multipart/form-data form
+    whose file fields are fonts."""
+    if content_type.startswith('multipart/form-data'):
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body)
+        fonts = collections.OrderedDict()
+        for part in message.iter_parts():
+            file_name = part.get_filename()
+            if file_name:
+                fonts[file_name.replace('\\', '/').rsplit('/', 1)[-1]] = \
+                    part.get_payload(decode=True)
+        if not fonts:
+            raise Error('The form contains no font files')
+        return fonts
+    file_names = query.get('filename')
+    if not file_names:
+        raise Error('The filename parameter is required')
+    return collections.OrderedDict([(file_names[0], body)])
+
+# Formats which are compressed already, so compressing them again is a waste
+COMPRESSED_FORMATS = frozenset(['woff', 'woff2'])
+
+def zip_response(result, css_file_name):
+    fout = io.BytesIO()
+    with zipfile.ZipFile(fout, 'w') as archive:
+        for file_name, data in result.files.items():
+            if file_name.rsplit('.', 1)[-1] in COMPRESSED_FORMATS:
+                compress_type = zipfile.ZIP_STORED
+            else:
+                compress_type = zipfile.ZIP_DEFLATED
+            archive.writestr(file_name, data, compress_type)
+        archive.writestr(css_file_name, result.css, zipfile.ZIP_DEFLATED)
+    return 'application/zip', fout.getvalue()
+
+def multipart_response(result, css_file_name):
+    boundary = uuid.uuid4().hex
+    parts = [(file_name, 'application/octet-stream', data)
+        for file_name, data in result.files.items()]
+    parts.append((css_file_name, 'text/css; charset=utf-8',
+        result.css.encode('utf-8')))
+    fout = io.BytesIO()
+    for file_name, content_type, data in parts:
+        fout.write((
+            '--%s\r\n'
+            'Content-Type: %s\r\n'
+            'Content-Disposition: attachment; filename="%s"\r\n'
+            '\r\n' % (boundary, content_type, file_name.replace('"', '\\"'))
+        ).encode('utf-8'))
+        fout.write(data)
+        fout.write(b'\r\n')
+    fout.write(('--%s--\r\n' % boundary).encode('ascii'))
+    return 'multipart/mixed; boundary=%s' % boundary, fout.getvalue()
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    """Handles the endpoints:
+
+      POST /convert  Convert the uploaded fonts, and respond with the
+                     converted files and their CSS
+      GET /health    Report whether the service can take more requests
+      GET /metrics   Report metrics in the Prometheus text format
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        path = urllib.parse.urlsplit(self.path).path
+        if path == '/health':
+            self._health()
+        elif path == '/metrics':
+            self._metrics()
+        else:
+            self._error(404, 'Not found')
+
+    def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != '/convert':
+            self._error(404, 'Not found')
+            return
+        self._convert(urllib.parse.parse_qs(url.query))
+
+    def _convert(self, query):
+        service = self.server.service
+        try:
+            length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            self.close_connection = True
+            self._error(411, 'Content-Length is required')
+            return
+        if length < 0:
+            self.close_connection = True
+            self._error(400, 'Content-Length is negative')
+            return
+        if length > self.server.max_upload_size:
+            # The body is left unread, so the connection cannot be reused
+            self.close_connection = True
+            self._error(413, 'The upload is larger than %d bytes' %
+                self.server.max_upload_size)
+            return
+        body = self.rfile.read(length)
+        try:
+            fonts = parse_uploaded_fonts(
+                self.headers.get('Content-Type', ''), body, query)
+            formats_str = query.get('formats', [None])[0]
+            formats = None if formats_str is None else formats_str.split(',')
+            # Reject bad files and formats before queueing
+            check_font_files(input_font_files(list(fonts),
+                list(fonts.values())))
+            parse_output_formats(formats_str)
+            font_family = query.get('font_family', [None])[0]
+            prefix = query.get('prefix', [''])[0]
+        except Error as e:
+            self._error(400, str(e))
+            return
+        try:
+            future = service.submit(fonts, formats, font_family, prefix)
+        except queue.Full:
+            # Shed load rather than letting the queue grow without bound
+            self._error(503, 'Too many requests are queued',
+                [('Retry-After', '1')])
+            return
+        try:
+            result = future.result()
+        except Error as e:
+            self._error(422, str(e))
+            return
+        except Exception as e:
+            service.logger.exception('conversion failed')
+            self._error(500, 'Internal error')
+            return
+        start_time = time.perf_counter()
+        # Name the CSS file after the font files, which are named after the
+        # first font
+        css_file_name = next(iter(fonts)).rsplit('.', 1)[0] + '.css'
+        if 'multipart/mixed' in self.headers.get('Accept', ''):
+            content_type, data = multipart_response(result, css_file_name)
+        else:
+            content_type, data = zip_response(result, css_file_name)
+        service.metrics.add_stage('respond', time.perf_counter() - start_time)
+        self._respond(200, content_type, data)
+
+    def _health(self):
+        service = self.server.service
+        depth = service.queue_depth()
+        overloaded = depth >= service.queue_size
+        body = json.dumps({
+            'status' : 'overloaded' if overloaded else 'ok',
+            'queue_depth' : depth,
+            'queue_size' : service.queue_size,
+            'busy_workers' : service.busy_workers(),
+            'workers' : service.workers,
+            'converters' : {
+                engine : shared_pool(worker_class).pids()
+                for engine, worker_class in ENGINE_WORKERS.items()
+                if engine in service.engines }
+        }, indent=1, sort_keys=True) + '\n'
+        self._respond(503 if overloaded else 200, 'application/json',
+            body.encode('utf-8'))
+
+    def _metrics(self):
+        service = self.server.service
+        gauges = [
+            ('webfont_generator_queue_depth',
+                'Requests waiting to be converted.', service.queue_depth()),
+            ('webfont_generator_queue_size',
+                'Maximum number of queued requests.', service.queue_size),
+            ('webfont_generator_busy_workers',
+                'Requests being converted.', service.busy_workers()),
+            ('webfont_generator_workers',
+                'Requests which can be converted at once.', service.workers)
+        ]
+        for engine, worker_class in ENGINE_WORKERS.items():
+            if engine in service.engines:
+                gauges.append((
+                    'webfont_generator_%s_busy' % engine,
+                    'Busy %s processes.' % engine,
+                    shared_pool(worker_class).busy_count()))
+        out = io.StringIO()
+        service.metrics.write(out, gauges)
+        self._respond(200, 'text/plain; version=0.0.4',
+            out.getvalue().encode('utf-8'))
+
+    def _error(self, status, message, headers=()):
+        self._respond(status, 'text/plain; charset=utf-8',
+            (message + '\n').encode('utf-8'), headers)
+
+    def _respond(self, status, content_type, body, headers=()):
+        self.server.service.metrics.add_response(status)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        if self.close_connection:
+            # Tell the client not to send another request
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        self.server.service.logger.info('%s - %s' % (
+            self.address_string(), format % args))
+
+class ConversionServer(http.server.ThreadingHTTPServer):
+    """An HTTP server in front of a ConversionService. Requests are read on
+    threads of their own, which wait while the service converts."""
+
+    daemon_threads = True
+
+    def __init__(self, address, service, max_upload_size=DEFAULT_MAX_UPLOAD_SIZE):
+        super().__init__(address, RequestHandler)
+        self.service = service
+        self.max_upload_size = max_upload_size
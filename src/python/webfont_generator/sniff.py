@@ -0,0 +1,420 @@
+"""Detecting the formats of font files from their first bytes, checking that
+their headers are intact, and reading their family names, weights and styles,
+all without running any of the converters. Only the headers and the tables
+which hold the metadata are read, not the rest of the file."""
+
+import re
+import zlib
+import struct
+import contextlib
+import collections
+import xml.sax.saxutils
+
+from .error import Error
+from .woff import (SFNT_HEADER, SFNT_TABLE_ENTRY, WOFF_HEADER,
+    WOFF_TABLE_ENTRY, WOFF_SIGNATURE, SFNT_FLAVORS)
+
+# Number of bytes read from the start of a file to detect its format
+SNIFF_SIZE = 4096
+
+# Number of bytes of an SVG font searched for its <font-face> element
+SVG_METADATA_SIZE = 64 * 1024
+
+WOFF2_SIGNATURE = b'wOF2'
+WOFF2_HEADER = struct.Struct('>4s4sIHHIIHHIIIII')
+
+EOT_HEADER = struct.Struct('<IIII10sBBIHH')
+EOT_MAGIC_NUMBER = 0x504c
+# Offset of the FamilyNameSize field, which follows the fixed-size fields
+EOT_FAMILY_NAME_OFFSET = 82
+
+NAME_HEADER = struct.Struct('>HHH')
+NAME_RECORD = struct.Struct('>HHHHHH')
+
+# Tables are identified by their indices in this list in a WOFF2 table
+# directory, or by a tag which follows if the index is 63
+WOFF2_KNOWN_TAGS = [t.encode('ascii') for t in [
+    'cmap', 'head', 'hhea', 'hmtx', 'maxp', 'name', 'OS/2', 'post', 'cvt ',
+    'fpgm', 'glyf', 'loca', 'prep', 'CFF ', 'VORG', 'EBDT', 'EBLC', 'gasp',
+    'hdmx', 'kern', 'LTSH', 'PCLT', 'VDMX', 'vhea', 'vmtx', 'BASE', 'GDEF',
+    'GPOS', 'GSUB', 'EBSC', 'JSTF', 'MATH', 'CBDT', 'CBLC', 'COLR', 'CPAL',
+    'SVG ', 'sbix', 'acnt', 'avar', 'bdat', 'bloc', 'bsln', 'cvar', 'fdsc',
+    'feat', 'fmtx', 'fvar', 'gvar', 'hsty', 'just', 'lcar', 'mort', 'morx',
+    'opbd', 'prop', 'trak', 'Zapf', 'Silf', 'Glat', 'Gloc', 'Feat', 'Sill']]
+
+# Formats which are interchangeable, since the converters look at the
+# contents of sfnt fonts rather than their extensions
+SFNT_FORMATS = frozenset(['ttf', 'otf'])
+
+FontMetadata = collections.namedtuple('FontMetadata',
+    ['family', 'weight', 'style'])
+FontMetadata.__doc__ = """The family name, numeric weight and CSS style
+(normal, italic or oblique) of a font. Any of these which the font does not
+record is None."""
+
+NO_METADATA = FontMetadata(None, None, None)
+
+def sniff_format(header):
+    """Return the format of a font given its first bytes, or None if they
+    are not those of any supported format."""
+    header = bytes(header)
+    signature = header[:4]
+    if signature in SFNT_FLAVORS:
+        return SFNT_FLAVORS[signature]
+    if signature == WOFF_SIGNATURE:
+        return 'woff'
+    if signature == WOFF2_SIGNATURE:
+        return 'woff2'
+    if len(header) >= EOT_HEADER.size and \
+            EOT_HEADER.unpack_from(header)[-1] == EOT_MAGIC_NUMBER:
+        return 'eot'
+    text = header.lstrip(b'\xef\xbb\xbf \t\r\n')
+    if text.startswith(b'<') and b'<svg' in text:
+        return 'svg'
+    return None
+
+class _Reader(object):
+    """Reads byte ranges of a font held in memory or in an open file."""
+
+    def __init__(self, data=None, fin=None):
+        self._data = data
+        self._fin = fin
+        if data is not None:
+            self.size = len(data)
+        else:
+            fin.seek(0, 2)
+            self.size = fin.tell()
+
+    def read(self, offset, length, what='header'):
+        if offset + length > self.size:
+            raise Error('%s extends past the end of the file' % what)
+        if self._data is not None:
+            return bytes(self._data[offset:offset + length])
+        self._fin.seek(offset)
+        return self._fin.read(length)
+
+    def head(self, length):
+        return self.read(0, min(length, self.size))
+
+@contextlib.contextmanager
+def _open_font(font_file):
+    if font_file.data is not None:
+        with memoryview(font_file.data) as view, view.cast('B') as data:
+            yield _Reader(data=data)
+    else:
+        try:
+            fin = open(font_file.full_path, 'rb')
+        except OSError as e:
+            raise Error('Cannot read %s: %s' % (font_file.full_path,
+                e.strerror))
+        with fin:
+            yield _Reader(fin=fin)
+
+def _sfnt_tables(reader):
+    """Check the table directory of an sfnt font, and return a dict mapping
+    the tags of its tables to functions which read them."""
+    flavor, num_tables, search_range, entry_selector, range_shift = \
+        SFNT_HEADER.unpack(reader.read(0, SFNT_HEADER.size))
+    if not num_tables:
+        raise Error('the font has no tables')
+    directory = reader.read(SFNT_HEADER.size,
+        num_tables * SFNT_TABLE_ENTRY.size, 'table directory')
+    tables = {}
+    for i in range(num_tables):
+        tag, checksum, offset, length = SFNT_TABLE_ENTRY.unpack_from(
+            directory, i * SFNT_TABLE_ENTRY.size)
+        if offset + length > reader.size:
+            raise Error('table %r extends past the end of the file' % tag)
+        tables[tag] = lambda offset=offset, length=length: \
+            reader.read(offset, length)
+    return tables
+
+def _woff_tables(reader):
+    header = WOFF_HEADER.unpack(reader.read(0, WOFF_HEADER.size))
+    length, num_tables = header[2:4]
+    if length != reader.size:
+        raise Error('the header gives a length of %d bytes, but the file is '
+            '%d bytes long' % (length, reader.size))
+    directory = reader.read(WOFF_HEADER.size,
+        num_tables * WOFF_TABLE_ENTRY.size, 'table directory')
+    tables = {}
+    for i in range(num_tables):
+        tag, offset, comp_length, orig_length, orig_checksum = \
+            WOFF_TABLE_ENTRY.unpack_from(directory, i * WOFF_TABLE_ENTRY.size)
+        if offset + comp_length > reader.size:
+            raise Error('table %r extends past the end of the file' % tag)
+        def read_table(tag=tag, offset=offset, comp_length=comp_length,
+                orig_length=orig_length):
+            data = reader.read(offset, comp_length)
+            if comp_length < orig_length:
+                try:
+                    data = zlib.decompress(data)
+                except zlib.error as e:
+                    raise Error('cannot decompress table %r: %s' % (tag, e))
+            return data
+        tables[tag] = read_table
+    return tables
+
+def _read_base128(data, offset):
+    """Read a UIntBase128 number from a WOFF2 table directory. Return it
+    and the offset after it."""
+    value = 0
+    for i in range(5):
+        if offset >= len(data):
+            break
+        byte = data[offset]
+        offset += 1
+        if i == 0 and byte == 0x80:
+            break
+        value = (value << 7) | (byte & 0x7f)
+        if not byte & 0x80:
+            return value, offset
+    raise Error('the table directory is corrupt')
+
+def _woff2_tables(reader):
+    header = WOFF2_HEADER.unpack(reader.read(0, WOFF2_HEADER.size))
+    flavor, length, num_tables = header[1], header[2], header[3]
+    total_compressed_size = header[6]
+    if length != reader.size:
+        raise Error('the header gives a length of %d bytes, but the file is '
+            '%d bytes long' % (length, reader.size))
+    # Every entry takes at most 15 bytes
+    directory = reader.read(WOFF2_HEADER.size,
+        min(num_tables * 15, reader.size - WOFF2_HEADER.size))
+    offset = 0
+    entries = []
+    stream_offset = 0
+    for i in range(num_tables):
+        if offset >= len(directory):
+            raise Error('the table directory is truncated')
+        flags = directory[offset]
+        offset += 1
+        tag_index = flags & 0x3f
+        transform_version = flags >> 6
+        if tag_index == 63:
+            tag = directory[offset:offset + 4]
+            offset += 4
+        else:
+            tag = WOFF2_KNOWN_TAGS[tag_index]
+        orig_length, offset = _read_base128(directory, offset)
+        # glyf and loca are transformed unless their version is 3; other
+        # tables are transformed unless it is 0
+        if tag in (b'glyf', b'loca'):
+            transformed = transform_version != 3
+        else:
+            transformed = transform_version != 0
+        if transformed:
+            stored_length, offset = _read_base128(directory, offset)
+        else:
+            stored_length = orig_length
+        if not transformed:
+            entries.append((tag, stream_offset, stored_length))
+        stream_offset += stored_length
+    data_offset = WOFF2_HEADER.size + offset
+    if data_offset + total_compressed_size > reader.size:
+        raise Error('the compressed tables extend past the end of the file')
+    if flavor == b'ttcf':
+        # The tables are shared between the fonts of a collection, which
+        # has no single family name
+        return {}
+    stream = []
+    def read_stream():
+        if not stream:
+            # brotli is an optional dependency; without it, the metadata of
+            # WOFF2 fonts is not read
+            try:
+                import brotli
+            except ImportError:
+                return None
+            try:
+                stream.append(brotli.decompress(
+                    reader.read(data_offset, total_compressed_size)))
+            except brotli.error as e:
+                raise Error('cannot decompress the tables: %s' % e)
+        return stream[0]
+    tables = {}
+    for tag, table_offset, table_length in entries:
+        def read_table(table_offset=table_offset, table_length=table_length):
+            data = read_stream()
+            if data is None:
+                return None
+            return data[table_offset:table_offset + table_length]
+        tables[tag] = read_table
+    return tables
+
+def _decode_name(platform_id, encoding_id, data):
+    if platform_id in (0, 3):
+        return data.decode('utf-16-be', 'replace')
+    if platform_id == 1 and encoding_id == 0:
+        return data.decode('mac_roman')
+    return None
+
+def _name_priority(record):
+    platform_id, encoding_id, language_id, name_id, length, offset = record
+    # Prefer the typographic family name, which is the same for every face
+    # of a family, and names in US English
+    return (
+        name_id != 16,
+        (platform_id, language_id) != (3, 0x409),
+        platform_id != 3,
+        (platform_id, language_id) != (1, 0))
+
+def _family_name(data):
+    if data is None or len(data) < NAME_HEADER.size:
+        return None
+    format, count, string_offset = NAME_HEADER.unpack_from(data)
+    records = []
+    for i in range(count):
+        record_offset = NAME_HEADER.size + i * NAME_RECORD.size
+        if record_offset + NAME_RECORD.size > len(data):
+            break
+        record = NAME_RECORD.unpack_from(data, record_offset)
+        if record[3] in (1, 16):
+            records.append(record)
+    for record in sorted(records, key=_name_priority):
+        platform_id, encoding_id, language_id, name_id, length, offset = record
+        start = string_offset + offset
+        name = _decode_name(platform_id, encoding_id,
+            data[start:start + length])
+        if name and name.strip():
+            return name.strip()
+    return None
+
+def _normalize_weight(weight):
+    if not weight:
+        return None
+    # Some old fonts give the weight on a scale from 1 to 9
+    if weight < 10:
+        weight *= 100
+    return min(weight, 1000)
+
+def _sfnt_metadata(tables):
+    def read(tag):
+        read_table = tables.get(tag)
+        return None if read_table is None else read_table()
+    family = _family_name(read(b'name'))
+    weight = style = None
+    os2 = read(b'OS/2')
+    if os2 is not None and len(os2) >= 64:
+        weight = _normalize_weight(struct.unpack_from('>H', os2, 4)[0])
+        fs_selection = struct.unpack_from('>H', os2, 62)[0]
+        if fs_selection & 0x1:
+            style = 'italic'
+        elif fs_selection & 0x200:
+            style = 'oblique'
+        else:
+            style = 'normal'
+    else:
+        head = read(b'head')
+        if head is not None and len(head) >= 46:
+            mac_style = struct.unpack_from('>H', head, 44)[0]
+            weight = 700 if mac_style & 0x1 else 400
+            style = 'italic' if mac_style & 0x2 else 'normal'
+    return FontMetadata(family, weight, style)
+
+def _eot_metadata(reader):
+    header = reader.read(0, EOT_HEADER.size)
+    (eot_size, font_data_size, version, flags, panose, charset, italic,
+        weight, fs_type, magic_number) = EOT_HEADER.unpack(header)
+    if eot_size != reader.size:
+        raise Error('the header gives a length of %d bytes, but the file is '
+            '%d bytes long' % (eot_size, reader.size))
+    if font_data_size > eot_size:
+        raise Error('the font data extends past the end of the file')
+    family = None
+    if reader.size >= EOT_FAMILY_NAME_OFFSET + 2:
+        name_size = struct.unpack('<H', reader.read(EOT_FAMILY_NAME_OFFSET, 2))[0]
+        if EOT_FAMILY_NAME_OFFSET + 2 + name_size <= reader.size:
+            family = reader.read(EOT_FAMILY_NAME_OFFSET + 2, name_size).decode(
+                'utf-16-le', 'replace').strip() or None
+    return FontMetadata(family, _normalize_weight(weight),
+        'italic' if italic else 'normal')
+
+FONT_FACE_PAT = re.compile(r'<font-face\b([^>]*)>')
+ATTRIBUTE_PAT = re.compile(r'''([\w:-]+)\s*=\s*(?:"([^"]*)"|'([^']*)')''')
+SVG_WEIGHTS = { 'normal' : 400, 'bold' : 700 }
+SVG_STYLES = frozenset(['normal', 'italic', 'oblique'])
+
+def _svg_metadata(reader):
+    text = reader.head(SVG_METADATA_SIZE).decode('utf-8', 'replace')
+    m = FONT_FACE_PAT.search(text)
+    if m is None:
+        return NO_METADATA
+    attributes = {
+        name : xml.sax.saxutils.unescape(double_quoted or single_quoted,
+            { '&quot;' : '"', '&apos;' : "'" })
+        for name, double_quoted, single_quoted
+        in ATTRIBUTE_PAT.findall(m.group(1)) }
+    family = attributes.get('font-family', '').strip() or None
+    weight = attributes.get('font-weight', '').strip()
+    if weight.isdigit():
+        weight = _normalize_weight(int(weight))
+    else:
+        weight = SVG_WEIGHTS.get(weight)
+    style = attributes.get('font-style', '').strip()
+    if style not in SVG_STYLES:
+        style = None
+    return FontMetadata(family, weight, style)
+
+TABLE_READERS = {
+    'ttf' : _sfnt_tables,
+    'otf' : _sfnt_tables,
+    'woff' : _woff_tables,
+    'woff2' : _woff2_tables
+}
+
+def _inspect(font_file, read_metadata):
+    with _open_font(font_file) as reader:
+        format = sniff_format(reader.head(SNIFF_SIZE))
+        if format is None:
+            raise Error('%s is not a font file in any supported format' %
+                font_file.full_path)
+        if format != font_file.format and not (
+                format in SFNT_FORMATS and font_file.format in SFNT_FORMATS):
+            raise Error('%s is a %s file, not %s' % (font_file.full_path,
+                format, font_file.format))
+        try:
+            read_tables = TABLE_READERS.get(format)
+            if read_tables is not None:
+                tables = read_tables(reader)
+                if read_metadata:
+                    return _sfnt_metadata(tables)
+            elif format == 'eot':
+                metadata = _eot_metadata(reader)
+                if read_metadata:
+                    return metadata
+            elif read_metadata:
+                return _svg_metadata(reader)
+        except (Error, struct.error) as e:
+            raise Error('%s is corrupt: %s' % (font_file.full_path, e))
+    return NO_METADATA
+
+def check_font_files(font_files):
+    """Check that the contents of the font files are in the formats given by
+    their extensions, and that their headers and table directories are
+    intact, so that bad input is rejected before any converter is run. ttf
+    and otf fonts may be given either extension."""
+    for font_file in font_files:
+        _inspect(font_file, False)
+
+def font_metadata(font_files):
+    """Read the family name, weight and style of a font from the first of
+    `font_files` which records each of them."""
+    family = weight = style = None
+    for font_file in font_files:
+        metadata = _inspect(font_file, True)
+        family = family or metadata.family
+        weight = weight or metadata.weight
+        style = style or metadata.style
+        if None not in (family, weight, style):
+            break
+    return FontMetadata(family, weight, style)
+
+def sniff_file_format(path):
+    """Return the format of a font file from its first bytes, or None if it
+    cannot be read or is not in any supported format."""
+    try:
+        with open(path, 'rb') as fin:
+            return sniff_format(fin.read(SNIFF_SIZE))
+    except OSError:
+        return None
@@ -0,0 +1,366 @@
+"""Distributing the conversion of font families across machines through a
+spool directory on a shared filesystem, with no other coordination. A batch
+is submitted as one job file per family. Workers claim jobs by renaming them,
+which only one of them can do, convert them, and record the outcome, and a
+collector waits for the outcomes of a batch.
+
+The spool directory holds these subdirectories:
+
+    batches/  one record per batch, listing its jobs
+    jobs/     jobs waiting for a worker
+    claimed/  jobs being converted, whose modification times are kept fresh
+              by the workers converting them
+    done/     the outcome of every finished job
+    tmp/      files being written, which are renamed into place once
+              complete
+
+Every file is written to tmp/ and then renamed, so no process ever reads a
+partly written file. A claim which is not kept fresh was left behind by a
+worker which died, and is put back in jobs/ by the next worker to notice."""
+
+import os
+import os.path
+import json
+import time
+import socket
+import secrets
+import threading
+
+from .error import Error
+from .batch import Family, convert_families
+from .family import (parse_output_formats, format_output_formats,
+    parse_engines, default_prefix, ConversionOptions)
+from .subset import parse_subsets, read_frequency_file
+from .precompress import parse_encodings
+
+SUBDIRECTORIES = ['batches', 'jobs', 'claimed', 'done', 'tmp']
+
+# Seconds after which a claim which has not been kept fresh is taken to be
+# abandoned
+DEFAULT_STALE_AFTER = 120
+
+# Seconds between checks for new jobs or finished batches
+DEFAULT_POLL_INTERVAL = 1
+
+# Number of times a job is handed out before it is given up on, so that a
+# family which brings down every worker that converts it does not do so
+# forever
+MAX_ATTEMPTS = 3
+
+JSON_EXTENSION = os.extsep + 'json'
+
+def worker_id():
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+class Job(object):
+    """A job claimed by a worker. `record` is the contents of the job file,
+    and `claim_path` is where the claimed job file is."""
+
+    def __init__(self, record, claim_path):
+        self.record = record
+        self.claim_path = claim_path
+
+    @property
+    def id(self):
+        return self.record['id']
+
+class Spool(object):
+    """The spool directory at `path`, which is created if needed."""
+
+    def __init__(self, path):
+        self.path = path
+        for name in SUBDIRECTORIES:
+            os.makedirs(os.path.join(path, name), exist_ok=True)
+
+    def _file(self, directory, name):
+        return os.path.join(self.path, directory, name)
+
+    def _write_json(self, directory, name, value):
+        temp_path = self._file('tmp', '%s.%s' % (secrets.token_hex(8), name))
+        with open(temp_path, 'w') as fout:
+            json.dump(value, fout, indent=1)
+            fout.write('\n')
+        os.replace(temp_path, self._file(directory, name))
+
+    def _read_json(self, path):
+        with open(path) as fin:
+            return json.load(fin)
+
+    def submit(self, families, output_dir, options):
+        """Submit a batch of font families to be converted, and return its
+        ID. `options` is a dict of the conversion options, as returned by
+        job_options. Paths are made absolute, so that workers running in
+        other directories find the same files."""
+        batch_id = '%s-%s' % (time.strftime('%Y%m%d%H%M%S'),
+            secrets.token_hex(4))
+        if options['prefix'] is None:
+            # Base the paths in the CSS on the output directory as given,
+            # not on its absolute path
+            options = dict(options, prefix=default_prefix(output_dir))
+        jobs = [
+            {
+                'id' : '%s-%04d' % (batch_id, i),
+                'batch' : batch_id,
+                'family' : family.name,
+                'input_files' : [
+                    os.path.abspath(name) for name in family.input_file_names ],
+                'output_dir' : os.path.abspath(output_dir),
+                'options' : options,
+                'attempts' : 0
+            }
+            for i, family in enumerate(families) ]
+        # Record the batch before any of its jobs can finish
+        self._write_json('batches', batch_id + JSON_EXTENSION, {
+            'id' : batch_id,
+            'jobs' : [
+                { 'id' : job['id'], 'family' : job['family'] }
+                for job in jobs ]
+        })
+        for job in jobs:
+            self._write_json('jobs', job['id'] + JSON_EXTENSION, job)
+        return batch_id
+
+    def claim(self):
+        """Claim the oldest waiting job, and return it, or None if there are
+        none."""
+        for name in sorted(os.listdir(os.path.join(self.path, 'jobs'))):
+            if not name.endswith(JSON_EXTENSION):
+                continue
+            # Claim files are unique to each claim, so that a worker which
+            # lost its claim cannot touch the claim of the next worker
+            claim_path = self._file('claimed', '%s.%s%s' % (
+                name[:-len(JSON_EXTENSION)], secrets.token_hex(4),
+                JSON_EXTENSION))
+            job_path = self._file('jobs', name)
+            try:
+                # Renaming keeps the modification time of the job file, which
+                # may be old enough to look stale once claimed
+                os.utime(job_path)
+                os.rename(job_path, claim_path)
+            except FileNotFoundError:
+                # Another worker claimed it first
+                continue
+            return Job(self._read_json(claim_path), claim_path)
+        return None
+
+    def heartbeat(self, job):
+        """Mark a claim as still in progress. Return False if the claim has
+        been lost, because it went stale and was put back."""
+        try:
+            os.utime(job.claim_path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def release(self, job):
+        """Put a claimed job back, unfinished."""
+        try:
+            os.rename(job.claim_path, self._file('jobs',
+                job.id + JSON_EXTENSION))
+        except FileNotFoundError:
+            pass
+
+    def finish(self, job, error, worker, started):
+        """Record the outcome of a job, where `error` is None if it
+        succeeded, and give up the claim. Return False if the claim had been
+        lost, in which case the job is left to the worker which holds it
+        now."""
+        if not self.heartbeat(job):
+            return False
+        self._finish(job.record, error, worker, started)
+        try:
+            os.remove(job.claim_path)
+        except FileNotFoundError:
+            # The claim went stale just after the heartbeat, and another
+            # worker put it back; the outcome is recorded all the same
+            pass
+        return True
+
+    def _finish(self, record, error, worker, started):
+        self._write_json('done', record['id'] + JSON_EXTENSION, {
+            'id' : record['id'],
+            'family' : record['family'],
+            'status' : 'ok' if error is None else 'failed',
+            'error' : error,
+            'worker' : worker,
+            'attempts' : record['attempts'] + 1,
+            'started' : started,
+            'finished' : time.time()
+        })
+
+    def recover_stale_claims(self, stale_after, logger):
+        """Put back the claimed jobs which have not been kept fresh for
+        `stale_after` seconds, since the workers which claimed them have
+        died. Jobs which have been handed out too many times already are
+        recorded as failed instead."""
+        claimed_dir = os.path.join(self.path, 'claimed')
+        now = time.time()
+        for name in os.listdir(claimed_dir):
+            claim_path = os.path.join(claimed_dir, name)
+            try:
+                if now - os.stat(claim_path).st_mtime < stale_after:
+                    continue
+                # Move the claim aside first, so that only one worker
+                # recovers it
+                temp_path = self._file('tmp', name)
+                os.rename(claim_path, temp_path)
+            except FileNotFoundError:
+                continue
+            record = self._read_json(temp_path)
+            if os.path.exists(self._file('done', record['id'] + JSON_EXTENSION)):
+                # The worker died after recording the outcome
+                pass
+            elif record['attempts'] + 1 >= MAX_ATTEMPTS:
+                logger.warning('giving up on %s (%s) after %d attempts' % (
+                    record['id'], record['family'], record['attempts'] + 1))
+                self._finish(record,
+                    'abandoned by %d workers' % (record['attempts'] + 1),
+                    None, None)
+            else:
+                logger.warning('putting back stale claim of %s (%s)' % (
+                    record['id'], record['family']))
+                record['attempts'] += 1
+                self._write_json('jobs', record['id'] + JSON_EXTENSION, record)
+            os.remove(temp_path)
+
+    def batch_results(self, batch_id):
+        """Return a (family name, outcome) pair for every job of a batch, in
+        the order submitted, where the outcome is the record written by
+        `finish`, or None if the job has not finished."""
+        try:
+            batch = self._read_json(self._file('batches',
+                batch_id + JSON_EXTENSION))
+        except FileNotFoundError:
+            raise Error('No batch %r in %s' % (batch_id, self.path))
+        results = []
+        for job in batch['jobs']:
+            try:
+                outcome = self._read_json(self._file('done',
+                    job['id'] + JSON_EXTENSION))
+            except FileNotFoundError:
+                outcome = None
+            results.append((job['family'], outcome))
+        return results
+
+def job_options(options, subset_strs, subset_frequency_file_name):
+    """Return the ConversionOptions of a batch as a dict which can be stored
+    in job files. The subsets and the frequency file, which need parsing, are
+    stored as given in `subset_strs` and `subset_frequency_file_name`, and
+    parsed again by the worker. The threads, cache and cost model are up to
+    the worker."""
+    def absolute(path):
+        return None if path is None else os.path.abspath(path)
+    return {
+        'formats' : format_output_formats(options.parsed_output_formats),
+        'css' : options.css_file_name,
+        'prefix' : options.prefix,
+        'engines' : ','.join(options.engines),
+        'subsets' : subset_strs,
+        'subset_frequency' : absolute(subset_frequency_file_name),
+        'precompress' : options.precompress,
+        'hash_names' : options.hash_names,
+        'asset_manifest' : absolute(options.asset_manifest),
+        'font_display' : options.font_display,
+        'preload' : options.preload_file_name,
+        'inline_under' : options.inline_under,
+        'incremental' : options.incremental
+    }
+
+def _convert_job(job, threads, cache, logger, cancelled):
+    options = job.record['options']
+    try:
+        subsets = parse_subsets(options['subsets']) if options['subsets'] else None
+        if options['subset_frequency'] is None:
+            subset_frequency = ()
+        else:
+            try:
+                subset_frequency = read_frequency_file(options['subset_frequency'])
+            except (OSError, ValueError) as e:
+                raise Error('Cannot read %s: %s' % (
+                    options['subset_frequency'], e))
+        if options['precompress'] is None:
+            precompress = None
+        else:
+            precompress = parse_encodings(','.join(options['precompress']))
+        families = [Family(job.record['family'], job.record['input_files'])]
+        conversion_options = ConversionOptions(
+            parse_output_formats(options['formats']), options['css'],
+            options['preload'], options['prefix'], None,
+            options['font_display'], options['inline_under'], threads, cache,
+            options['incremental'], parse_engines(options['engines']), None,
+            subsets, subset_frequency, precompress, options['hash_names'],
+            options['asset_manifest'])
+        for family, error in convert_families(families,
+                job.record['output_dir'], conversion_options, 1,
+                logger.level, cancelled):
+            return error
+    except Error as e:
+        return str(e)
+
+def run_worker(spool, logger, threads=1, cache=None,
+        stale_after=DEFAULT_STALE_AFTER, poll_interval=DEFAULT_POLL_INTERVAL,
+        exit_when_idle=False):
+    """Claim and convert jobs from a spool until interrupted, or, if
+    `exit_when_idle` is set, until there are none left. Up to `threads`
+    conversions of a family run at the same time. While a job is being
+    converted, its claim is kept fresh several times per `stale_after`
+    seconds. If the claim is lost anyway, the job is left to the worker which
+    claims it next, and this worker stops writing its outputs."""
+    worker = worker_id()
+    while True:
+        spool.recover_stale_claims(stale_after, logger)
+        job = spool.claim()
+        if job is None:
+            if exit_when_idle:
+                return
+            time.sleep(poll_interval)
+            continue
+        logger.info('converting %s (%s)' % (job.id, job.record['family']))
+        started = time.time()
+        stop = threading.Event()
+        lost = threading.Event()
+        def keep_claim_fresh():
+            while not stop.wait(stale_after / 4):
+                if not spool.heartbeat(job):
+                    logger.warning('lost the claim of %s' % job.id)
+                    # Leave the outputs to the next worker, rather than
+                    # overwriting them while it writes them
+                    lost.set()
+                    return
+        heartbeat_thread = threading.Thread(target=keep_claim_fresh,
+            daemon=True)
+        heartbeat_thread.start()
+        error = finished = None
+        try:
+            error = _convert_job(job, threads, cache, logger, lost)
+            finished = True
+        finally:
+            stop.set()
+            heartbeat_thread.join()
+            if not finished:
+                # Let another worker have it
+                spool.release(job)
+        if error is not None and not lost.is_set():
+            logger.warning('%s: %s' % (job.record['family'], error))
+        if not spool.finish(job, error, worker, started):
+            logger.warning('not recording the outcome of %s, whose claim '
+                'was lost' % job.id)
+        if cache is not None:
+            cache.prune_if_full()
+
+def wait_for_batch(spool, batch_id, poll_interval=DEFAULT_POLL_INTERVAL,
+        timeout=None):
+    """Wait until every job of a batch has finished, and return a (family
+    name, error message) pair for each, where the error message is None if
+    the family was converted successfully. Raise Error if `timeout` seconds
+    pass first."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        results = spool.batch_results(batch_id)
+        num_waiting = sum(1 for family, outcome in results if outcome is None)
+        if not num_waiting:
+            return [(family, outcome['error']) for family, outcome in results]
+        if deadline is not None and time.monotonic() >= deadline:
+            raise Error('%d of %d font families of batch %s have not been '
+                'converted' % (num_waiting, len(results), batch_id))
+        time.sleep(poll_interval)
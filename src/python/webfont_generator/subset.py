@@ -0,0 +1,208 @@
+"""Splitting fonts into shards which cover different ranges of Unicode, so
+that browsers download only the shards which a page uses. Requires the
+fontTools package."""
+
+import io
+import os
+import os.path
+import collections
+
+from .error import Error
+from .operations import FontFile, ensure_file_directory_exists
+
+# Formats which fontTools can subset, in order of preference
+SUBSETTABLE_FORMATS = ['ttf', 'otf', 'woff', 'woff2']
+
+DEFAULT_CJK_CHUNK_SIZE = 1000
+
+# Named shards, after the ranges used by Google Fonts
+NAMED_RANGES = collections.OrderedDict([
+    ('latin', 'U+0000-00FF,U+0131,U+0152-0153,U+02BB-02BC,U+02C6,U+02DA,'
+        'U+02DC,U+0304,U+0308,U+0329,U+2000-206F,U+2074,U+20AC,U+2122,'
+        'U+2191,U+2193,U+2212,U+2215,U+FEFF,U+FFFD'),
+    ('latin-ext', 'U+0100-02AF,U+0304,U+0308,U+0329,U+1E00-1E9F,'
+        'U+1EF2-1EFF,U+2020,U+20A0-20AB,U+20AD-20C0,U+2113,U+2C60-2C7F,'
+        'U+A720-A7FF'),
+    ('cyrillic', 'U+0301,U+0400-045F,U+0490-0491,U+04B0-04B1,U+2116'),
+    ('cyrillic-ext', 'U+0460-052F,U+1C80-1C88,U+20B4,U+2DE0-2DFF,'
+        'U+A640-A69F,U+FE2E-FE2F'),
+    ('greek', 'U+0370-0377,U+037A-037F,U+0384-038A,U+038C,U+038E-03A1,'
+        'U+03A3-03FF'),
+    ('greek-ext', 'U+1F00-1FFF'),
+    ('vietnamese', 'U+0102-0103,U+0110-0111,U+0128-0129,U+0168-0169,'
+        'U+01A0-01A1,U+01AF-01B0,U+0300-0301,U+0303-0304,U+0308-0309,'
+        'U+0323,U+0329,U+1EA0-1EF9,U+20AB')
+])
+
+# Blocks used by Chinese, Japanese and Korean text, which the `cjk` shard
+# splits into chunks
+CJK_RANGES = ('U+2E80-2FDF,U+3000-31FF,U+3400-4DBF,U+4E00-9FFF,U+AC00-D7AF,'
+    'U+F900-FAFF,U+FF00-FFEF,U+20000-2FA1F')
+
+Shard = collections.namedtuple('Shard', ['name', 'code_points'])
+
+def parse_unicode_range(range_str):
+    """Parse a comma-separated list of code points and ranges of code
+    points in the syntax of the CSS `unicode-range` descriptor, such as
+    `U+0000-00FF,U+0131`. Return a set of code points."""
+    code_points = set()
+    for part in range_str.split(','):
+        part = part.strip()
+        if not part.upper().startswith('U+'):
+            raise Error('Invalid Unicode range: %r' % part)
+        first, _, last = part[2:].partition('-')
+        try:
+            first = int(first, 16)
+            last = int(last, 16) if last else first
+        except ValueError:
+            raise Error('Invalid Unicode range: %r' % part)
+        if last < first:
+            raise Error('Invalid Unicode range: %r' % part)
+        code_points.update(range(first, last + 1))
+    return code_points
+
+def format_unicode_range(code_points):
+    """Format a set of code points as the value of a CSS `unicode-range`
+    descriptor, merging consecutive code points into ranges."""
+    ranges = []
+    for c in sorted(code_points):
+        if ranges and ranges[-1][1] == c - 1:
+            ranges[-1][1] = c
+        else:
+            ranges.append([c, c])
+    return ', '.join(
+        'U+%X' % first if first == last else 'U+%X-%X' % (first, last)
+        for first, last in ranges)
+
+def parse_subsets(subset_strs):
+    """Parse the values of the --subset option. Each is either a
+    comma-separated list of shard names, or a custom shard in the form
+    `<name>=<unicode range>`. Return a list of shard specifications, as
+    (name, code points, CJK chunk size) triples."""
+    specs = []
+    for subset_str in subset_strs:
+        name, equals, range_str = subset_str.partition('=')
+        if equals:
+            specs.append((name, parse_unicode_range(range_str), None))
+            continue
+        for name in subset_str.split(','):
+            name, colon, chunk_size_str = name.partition(':')
+            if name == 'cjk':
+                try:
+                    chunk_size = int(chunk_size_str) if colon else DEFAULT_CJK_CHUNK_SIZE
+                except ValueError:
+                    chunk_size = 0
+                if chunk_size < 1:
+                    raise Error('Invalid CJK chunk size: %r' % chunk_size_str)
+                specs.append((name, parse_unicode_range(CJK_RANGES), chunk_size))
+            elif name == 'other':
+                specs.append((name, None, None))
+            elif name in NAMED_RANGES and not colon:
+                specs.append((name, parse_unicode_range(NAMED_RANGES[name]), None))
+            else:
+                raise Error('Unrecognized subset: %r' % name)
+    names = [name for name, code_points, chunk_size in specs]
+    if len(set(names)) != len(names):
+        raise Error('Subsets must have different names')
+    return specs
+
+def read_frequency_file(file_name):
+    """Read a text file listing characters from most to least frequently
+    used. Return the code points in that order."""
+    with open(file_name, encoding='utf-8') as fin:
+        text = fin.read()
+    return list(collections.OrderedDict.fromkeys(
+        ord(c) for c in text if not c.isspace()))
+
+def subset_source(input_files):
+    """Choose the input file from which shards are cut."""
+    input_files_dict = { f.format : f for f in input_files }
+    for f in SUBSETTABLE_FORMATS:
+        if f in input_files_dict:
+            return input_files_dict[f]
+    raise Error('subsetting requires a %s input file' % ', '.join(SUBSETTABLE_FORMATS))
+
+def _fonttools():
+    # fontTools is an optional dependency, needed only for subsetting
+    try:
+        from fontTools import ttLib, subset
+    except ImportError:
+        raise Error('subsetting requires the fontTools package')
+    return ttLib, subset
+
+def plan_shards(input_file, specs, frequency_order=()):
+    """Decide which of the code points covered by a font go in which shard.
+    Shards which would be empty are left out. The `other` shard gets every
+    code point which no shard before it covers, and the `cjk` shard splits
+    the CJK code points which no shard before it covers into chunks, most
+    frequently used first according to `frequency_order`."""
+    ttLib, subset = _fonttools()
+    try:
+        font = ttLib.TTFont(input_file.full_path, lazy=True)
+    except Exception as e:
+        raise Error('cannot read %s: %s' % (input_file.full_path, e))
+    with font:
+        font_code_points = set(font.getBestCmap() or ())
+    shards = []
+    covered = set()
+    for name, code_points, chunk_size in specs:
+        if code_points is None:
+            shard_code_points = font_code_points - covered
+        elif chunk_size is None:
+            shard_code_points = font_code_points & code_points
+        else:
+            remaining = (font_code_points & code_points) - covered
+            ordered = [c for c in frequency_order if c in remaining]
+            ordered.extend(sorted(remaining.difference(ordered)))
+            for i in range(0, len(ordered), chunk_size):
+                shards.append(Shard('%s-%d' % (name, i // chunk_size),
+                    frozenset(ordered[i:i + chunk_size])))
+            covered.update(remaining)
+            continue
+        if shard_code_points:
+            shards.append(Shard(name, frozenset(shard_code_points)))
+            covered.update(shard_code_points)
+    if not shards:
+        raise Error('%s has no characters in the requested subsets' % input_file.full_path)
+    return shards
+
+def write_shard(input_file, shard, output_dir):
+    """Cut a shard out of a font, and save it as a ttf or otf file in the
+    output directory. Return the new file. The file is left alone if it
+    already has the same contents, so that incremental builds do not
+    convert it again."""
+    ttLib, subset = _fonttools()
+    options = subset.Options()
+    options.name_IDs = ['*']
+    options.name_languages = ['*']
+    options.notdef_outline = True
+    try:
+        font = subset.load_font(input_file.full_path, options)
+        with font:
+            format = 'otf' if 'CFF ' in font or 'CFF2' in font else 'ttf'
+            subsetter = subset.Subsetter(options)
+            subsetter.populate(unicodes=shard.code_points)
+            subsetter.subset(font)
+            fout = io.BytesIO()
+            subset.save_font(font, fout, options)
+    except Exception as e:
+        raise Error('subsetting %s failed: %s' % (input_file.full_path, e))
+    data = fout.getvalue()
+    shard_file = _shard_file(input_file, shard, output_dir, format)
+    try:
+        with open(shard_file.full_path, 'rb') as fin:
+            unchanged = fin.read() == data
+    except OSError:
+        unchanged = False
+    if not unchanged:
+        ensure_file_directory_exists(shard_file.full_path)
+        temp_path = shard_file.full_path + '.tmp'
+        with open(temp_path, 'wb') as fout:
+            fout.write(data)
+        os.replace(temp_path, shard_file.full_path)
+    return shard_file
+
+def _shard_file(input_file, shard, output_dir, format):
+    path_without_ext = os.path.join(output_dir, '%s-%s' % (
+        os.path.basename(input_file.path_without_extension), shard.name))
+    return FontFile(path_without_ext + os.extsep + format, path_without_ext, format)
@@ -1,3 +1,5 @@
+from .error import Error
+
 def indent(s, tab):
     return '\n'.join(tab + line for line in s.split('\n'))
 
@@ -6,3 +8,24 @@ def remove_suffix(s, suffix):
     if was_there:
         s = s[:-len(suffix)]
     return s, was_there
+
+SIZE_SUFFIXES = { 'K' : 1024, 'M' : 1024 ** 2, 'G' : 1024 ** 3 }
+
+def parse_size(s):
+    """Parse a number of bytes, optionally suffixed with K, M or G."""
+    multiplier = SIZE_SUFFIXES.get(s[-1:].upper())
+    if multiplier is not None:
+        s = s[:-1]
+    else:
+        multiplier = 1
+    return int(s) * multiplier
+
+def parse_count(count_str, what):
+    """Parse a positive number of things, as given on the command line."""
+    try:
+        count = int(count_str)
+    except ValueError:
+        count = 0
+    if count < 1:
+        raise Error('Invalid number of %s: %r' % (what, count_str))
+    return count
@@ -0,0 +1,200 @@
+"""Watching files for changes, with inotify where it is available and by
+polling elsewhere."""
+
+import os
+import os.path
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+DEFAULT_DEBOUNCE = 0.2
+POLL_INTERVAL = 0.5
+
+# From <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# Editors often save by writing a new file and renaming it over the old one,
+# so watch the directories containing the files rather than the files
+_INOTIFY_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+    IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+def _signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_size, st.st_mtime_ns, st.st_ino)
+
+class PollingWatcher(object):
+    """Detects changes to files by checking their sizes and modification
+    times periodically."""
+
+    def __init__(self, paths):
+        self.set_paths(paths)
+
+    def set_paths(self, paths):
+        self._signatures = {
+            os.path.abspath(p) : _signature(p) for p in paths }
+
+    def wait(self, timeout=None):
+        """Wait until some of the files change, or until `timeout` seconds
+        have passed. Return the set of files which changed."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if deadline is None:
+                delay = POLL_INTERVAL
+            else:
+                delay = min(POLL_INTERVAL, max(deadline - time.monotonic(), 0))
+            time.sleep(delay)
+            changed = set()
+            for path, old_signature in self._signatures.items():
+                new_signature = _signature(path)
+                if new_signature != old_signature:
+                    self._signatures[path] = new_signature
+                    changed.add(path)
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+    def close(self):
+        pass
+
+class InotifyWatcher(object):
+    """Detects changes to files with Linux's inotify API, called through
+    ctypes. Raises OSError if inotify is unavailable."""
+
+    def __init__(self, paths):
+        libc_name = ctypes.util.find_library('c')
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        try:
+            self._add_watch = libc.inotify_add_watch
+            self._rm_watch = libc.inotify_rm_watch
+            init = libc.inotify_init1
+        except AttributeError:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self._fd = init(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        self._dirs = {}
+        self._paths = set()
+        self.set_paths(paths)
+
+    def set_paths(self, paths):
+        self._paths = set(os.path.abspath(p) for p in paths)
+        dirs = set(os.path.dirname(p) for p in self._paths)
+        for wd, d in list(self._dirs.items()):
+            if d not in dirs:
+                self._rm_watch(self._fd, wd)
+                del self._dirs[wd]
+        self._watch_dirs()
+
+    def _unwatched_dirs(self):
+        return set(os.path.dirname(p) for p in self._paths) - \
+            set(self._dirs.values())
+
+    def _watch_dirs(self):
+        # Watch the directories which are not watched yet, and return the
+        # files in those which could be watched. Directories which do not
+        # exist, such as one which was removed to be created again, are
+        # tried again by wait.
+        added = set()
+        for d in self._unwatched_dirs():
+            wd = self._add_watch(self._fd, os.fsencode(d), _INOTIFY_MASK)
+            if wd < 0:
+                e = ctypes.get_errno()
+                if e == errno.ENOENT:
+                    continue
+                raise OSError(e, '%s: %s' % (d, os.strerror(e)))
+            self._dirs[wd] = d
+            added.add(d)
+        return set(p for p in self._paths if os.path.dirname(p) in added)
+
+    def wait(self, timeout=None):
+        """Wait until some of the files change, or until `timeout` seconds
+        have passed. Return the set of files which changed."""
+        if self._unwatched_dirs():
+            # Look for missing directories every so often
+            timeout = POLL_INTERVAL if timeout is None else min(timeout,
+                POLL_INTERVAL)
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        # Files in a directory which was created again have changed
+        changed = self._watch_dirs()
+        if not readable:
+            return changed
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            d = self._dirs.get(wd)
+            if d is None:
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                # The directory itself went away; report all of its files,
+                # and drop its watch so that the directory is watched again
+                # if it comes back
+                changed.update(p for p in self._paths if os.path.dirname(p) == d)
+                if not mask & IN_IGNORED:
+                    # A moved directory is still watched under its new name
+                    self._rm_watch(self._fd, wd)
+                del self._dirs[wd]
+                continue
+            path = os.path.join(d, os.fsdecode(name))
+            if path in self._paths:
+                changed.add(path)
+        # Watch a directory which came back right away
+        changed.update(self._watch_dirs())
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+def make_watcher(paths, logger):
+    """Watch a list of files, using inotify if possible."""
+    try:
+        return InotifyWatcher(paths)
+    except OSError as e:
+        logger.info('cannot use inotify (%s), polling for changes instead' % e)
+        return PollingWatcher(paths)
+
+def watch(watcher, on_change, debounce=DEFAULT_DEBOUNCE):
+    """Call `on_change` with the set of files which changed whenever any
+    of the watched files change. A burst of changes which are no more than
+    `debounce` seconds apart results in a single call. If `on_change`
+    returns a list of files, those files are watched from then on. Runs
+    until interrupted."""
+    while True:
+        changed = watcher.wait()
+        if not changed:
+            continue
+        # Wait for the burst of writes to end
+        while True:
+            more = watcher.wait(debounce)
+            if not more:
+                break
+            changed.update(more)
+        new_paths = on_change(changed)
+        if new_paths is not None:
+            watcher.set_paths(new_paths)
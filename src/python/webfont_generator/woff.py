@@ -0,0 +1,156 @@
+"""A WOFF 1.0 encoder and decoder.
+
+A WOFF file is an sfnt (ttf or otf) font whose tables have been compressed
+individually with zlib, so no font library is needed to convert between the
+two. See https://www.w3.org/TR/WOFF/."""
+
+import zlib
+import struct
+import threading
+import concurrent.futures
+
+from .error import Error
+
+SFNT_HEADER = struct.Struct('>4sHHHH')
+SFNT_TABLE_ENTRY = struct.Struct('>4sIII')
+WOFF_HEADER = struct.Struct('>4s4sIHHIHHIIIII')
+WOFF_TABLE_ENTRY = struct.Struct('>4sIIII')
+
+WOFF_SIGNATURE = b'wOFF'
+SFNT_FLAVORS = {
+    b'\x00\x01\x00\x00' : 'ttf',
+    b'true' : 'ttf',
+    b'OTTO' : 'otf'
+}
+
+# Tables smaller than this are not worth handing to another thread
+_MIN_PARALLEL_TABLE_SIZE = 4096
+
+def _padded(length):
+    return (length + 3) & ~3
+
+def _padding(length):
+    return b'\0' * (_padded(length) - length)
+
+def _read_sfnt_tables(data):
+    """Return the flavor of an sfnt font and a list of its tables, as
+    (tag, checksum, data) triples."""
+    if len(data) < SFNT_HEADER.size:
+        raise Error('not an sfnt font: file is too short')
+    flavor, num_tables, search_range, entry_selector, range_shift = \
+        SFNT_HEADER.unpack_from(data)
+    if flavor not in SFNT_FLAVORS:
+        raise Error('not an sfnt font: unknown flavor %r' % flavor)
+    tables = []
+    for i in range(num_tables):
+        offset = SFNT_HEADER.size + i * SFNT_TABLE_ENTRY.size
+        if offset + SFNT_TABLE_ENTRY.size > len(data):
+            raise Error('sfnt table directory is truncated')
+        tag, checksum, table_offset, length = \
+            SFNT_TABLE_ENTRY.unpack_from(data, offset)
+        if table_offset + length > len(data):
+            raise Error('sfnt table %r extends past the end of the file' % tag)
+        tables.append((tag, checksum, data[table_offset:table_offset + length]))
+    return flavor, tables
+
+def _compress_table(table_data):
+    compressed = zlib.compress(table_data, 9)
+    # Tables which do not shrink are stored uncompressed
+    if len(compressed) < len(table_data):
+        return compressed
+    return table_data
+
+def encode(data, executor=None):
+    """Convert an sfnt font to WOFF. Tables are compressed concurrently on
+    `executor` if one is given; zlib releases the GIL while compressing."""
+    data = memoryview(data).cast('B')
+    flavor, tables = _read_sfnt_tables(data)
+    tables.sort(key=lambda t: t[0])
+    table_datas = [bytes(t[2]) for t in tables]
+    if executor is None:
+        compressed = [_compress_table(d) for d in table_datas]
+    else:
+        futures = [
+            executor.submit(_compress_table, d)
+            if len(d) >= _MIN_PARALLEL_TABLE_SIZE else None
+            for d in table_datas ]
+        compressed = [
+            _compress_table(d) if future is None else future.result()
+            for d, future in zip(table_datas, futures) ]
+    # Lay out the tables after the header and table directory
+    offset = WOFF_HEADER.size + len(tables) * WOFF_TABLE_ENTRY.size
+    directory = []
+    body = []
+    total_sfnt_size = SFNT_HEADER.size + len(tables) * SFNT_TABLE_ENTRY.size
+    for (tag, checksum, table_data), comp_data in zip(tables, compressed):
+        directory.append(WOFF_TABLE_ENTRY.pack(
+            tag, offset, len(comp_data), len(table_data), checksum))
+        body.append(comp_data)
+        body.append(_padding(len(comp_data)))
+        offset += _padded(len(comp_data))
+        total_sfnt_size += _padded(len(table_data))
+    header = WOFF_HEADER.pack(WOFF_SIGNATURE, flavor, offset, len(tables),
+        0, total_sfnt_size, 0, 0, 0, 0, 0, 0, 0)
+    return b''.join([header] + directory + body)
+
+def decode(data):
+    """Convert a WOFF font to an sfnt font. Return the font and its format,
+    either ttf or otf."""
+    data = memoryview(data).cast('B')
+    if len(data) < WOFF_HEADER.size:
+        raise Error('not a WOFF font: file is too short')
+    (signature, flavor, length, num_tables, reserved, total_sfnt_size,
+        major_version, minor_version, meta_offset, meta_length,
+        meta_orig_length, priv_offset, priv_length) = \
+        WOFF_HEADER.unpack_from(data)
+    if signature != WOFF_SIGNATURE:
+        raise Error('not a WOFF font: bad signature %r' % signature)
+    format = SFNT_FLAVORS.get(flavor)
+    if format is None:
+        raise Error('WOFF font has unknown flavor %r' % flavor)
+    tables = []
+    for i in range(num_tables):
+        offset = WOFF_HEADER.size + i * WOFF_TABLE_ENTRY.size
+        if offset + WOFF_TABLE_ENTRY.size > len(data):
+            raise Error('WOFF table directory is truncated')
+        tag, table_offset, comp_length, orig_length, checksum = \
+            WOFF_TABLE_ENTRY.unpack_from(data, offset)
+        if table_offset + comp_length > len(data):
+            raise Error('WOFF table %r extends past the end of the file' % tag)
+        table_data = data[table_offset:table_offset + comp_length]
+        if comp_length < orig_length:
+            try:
+                table_data = zlib.decompress(table_data)
+            except zlib.error as e:
+                raise Error('WOFF table %r is corrupt: %s' % (tag, e))
+        if len(table_data) != orig_length:
+            raise Error('WOFF table %r has the wrong length' % tag)
+        tables.append((tag, checksum, table_data))
+    # Rebuild the sfnt header and table directory
+    entry_selector = max(num_tables, 1).bit_length() - 1
+    search_range = (1 << entry_selector) * 16
+    range_shift = num_tables * 16 - search_range
+    header = SFNT_HEADER.pack(
+        flavor, num_tables, search_range, entry_selector, range_shift)
+    offset = SFNT_HEADER.size + num_tables * SFNT_TABLE_ENTRY.size
+    directory = []
+    body = []
+    for tag, checksum, table_data in tables:
+        directory.append(SFNT_TABLE_ENTRY.pack(
+            tag, checksum, offset, len(table_data)))
+        body.append(table_data)
+        body.append(_padding(len(table_data)))
+        offset += _padded(len(table_data))
+    return b''.join([header] + directory + body), format
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def shared_executor():
+    """Return a thread pool for compressing tables, shared by every
+    conversion in this process."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor()
+        return _executor
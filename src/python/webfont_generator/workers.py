@@ -0,0 +1,386 @@
+import os
+import time
+import atexit
+import select
+import asyncio
+import tempfile
+import threading
+import contextlib
+import subprocess
+
+from .util import indent
+from .error import Error
+
+class WorkerCrashed(Error):
+    pass
+
+class WorkerTimedOut(Error):
+    pass
+
+class WorkerProcess(object):
+    """A long-running helper process which reads requests from its stdin and
+    writes one reply line per request line to its stdout. The process is
+    started lazily and restarted automatically if it dies. Requests from
+    multiple threads are serialized. If `timeout` is set, a process which
+    takes longer than that many seconds to start or to reply to a request is
+    taken to be hung, and is killed."""
+
+    timeout = None
+
+    def __init__(self, name, command):
+        self.name = name
+        self.command = command
+        self._process = None
+        self._stderr = None
+        self._buffer = b''
+        self._deadline = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        # Collect stderr in a file rather than a pipe, so that the process
+        # can never block on writing to it
+        self._stderr = tempfile.TemporaryFile()
+        try:
+            self._process = subprocess.Popen(self.command,
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                stderr=self._stderr, encoding='utf-8', bufsize=1)
+        except OSError as e:
+            self._stderr.close()
+            self._stderr = None
+            raise Error('unable to start %s: %s' % (self.name, e))
+        self._set_deadline()
+        self._wait_until_ready()
+
+    def _wait_until_ready(self):
+        """Hook for waiting until the process signals that it has started."""
+        pass
+
+    def _set_deadline(self):
+        self._deadline = None if self.timeout is None else \
+            time.monotonic() + self.timeout
+
+    def _read_reply(self):
+        # Read from the pipe directly rather than through the file object,
+        # whose buffer select cannot see
+        fd = self._process.stdout.fileno()
+        while b'\n' not in self._buffer:
+            if self._deadline is None:
+                remaining = None
+            else:
+                remaining = self._deadline - time.monotonic()
+                if remaining <= 0:
+                    err = self.output()
+                    self._process.kill()
+                    self._discard()
+                    raise WorkerTimedOut(
+                        '%s did not reply within %d seconds, so it was '
+                        'killed:\n'
+                        'Output from %s:\n'
+                        '%s' % (self.name, self.timeout, self.name,
+                            indent(err, '  ')))
+            readable, _, _ = select.select([fd], [], [], remaining)
+            if not readable:
+                continue
+            chunk = os.read(fd, 64 * 1024)
+            if not chunk:
+                err = self.output()
+                self._discard()
+                raise WorkerCrashed(
+                    '%s exited unexpectedly:\n'
+                    'Output from %s:\n'
+                    '%s' % (self.name, self.name, indent(err, '  ')))
+            self._buffer += chunk
+        line, _, self._buffer = self._buffer.partition(b'\n')
+        return line.decode('utf-8', 'replace')
+
+    def output(self):
+        """Return what the process has written to stderr since the start of
+        the current request."""
+        fd = self._stderr.fileno()
+        return os.pread(fd, os.fstat(fd).st_size, 0).decode('utf-8', 'replace')
+
+    def start(self):
+        """Start the process now rather than on the first request."""
+        with self._lock:
+            if self._process is None:
+                self._start()
+
+    def request(self, lines):
+        """Send a list of request lines and return the list of reply lines,
+        along with what the process wrote to stderr meanwhile. Raise
+        WorkerCrashed if the process dies before replying, or WorkerTimedOut
+        if it takes too long and is killed; the next request will start a
+        fresh process."""
+        with self._lock:
+            if self._process is not None and self._process.poll() is not None:
+                # It died since the last request, so there is no request to
+                # blame it on
+                self._discard()
+            if self._process is None:
+                self._start()
+            else:
+                # The process is idle, so it is safe to discard the output
+                # from previous requests
+                fd = self._stderr.fileno()
+                os.ftruncate(fd, 0)
+                os.lseek(fd, 0, os.SEEK_SET)
+            self._set_deadline()
+            try:
+                for line in lines:
+                    self._process.stdin.write(line + '\n')
+                self._process.stdin.flush()
+            except BrokenPipeError:
+                # Report the crash when reading the reply
+                pass
+            replies = [self._read_reply() for line in lines]
+            return replies, self.output()
+
+    def _discard(self):
+        for f in (self._process.stdin, self._process.stdout):
+            try:
+                f.close()
+            except OSError:
+                pass
+        self._process.wait()
+        self._stderr.close()
+        self._process = self._stderr = None
+        self._buffer = b''
+
+    @property
+    def pid(self):
+        """The process ID of the running process, or None."""
+        process = self._process
+        return None if process is None else process.pid
+
+    def close(self):
+        with self._lock:
+            if self._process is not None:
+                self._discard()
+
+class AsyncWorkerProcess(object):
+    """The counterpart of WorkerProcess for use from an asyncio event loop.
+    Requests are serialized by an asyncio lock instead of a thread lock. If
+    a request is cancelled, or takes longer than `timeout` seconds, the
+    process is killed, since it may be left in the middle of a request; the
+    next request starts a fresh process."""
+
+    timeout = None
+
+    def __init__(self, name, command):
+        self.name = name
+        self.command = command
+        self._process = None
+        self._stderr = None
+        self._lock = asyncio.Lock()
+
+    async def _start(self):
+        # Collect stderr in a file rather than a pipe, so that the process
+        # can never block on writing to it
+        self._stderr = tempfile.TemporaryFile()
+        try:
+            self._process = await asyncio.create_subprocess_exec(
+                *self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                stderr=self._stderr)
+        except OSError as e:
+            self._stderr.close()
+            self._stderr = None
+            raise Error('unable to start %s: %s' % (self.name, e))
+        await self._wait_until_ready()
+
+    async def _wait_until_ready(self):
+        """Hook for waiting until the process signals that it has started."""
+        pass
+
+    async def _read_reply(self):
+        line = await self._process.stdout.readline()
+        if not line:
+            err = self.output()
+            await self._discard()
+            raise WorkerCrashed(
+                '%s exited unexpectedly:\n'
+                'Output from %s:\n'
+                '%s' % (self.name, self.name, indent(err, '  ')))
+        return line.decode('utf-8').rstrip('\n')
+
+    def output(self):
+        """Return what the process has written to stderr since the start of
+        the current request."""
+        fd = self._stderr.fileno()
+        return os.pread(fd, os.fstat(fd).st_size, 0).decode('utf-8', 'replace')
+
+    async def request(self, lines):
+        """Send a list of request lines and return the list of reply lines,
+        along with what the process wrote to stderr meanwhile."""
+        async with self._lock:
+            if self._process is not None and self._process.returncode is not None:
+                await self._discard()
+            try:
+                replies = await asyncio.wait_for(self._exchange(lines),
+                    self.timeout)
+            except asyncio.TimeoutError:
+                err = '' if self._stderr is None else self.output()
+                await self._kill()
+                raise WorkerTimedOut(
+                    '%s did not reply within %d seconds, so it was killed:\n'
+                    'Output from %s:\n'
+                    '%s' % (self.name, self.timeout, self.name,
+                        indent(err, '  ')))
+            except asyncio.CancelledError:
+                await self._kill()
+                raise
+            return replies, self.output()
+
+    async def _exchange(self, lines):
+        if self._process is None:
+            await self._start()
+        else:
+            fd = self._stderr.fileno()
+            os.ftruncate(fd, 0)
+            os.lseek(fd, 0, os.SEEK_SET)
+        try:
+            self._process.stdin.write(
+                ''.join(line + '\n' for line in lines).encode('utf-8'))
+            await self._process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # Report the crash when reading the reply
+            pass
+        return [await self._read_reply() for line in lines]
+
+    async def _kill(self):
+        if self._process is None:
+            # It was cancelled while starting
+            if self._stderr is not None:
+                self._stderr.close()
+                self._stderr = None
+            return
+        try:
+            self._process.kill()
+        except ProcessLookupError:
+            pass
+        await self._discard()
+
+    async def _discard(self):
+        self._process.stdin.close()
+        await self._process.wait()
+        self._stderr.close()
+        self._process = self._stderr = None
+
+    @property
+    def pid(self):
+        """The process ID of the running process, or None."""
+        process = self._process
+        return None if process is None else process.pid
+
+    async def close(self):
+        async with self._lock:
+            if self._process is not None:
+                await self._discard()
+
+class WorkerPool(object):
+    """A set of interchangeable workers of one class. Each caller gets an
+    idle worker, or a new one while there are fewer than `size` workers, and
+    otherwise waits until a worker becomes idle."""
+
+    def __init__(self, worker_class, size=1):
+        self.worker_class = worker_class
+        self.size = size
+        self._workers = []
+        self._idle = []
+        self._condition = threading.Condition()
+
+    def resize(self, size):
+        """Allow up to `size` workers. Surplus idle workers are closed."""
+        with self._condition:
+            self.size = size
+            surplus = []
+            while len(self._workers) > size and self._idle:
+                worker = self._idle.pop()
+                self._workers.remove(worker)
+                surplus.append(worker)
+            self._condition.notify_all()
+        for worker in surplus:
+            worker.close()
+
+    def start(self):
+        """Start every worker now, so that the first requests do not have to
+        wait for them to start."""
+        with self._condition:
+            while len(self._workers) < self.size:
+                worker = self.worker_class()
+                self._workers.append(worker)
+                self._idle.append(worker)
+            workers = list(self._workers)
+        for worker in workers:
+            worker.start()
+
+    @contextlib.contextmanager
+    def worker(self):
+        """Borrow a worker for the duration of the block."""
+        with self._condition:
+            while not self._idle and len(self._workers) >= self.size:
+                self._condition.wait()
+            if self._idle:
+                worker = self._idle.pop()
+            else:
+                worker = self.worker_class()
+                self._workers.append(worker)
+        try:
+            yield worker
+        finally:
+            with self._condition:
+                self._idle.append(worker)
+                self._condition.notify()
+
+    def busy_count(self):
+        """Return the number of workers which are lent out."""
+        with self._condition:
+            return len(self._workers) - len(self._idle)
+
+    def pids(self):
+        with self._condition:
+            workers = list(self._workers)
+        return [w.pid for w in workers if w.pid is not None]
+
+    def close(self):
+        with self._condition:
+            workers = list(self._workers)
+        for worker in workers:
+            worker.close()
+
+_pools = {}
+_pool_sizes = {}
+_pools_lock = threading.Lock()
+
+def shared_pool(worker_class):
+    """Return the pool of workers of the given class shared by everything in
+    this process, creating it if necessary. The pool has one worker unless
+    set_shared_pool_size says otherwise."""
+    with _pools_lock:
+        # Workers inherited across a fork belong to the parent process
+        key = (worker_class, os.getpid())
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = WorkerPool(
+                worker_class, _pool_sizes.get(worker_class, 1))
+        return pool
+
+def set_shared_pool_size(worker_class, size):
+    with _pools_lock:
+        _pool_sizes[worker_class] = size
+    shared_pool(worker_class).resize(size)
+
+def shared_worker_pids():
+    """Return the process IDs of the running shared workers."""
+    with _pools_lock:
+        pools = [
+            pool for (worker_class, pid), pool in _pools.items()
+            if pid == os.getpid() ]
+    return [pid for pool in pools for pid in pool.pids()]
+
+@atexit.register
+def close_workers():
+    with _pools_lock:
+        for (worker_class, pid), pool in list(_pools.items()):
+            if pid == os.getpid():
+                pool.close()
+            del _pools[worker_class, pid]